@@ -0,0 +1,62 @@
+from jose import JWTError, jwt
+from typing import Optional
+import hashlib
+import os
+import time
+
+from shared.response_cache import ResponseCache
+
+# Same key and algorithm user-service signs its access tokens with
+SECRET_KEY = os.getenv("SECRET_KEY", "mysecretkey")
+ALGORITHM = "HS256"
+
+# When true every non public route needs a valid bearer token,
+# otherwise tokens are verified only when the client sends one
+GATEWAY_REQUIRE_AUTH = os.getenv("GATEWAY_REQUIRE_AUTH", "false").lower() == "true"
+PUBLIC_PATHS = {"/", "/api-health", "/metrics"}
+
+class InvalidToken(Exception):
+    """Raised when a bearer token is malformed, badly signed or expired."""
+    pass
+
+
+class TokenVerifier:
+    """Verify JWTs locally, caching decoded claims until the token expires.
+
+    Tokens are keyed by their sha256 so the raw token is never kept, and an
+    entry never outlives the token's own `exp`. A cache hit is one hash plus
+    a dict lookup, no signature check and no call to user-service.
+    """
+
+    def __init__(self, max_entries: int):
+        self.cache = ResponseCache(ttl=0, max_entries=max_entries)
+        self.failures = 0
+
+    def verify(self, token: str) -> dict:
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        claims = self.cache.get(key)
+        if claims is not None:
+            return claims
+
+        try:
+            claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError as e:
+            self.failures += 1
+            raise InvalidToken(str(e))
+
+        expires_in = claims.get("exp", 0) - time.time()
+        if expires_in > 0:
+            self.cache.set(key, claims, ttl=expires_in)
+        return claims
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "failures": self.failures}
+
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return token.strip()
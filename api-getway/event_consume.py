@@ -0,0 +1,49 @@
+import os
+import logging
+from shared.kafka_client import KafkaConsumer
+from shared.kafka_events import EventType
+
+from shared.response_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+
+def invalidate_product_cache(product_cache: ResponseCache, event: dict):
+    """Drop cached product listings affected by a product event"""
+    event_type = event.get("event_type")
+    product_id = event.get("data", {}).get("product_id")
+
+    # A stock change can't move a product in or out of a listing,
+    # so only the pages that already contain it are stale
+    if event_type == EventType.PRODUCT_STOCK_UPDATED and product_id is not None:
+        dropped = product_cache.invalidate_tag(product_id)
+    else:
+        # New, edited or deleted products can change any listing page
+        dropped = product_cache.clear()
+    logger.debug(f"{event_type} for product {product_id} dropped {dropped} cached listings")
+
+
+async def start_kafka_consumer(product_cache: ResponseCache):
+    """Start kafka consumer for the gateway caches"""
+    # No group id: every gateway replica must see every invalidation
+    consumer = KafkaConsumer(
+        bootstrap_servers=os.getenv("KAFKA_BROKER", "localhost:9092"),
+        group_id=None
+    )
+
+    product_events = {
+        EventType.PRODUCT_CREATED.value,
+        EventType.PRODUCT_UPDATED.value,
+        EventType.PRODUCT_STOCK_UPDATED.value,
+        EventType.PRODUCT_DELETED.value,
+    }
+
+    async def message_handler(message: dict):
+        if message.get("event_type") in product_events:
+            invalidate_product_cache(product_cache, message)
+
+    try:
+        await consumer.consumer(["products"], message_handler)
+    except Exception as e:
+        # Entries still expire by TTL while kafka is unavailable
+        logger.error(f"Gateway cache consumer stopped: {e}")
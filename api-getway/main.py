@@ -1,10 +1,16 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Depends
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import asyncio
 import httpx
 import json
 import os
 
-
-app = FastAPI(title="API Getway", description="API Getway for AI Powered E-commerce")
+from upstream import UpstreamClients
+from shared.response_cache import ResponseCache, normalize_key
+from single_flight import SingleFlight, SingleFlightOverflow
+from auth import TokenVerifier, InvalidToken, bearer_token, GATEWAY_REQUIRE_AUTH, PUBLIC_PATHS
+import event_consume
 
 # USER_SERVICE_URL = "http://localhost:8001"
 # PRODUCT_SERVICE_URL = "http://localhost:8002"
@@ -20,6 +26,59 @@ PRODUCT_SERVICE_URL = os.getenv("PRODUCT_SERVICE_URL_DOCKER", "http://localhost:
 ORDER_SERVICE_URL = os.getenv("ORDER_SERVICE_URL_DOCKER", "http://localhost:8003")
 # =========================================================================
 
+# One keep-alive connection pool per downstream service, shared by every request
+upstream = UpstreamClients({
+    "user": USER_SERVICE_URL,
+    "product": PRODUCT_SERVICE_URL,
+    "order": ORDER_SERVICE_URL,
+})
+
+# Catalog listings are our highest volume read, cache them at the gateway.
+# Entries expire by TTL and are dropped early by product events from kafka.
+product_cache = ResponseCache(
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL", "30")),
+    max_entries=int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", "1024")),
+)
+PRODUCT_LIST_DEFAULTS = {"skip": 0, "limit": 100}
+
+# Identical concurrent GETs (same service + path) share one upstream call
+single_flight = SingleFlight(max_waiters=int(os.getenv("SINGLE_FLIGHT_MAX_WAITERS", "1000")))
+
+# JWTs are verified here with the shared key, decoded claims cached until exp
+token_verifier = TokenVerifier(max_entries=int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000")))
+
+
+async def authenticate(request: Request):
+    """Reject requests with an invalid bearer token, or without one when auth is required"""
+    token = bearer_token(request.headers.get("Authorization"))
+    if token is None:
+        if GATEWAY_REQUIRE_AUTH and request.url.path not in PUBLIC_PATHS:
+            raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+        return
+
+    try:
+        token_verifier.verify(token)
+    except InvalidToken:
+        raise HTTPException(status_code=401, detail="Invalid or expired token", headers={"WWW-Authenticate": "Bearer"})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    upstream.start()
+    # Start Kafka consumer in background for cache invalidation
+    consumer_task = asyncio.create_task(event_consume.start_kafka_consumer(product_cache))
+    yield
+    consumer_task.cancel()
+    await upstream.close()
+
+
+app = FastAPI(
+    title="API Getway",
+    description="API Getway for AI Powered E-commerce",
+    lifespan=lifespan,
+    dependencies=[Depends(authenticate)]
+)
+
 
 @app.get("/")
 def root():
@@ -29,6 +88,30 @@ def root():
 def api_health():
     return {"status": "ok", "message": "API getway is up & running"}
 
+@app.get("/metrics")
+def metrics():
+    return {
+        "upstream": upstream.stats(),
+        "product_cache": product_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "token_cache": token_verifier.stats(),
+    }
+
+
+async def coalesced_get(service: str, path: str, route: str, params: Optional[dict] = None) -> httpx.Response:
+    """Idempotent GET through the single-flight layer"""
+    params = {k: v for k, v in (params or {}).items() if v is not None}
+    key = (service, path, tuple(sorted(params.items())))
+    return await single_flight.do(key, lambda: upstream[service].get(path, route=route, params=params))
+
+
+def cache_product_list(key, response: httpx.Response):
+    """Cache a successful product listing, tagged with the product ids it contains"""
+    if response.status_code != 200:
+        return
+    products = response.json()
+    product_cache.set(key, products, tags=[p.get("id") for p in products if isinstance(p, dict)])
+
 
 # user get by Synchronous way
 @app.get("/sync/users/{user_id}")
@@ -39,17 +122,15 @@ def get_sync_user(user_id: int):
     # ============================#
     
     try:
-        # Use synchronous Client
-        with httpx.Client() as client:
-            # Use synchronous client.get() method (no 'await')
-            response = client.get(f"{USER_SERVICE_URL}/users/{user_id}")
+        # Use the shared synchronous Client (no 'await')
+        response = upstream["user"].sync_get(f"/users/{user_id}", route="users.get")
 
-            # Check for bad status codes (4xx or 5xx) from the downstream service
-            # If 404 is returned, this line RAISES httpx.HTTPStatusError
-            response.raise_for_status()
+        # Check for bad status codes (4xx or 5xx) from the downstream service
+        # If 404 is returned, this line RAISES httpx.HTTPStatusError
+        response.raise_for_status()
 
-            # Use response.json() to extract the data payload
-            return response.json()
+        # Use response.json() to extract the data payload
+        return response.json()
 
     except httpx.RequestError as e:
         # Handle connection errors (e.g., service is down or DNS resolution failure)
@@ -72,17 +153,15 @@ async def get_async_user(user_id: int):
     # ============================#
 
     try:
-        # Use Asynchronous Client
-        async with httpx.AsyncClient() as client:
-            # Use Asynchronous client.get() method (yes 'await')
-            response = await client.get(f"{USER_SERVICE_URL}/userss/{user_id}")
+        # Use the shared Asynchronous Client (yes 'await')
+        response = await coalesced_get("user", f"/users/{user_id}", route="users.get")
 
-            # Check for bad status codes (4xx or 5xx) from the downstream service
-            # If 404 is returned, this line RAISES httpx.HTTPStatusError
-            response.raise_for_status()
+        # Check for bad status codes (4xx or 5xx) from the downstream service
+        # If 404 is returned, this line RAISES httpx.HTTPStatusError
+        response.raise_for_status()
 
-            # Use response.json() to extract the data payload
-            return response.json()
+        # Use response.json() to extract the data payload
+        return response.json()
     except httpx.RequestError as e:
         # Handle connection errors (e.g., service is down or DNS resolution failure)
         print(f"Error for connection to User Service {e}")
@@ -93,16 +172,19 @@ async def get_async_user(user_id: int):
         print(f"User Service returned error: {e}")
         raise HTTPException(status_code=e.response.status_code, detail=f"User Service Error: {e.response.status_code}")
 
+    except SingleFlightOverflow:
+        # Too many callers already waiting on this exact request, shed the load
+        raise HTTPException(status_code=503, detail="User Service is busy, retry later")
+
 
 @app.get("/async/users/{user_id}/orders")
-async def get_user_order(user_id: str):
+async def get_user_order(user_id: str, cursor: Optional[str] = None, limit: Optional[int] = None):
     try:
-        # Use Asynchronous Client
-        async with httpx.AsyncClient() as client:
-            # Use Asynchronous client.get() method (no 'await')
-            response = await client.get(f"{ORDER_SERVICE_URL}/users/{user_id}/orders")
-            # Use response.json() to extract the data payload
-            return response.json()
+        # Use the shared Asynchronous Client, the order service pages by cursor
+        params = {"cursor": cursor, "limit": limit}
+        response = await coalesced_get("order", f"/users/{user_id}/orders", route="users.orders", params=params)
+        # Use response.json() to extract the data payload
+        return response.json()
     except httpx.RequestError as e:
         # Handle connection errors (e.g., service is down or DNS resolution failure)
         print(f"Error for connection to User Service {e}")
@@ -113,58 +195,166 @@ async def get_user_order(user_id: str):
         print(f"User Service returned error: {e}")
         raise HTTPException(status_code=e.response.status_code, detail=f"User Service Error: {e.response.status_code}")
 
+    except SingleFlightOverflow:
+        # Too many callers already waiting on this exact request, shed the load
+        raise HTTPException(status_code=503, detail="User Service is busy, retry later")
+
 
+# Product service accepts at most this many ids per batch lookup
+PRODUCT_BATCH_SIZE = 1000
+
+
+async def fetch_products_batch(product_ids: List[int]) -> dict:
+    """Resolve product ids with one batch lookup per PRODUCT_BATCH_SIZE ids"""
+    chunks = [product_ids[i:i + PRODUCT_BATCH_SIZE] for i in range(0, len(product_ids), PRODUCT_BATCH_SIZE)]
+    responses = await asyncio.gather(*[
+        upstream["product"].post("/products/batch", route="products.batch", json={"ids": chunk})
+        for chunk in chunks
+    ])
+    products, missing = {}, []
+    for response in responses:
+        response.raise_for_status()
+        payload = response.json()
+        products.update({product["id"]: product for product in payload["products"]})
+        missing.extend(payload["missing"])
+    return {"products": products, "missing": missing}
+
+
+def describe_error(e: Exception) -> str:
+    if isinstance(e, httpx.HTTPStatusError):
+        return f"status {e.response.status_code}"
+    if isinstance(e, SingleFlightOverflow):
+        return "busy"
+    return e.__class__.__name__
+
+
+# user profile + orders + ordered products in one round trip
+@app.get("/async/users/{user_id}/overview")
+async def get_user_overview(user_id: int):
+
+    async def fetch_user():
+        response = await coalesced_get("user", f"/users/{user_id}", route="users.get")
+        response.raise_for_status()
+        return response.json()
+
+    async def fetch_orders():
+        response = await coalesced_get("order", f"/users/{user_id}/orders", route="users.orders")
+        # Order service answers 404 when the user simply has no orders yet
+        if response.status_code == 404:
+            return {"orders": [], "next_cursor": None}
+        response.raise_for_status()
+        return response.json()
+
+    # User and orders don't depend on each other, fetch them concurrently
+    user, orders_page = await asyncio.gather(fetch_user(), fetch_orders(), return_exceptions=True)
+
+    if isinstance(user, httpx.HTTPStatusError) and user.response.status_code == 404:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    errors = {}
+    if isinstance(user, Exception):
+        print(f"Overview: user lookup failed {user}")
+        errors["user"] = describe_error(user)
+        user = None
+    orders, orders_cursor = [], None
+    if isinstance(orders_page, Exception):
+        print(f"Overview: orders lookup failed {orders_page}")
+        errors["orders"] = describe_error(orders_page)
+    else:
+        # Only the most recent page of orders, the client pages on with orders_next_cursor
+        orders, orders_cursor = orders_page["orders"], orders_page["next_cursor"]
+
+    # Every distinct product across all orders, resolved in one batch lookup
+    product_ids = sorted({item["prodict_id"] for order in orders for item in order.get("items", [])})
+    products, missing_products = {}, []
+    if product_ids:
+        try:
+            batch = await fetch_products_batch(product_ids)
+            products, missing_products = batch["products"], batch["missing"]
+        except (httpx.RequestError, httpx.HTTPStatusError) as e:
+            print(f"Overview: product lookup failed {e}")
+            errors["products"] = describe_error(e)
+
+    return {
+        "user": user,
+        "orders": orders,
+        "orders_next_cursor": orders_cursor,
+        "products": products,
+        "missing_products": missing_products,
+        "partial": bool(errors),
+        "errors": errors
+    }
 
 
 # products get by Synchronous way
 @app.get("/sync/products")
-def get_sync_products():
+def get_sync_products(
+    skip: int = 0,
+    limit: int = 100,
+    category: Optional[str] = Query(None),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+):
 
     # ============================#
     # Note: without try, except   #
     # ============================#
+
+    params = {"skip": skip, "limit": limit, "category": category, "min_price": min_price, "max_price": max_price}
+    key = normalize_key(params, PRODUCT_LIST_DEFAULTS)
+    cached = product_cache.get(key)
+    if cached is not None:
+        return cached
     
-    # Use synchronous Client
-    with httpx.Client() as client:
-        # Use synchronous client.get() method (no 'await')
-        response = client.get(f"{PRODUCT_SERVICE_URL}/products")
+    # Use the shared synchronous Client (no 'await')
+    response = upstream["product"].sync_get("/products", route="products.list", params=dict(key))
+    cache_product_list(key, response)
 
-        # Use response.json() to extract the data payload
-        return response.json()
+    # Use response.json() to extract the data payload
+    return response.json()
 
 
 
 # products get by Asynchronous way
 @app.get("/asycn/products")
-async def get_async_products():
+async def get_async_products(
+    skip: int = 0,
+    limit: int = 100,
+    category: Optional[str] = Query(None),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+):
 
     # ============================#
     # Note: without try, except   #
     # ============================#
+
+    params = {"skip": skip, "limit": limit, "category": category, "min_price": min_price, "max_price": max_price}
+    key = normalize_key(params, PRODUCT_LIST_DEFAULTS)
+    cached = product_cache.get(key)
+    if cached is not None:
+        return cached
     
-    # Use synchronous Client
-    async with httpx.AsyncClient() as client:
-        # Use synchronous client.get() method (no 'await')
-        response = await client.get(f"{PRODUCT_SERVICE_URL}/products")
+    # Use the shared Asynchronous Client
+    response = await upstream["product"].get("/products", route="products.list", params=dict(key))
+    cache_product_list(key, response)
 
-        # Use response.json() to extract the data payload
-        return response.json()
+    # Use response.json() to extract the data payload
+    return response.json()
 
 
 
 @app.post("/async/orders/")
 async def create_order(order_data: dict):
     try:
-        # Use Asynchronous Client
-        async with httpx.AsyncClient() as client:
-            # Use Asynchronous client.get() method (no 'await')
-            response = await client.post(f"{ORDER_SERVICE_URL}/orders/", json=order_data)
+        # Use the shared Asynchronous Client
+        response = await upstream["order"].post("/orders/", route="orders.create", json=order_data)
 
-            # Raise an HTTPException if the downstream service returns a 4xx or 5xx
-            response.raise_for_status() 
+        # Raise an HTTPException if the downstream service returns a 4xx or 5xx
+        response.raise_for_status() 
 
-            # Use response.json() to extract the data payload
-            return response.json()
+        # Use response.json() to extract the data payload
+        return response.json()
 
     except httpx.RequestError as e:
         # Handle connection errors (e.g., service is down or DNS resolution failure)
@@ -181,15 +371,14 @@ async def create_order(order_data: dict):
 async def get_order(order_id: str):
     # Use Asynchronous Client
     try:
-        async with httpx.AsyncClient() as client:
-            # This now uses the correct service URL (e.g., http://order-service:8003)
-            response = await client.get(f"{ORDER_SERVICE_URL}/orders/{order_id}")
-            
-            # Raise an HTTPException if the downstream service returns a 4xx or 5xx
-            response.raise_for_status() 
-            
-            # Use response.json() to extract the data payload
-            return response.json()
+        # The order pool is bound to the correct service URL (e.g., http://order-service:8003)
+        response = await coalesced_get("order", f"/orders/{order_id}", route="orders.get")
+        
+        # Raise an HTTPException if the downstream service returns a 4xx or 5xx
+        response.raise_for_status() 
+        
+        # Use response.json() to extract the data payload
+        return response.json()
             
     except httpx.RequestError as e:
         # Handle connection errors (e.g., service is down or DNS resolution failure)
@@ -199,6 +388,9 @@ async def get_order(order_id: str):
     except httpx.HTTPStatusError as e:
         # Forward the error status code and detail from the Order Service
         raise HTTPException(status_code=e.response.status_code, detail=f"Order Service Error: {e.response.status_code}")
+    except SingleFlightOverflow:
+        # Too many callers already waiting on this exact request, shed the load
+        raise HTTPException(status_code=503, detail="Order Service is busy, retry later")
 
 
 
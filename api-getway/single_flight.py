@@ -0,0 +1,70 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlightOverflow(Exception):
+    """Raised when too many callers are already waiting on the same flight."""
+    pass
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Collapse concurrent identical calls into a single upstream call.
+
+    The first caller for a key starts the call, every caller that arrives
+    while it is still in flight awaits the same result (or exception).
+    Nothing is kept once the call finishes, so there is no staleness.
+    """
+
+    def __init__(self, max_waiters: int):
+        self.max_waiters = max_waiters
+        self._flights: Dict[Hashable, _Flight] = {}
+
+        self.flights = 0
+        self.coalesced = 0
+        self.overflows = 0
+        self.errors = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self._flights.get(key)
+        if flight is None:
+            # Run the call in its own task so a disconnecting caller can't cancel it for the others
+            flight = _Flight(asyncio.ensure_future(fn()))
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+            self._flights[key] = flight
+            self.flights += 1
+        else:
+            if flight.waiters >= self.max_waiters:
+                self.overflows += 1
+                raise SingleFlightOverflow(f"Too many waiters for {key}")
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+
+    def _finish(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled() and flight.task.exception() is not None:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "max_waiters": self.max_waiters,
+            "flights": self.flights,
+            "coalesced": self.coalesced,
+            "overflows": self.overflows,
+            "errors": self.errors,
+        }
@@ -0,0 +1,160 @@
+import httpx
+import importlib.util
+import logging
+import os
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# =========================================================================
+# Connection pool settings, shared by every downstream service.
+# All of them can be overridden from the environment (docker-compose).
+# =========================================================================
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30.0"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "2.0"))
+UPSTREAM_POOL_TIMEOUT = float(os.getenv("UPSTREAM_POOL_TIMEOUT", "1.0"))
+
+# HTTP/2 needs the optional "h2" package (httpx[http2]) and an https upstream,
+# plain http:// upstreams keep using HTTP/1.1 keep-alive connections
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "true").lower() == "true" \
+    and importlib.util.find_spec("h2") is not None
+
+# Read timeout (seconds) per gateway route, anything not listed uses the default
+DEFAULT_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "5.0"))
+ROUTE_TIMEOUTS: Dict[str, float] = {
+    "users.get": float(os.getenv("TIMEOUT_USERS_GET", "2.0")),
+    "users.orders": float(os.getenv("TIMEOUT_USERS_ORDERS", "5.0")),
+    "products.list": float(os.getenv("TIMEOUT_PRODUCTS_LIST", "3.0")),
+    "products.batch": float(os.getenv("TIMEOUT_PRODUCTS_BATCH", "3.0")),
+    "orders.get": float(os.getenv("TIMEOUT_ORDERS_GET", "2.0")),
+    "orders.create": float(os.getenv("TIMEOUT_ORDERS_CREATE", "10.0")),
+}
+
+
+def route_timeout(route: Optional[str]) -> httpx.Timeout:
+    """Build the httpx timeout for a gateway route."""
+    read = ROUTE_TIMEOUTS.get(route, DEFAULT_READ_TIMEOUT)
+    return httpx.Timeout(read, connect=UPSTREAM_CONNECT_TIMEOUT, pool=UPSTREAM_POOL_TIMEOUT)
+
+
+class UpstreamPool:
+    """Keep-alive connection pool for a single downstream service."""
+
+    def __init__(self, name: str, base_url: str):
+        self.name = name
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        )
+        self.client: Optional[httpx.AsyncClient] = None
+        self.sync_client: Optional[httpx.Client] = None
+
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+
+    def start(self):
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=self.limits,
+            timeout=route_timeout(None),
+            http2=UPSTREAM_HTTP2,
+        )
+        # The /sync routes run inside FastAPI's threadpool, httpx.Client is thread safe
+        self.sync_client = httpx.Client(
+            base_url=self.base_url,
+            limits=self.limits,
+            timeout=route_timeout(None),
+            http2=UPSTREAM_HTTP2,
+        )
+        logger.info(f"Upstream pool '{self.name}' started for {self.base_url} (http2={UPSTREAM_HTTP2})")
+
+    async def close(self):
+        if self.client:
+            await self.client.aclose()
+        if self.sync_client:
+            self.sync_client.close()
+        logger.info(f"Upstream pool '{self.name}' closed")
+
+    def _enter(self):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    async def request(self, method: str, path: str, route: Optional[str] = None, **kwargs) -> httpx.Response:
+        """Send a request through the shared async client."""
+        self._enter()
+        try:
+            return await self.client.request(method, path, timeout=route_timeout(route), **kwargs)
+        except httpx.RequestError:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    async def get(self, path: str, route: Optional[str] = None, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, route=route, **kwargs)
+
+    async def post(self, path: str, route: Optional[str] = None, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, route=route, **kwargs)
+
+    def sync_get(self, path: str, route: Optional[str] = None, **kwargs) -> httpx.Response:
+        """Send a GET through the shared sync client (threadpool routes)."""
+        self._enter()
+        try:
+            return self.sync_client.get(path, timeout=route_timeout(route), **kwargs)
+        except httpx.RequestError:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    @staticmethod
+    def _pool_connections(client) -> Dict[str, int]:
+        # httpx does not expose its pool publicly, read it from httpcore when we can
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "http2": UPSTREAM_HTTP2,
+            "max_connections": UPSTREAM_MAX_CONNECTIONS,
+            "max_keepalive": UPSTREAM_MAX_KEEPALIVE,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "async_pool": self._pool_connections(self.client) if self.client else {},
+            "sync_pool": self._pool_connections(self.sync_client) if self.sync_client else {},
+        }
+
+
+class UpstreamClients:
+    """Registry of one UpstreamPool per downstream service, owned by the app lifespan."""
+
+    def __init__(self, services: Dict[str, str]):
+        self.pools: Dict[str, UpstreamPool] = {
+            name: UpstreamPool(name, base_url) for name, base_url in services.items()
+        }
+
+    def start(self):
+        for pool in self.pools.values():
+            pool.start()
+
+    async def close(self):
+        for pool in self.pools.values():
+            await pool.close()
+
+    def __getitem__(self, name: str) -> UpstreamPool:
+        return self.pools[name]
+
+    def stats(self) -> dict:
+        return {name: pool.stats() for name, pool in self.pools.items()}
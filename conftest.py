@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Services import the shared package from the repository root, as in their containers
+sys.path.insert(0, ROOT)
+
+# Flat modules every service has its own copy of
+SERVICE_MODULES = ("main", "models", "database", "crud", "event_handler", "event_consume", "init_data")
+DATABASE_DIR = tempfile.mkdtemp()
+
+os.environ.setdefault("SQL_ECHO", "false")
+os.environ.setdefault("KAFKA_COMPRESSION", "none")
+os.environ.setdefault("RECOMMENDATIONS", "false")
+
+
+def pytest_collect_file(file_path, parent):
+    """Import a service's tests against that service's modules and its own SQLite database"""
+    service_dir = file_path.parent.parent
+    if file_path.parent.name != "tests" or not (service_dir / "main.py").exists():
+        return None
+    service_dir = str(service_dir)
+    for name in SERVICE_MODULES:
+        module = sys.modules.get(name)
+        if module is not None and not getattr(module, "__file__", "").startswith(service_dir + os.sep):
+            del sys.modules[name]
+    if service_dir in sys.path:
+        sys.path.remove(service_dir)
+    sys.path.insert(0, service_dir)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(DATABASE_DIR, os.path.basename(service_dir))}.db"
+    return None
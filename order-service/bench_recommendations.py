@@ -0,0 +1,101 @@
+"""Benchmark: co-purchase recommendation build time, memory and serving latency.
+
+Generates a synthetic order history (10M order lines by default) straight
+into numpy arrays: baskets of 1 to 8 products drawn from a Zipf
+distributed catalog, with a share of orders built around fixed product
+bundles so there is real co-purchase signal. Reports the full build split
+into the sparse co-occurrence product and the top-k selection, the
+memory of the tables, recommend() latency, the cost of applying new
+baskets from order.created events and of merging them into the matrix.
+
+Run from the order-service directory:
+
+    python bench_recommendations.py
+"""
+import os
+import time
+
+import numpy as np
+
+from recommendations import CoPurchaseRecommender, co_occurrence, top_neighbours
+
+BENCH_ORDER_LINES = int(os.getenv("BENCH_ORDER_LINES", "10000000"))
+BENCH_PRODUCTS = int(os.getenv("BENCH_PRODUCTS", "100000"))
+BENCH_QUERIES = int(os.getenv("BENCH_QUERIES", "100000"))
+BENCH_EVENTS = int(os.getenv("BENCH_EVENTS", "20000"))
+BUNDLES = 5000
+BUNDLE_SHARE = 0.3
+
+
+def zipf_products(rng: np.random.Generator, size: int) -> np.ndarray:
+    cum_weights = np.cumsum(1 / np.arange(1, BENCH_PRODUCTS + 1))
+    ranks = np.searchsorted(cum_weights, rng.random(size) * cum_weights[-1])
+    # Popularity rank is not product id order
+    return rng.permutation(BENCH_PRODUCTS)[ranks] + 1
+
+
+def make_orders(rng: np.random.Generator):
+    """(order_ids, product_ids) of the order lines, a bundle or a random basket per order"""
+    sizes = rng.integers(1, 9, size=BENCH_ORDER_LINES // 4)
+    sizes = sizes[:np.searchsorted(np.cumsum(sizes), BENCH_ORDER_LINES, side="right")]
+    order_ids = np.repeat(np.arange(1, len(sizes) + 1), sizes)
+    product_ids = zipf_products(rng, len(order_ids))
+
+    bundles = zipf_products(rng, BUNDLES * 8).reshape(BUNDLES, 8)
+    bundled = rng.random(len(sizes)) < BUNDLE_SHARE
+    line_bundle = np.repeat(rng.integers(0, BUNDLES, size=len(sizes)), sizes)
+    position = np.arange(len(order_ids)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    use_bundle = np.repeat(bundled, sizes)
+    product_ids[use_bundle] = bundles[line_bundle[use_bundle], position[use_bundle]]
+    return order_ids, product_ids
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    rng = np.random.default_rng(42)
+    (order_ids, product_ids), seconds = timed(lambda: make_orders(rng))
+    print(f"{len(order_ids)} order lines, {order_ids[-1]} orders, generated in {seconds:.1f}s")
+
+    (ids, counts, orders), co_seconds = timed(lambda: co_occurrence(order_ids, product_ids))
+    _, top_seconds = timed(lambda: top_neighbours(counts, orders, 20))
+    print(f"co-occurrence {co_seconds:.1f}s ({len(ids)} products, {counts.nnz} pairs), top-k {top_seconds:.1f}s")
+
+    recommender = CoPurchaseRecommender()
+    recommender.build(order_ids, product_ids)
+    stats = recommender.stats()
+    print(f"full build {stats['last_build_ms'] / 1000:.1f}s, {stats['memory_bytes'] / 1e6:.1f} MB "
+          f"(sparse matrix and top-{recommender.top_k} tables)")
+
+    queries = zipf_products(rng, BENCH_QUERIES)
+    latencies = np.empty(len(queries))
+    for i, product_id in enumerate(queries.tolist()):
+        t = time.perf_counter()
+        recommender.recommend(product_id, 10)
+        latencies[i] = time.perf_counter() - t
+    p50, p99, worst = np.percentile(latencies, [50, 99, 100]) * 1e6
+    print(f"recommend: p50 {p50:.1f} us, p99 {p99:.1f} us, max {worst:.0f} us, "
+          f"{len(queries) / latencies.sum():.0f} lookups/s")
+
+    sizes = rng.integers(1, 9, size=BENCH_EVENTS)
+    baskets = np.split(zipf_products(rng, sizes.sum()), np.cumsum(sizes)[:-1])
+    latencies = np.empty(len(baskets))
+    for i, basket in enumerate(baskets):
+        basket = basket.tolist()
+        t = time.perf_counter()
+        recommender.add_basket(basket)
+        latencies[i] = time.perf_counter() - t
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1e6
+    print(f"add_basket: p50 {p50:.0f} us, p99 {p99:.0f} us, {len(baskets) / latencies.sum():.0f} orders/s, "
+          f"{recommender.delta_pairs} delta pairs")
+
+    recommender.merge()
+    print(f"merge: {recommender.last_merge_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+from sqlalchemy import insert
+from sqlmodel.ext.asyncio.session import AsyncSession
+from datetime import datetime
+from typing import Optional
+
+from models import Order, OrderItem, OrderCreate, OrderRead, OrderStatus
+from event_handler import EventHandler
+
+
+def order_event_data(order_id: int, order_data: OrderCreate, total_amount: float) -> dict:
+    return {
+        "order_id": order_id,
+        "user_id": order_data.user_id,
+        "total_amount": total_amount,
+        "items": [
+            {"product_id": item.prodict_id, "quantity": item.quantity, "price": item.price}
+            for item in order_data.items
+        ]
+    }
+
+
+async def create_order_with_items(
+    session: AsyncSession,
+    order_data: OrderCreate,
+    total_amount: float,
+    event_handler: Optional[EventHandler] = None
+) -> OrderRead:
+    """Write an order and all of its items in a single transaction.
+
+    The order row comes back with its id via RETURNING and the items go in
+    as one executemany (batched multi-row INSERT on postgres), so there is
+    no window where an order exists without items and no refresh round trip.
+    With an event handler the order.created event is queued in the outbox
+    in the same transaction.
+    """
+    now = datetime.utcnow()
+    order_id = (await session.execute(
+        insert(Order)
+        .values(
+            user_id=order_data.user_id,
+            shipping_address=order_data.shipping_address,
+            total_amount=total_amount,
+            status=OrderStatus.PENDING,
+            created_at=now,
+            updated_at=now
+        )
+        .returning(Order.id)
+    )).scalar_one()
+
+    await session.execute(
+        insert(OrderItem),
+        [
+            {
+                "order_id": order_id,
+                "prodict_id": item.prodict_id,
+                "quantity": item.quantity,
+                "price": item.price
+            }
+            for item in order_data.items
+        ]
+    )
+    if event_handler is not None:
+        event_handler.order_created(session, order_event_data(order_id, order_data, total_amount))
+    await session.commit()
+
+    # Everything in the response is already known, no need to read it back
+    return OrderRead(id=order_id, created_at=now, items=order_data.items)
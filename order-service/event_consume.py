@@ -2,24 +2,46 @@ import asyncio
 import os
 import logging
 from shared.kafka_client import KafkaConsumer
+from shared.kafka_events import EventType
+from shared.event_dedup import EventDeduplicator
+
+from database import async_session_maker
 
 logger = logging.getLogger(__name__)
 
+# Redeliveries after a rebalance or restart are dropped before any handler runs
+dedup = EventDeduplicator(session_maker=async_session_maker)
+
+# Batched consumer, its stats are served on /metrics
+consumer = KafkaConsumer(
+    bootstrap_servers=os.getenv("KAFKA_BROKER", "localhost:9092"),
+    group_id="order-service-group",
+    dedup=dedup
+)
+
+# No group id: every replica has its own lookup cache to invalidate
+cache_consumer = KafkaConsumer(
+    bootstrap_servers=os.getenv("KAFKA_BROKER", "localhost:9092"),
+    group_id=None
+)
+
+# No group id either: every replica keeps its own recommendation model
+recommendation_consumer = KafkaConsumer(
+    bootstrap_servers=os.getenv("KAFKA_BROKER", "localhost:9092"),
+    group_id=None
+)
+
 async def handle_user_created(event: dict):
     """Handle user created event"""
-    logger.info(f"User created: {event['data']}")
+    logger.debug(f"User created: {event['data']}")
 
 
 async def handle_order_events(event: dict):
     """Handle order-related events"""
-    logger.info(f"Order event: {event['event_type']}")
+    logger.debug(f"Order event: {event['event_type']}")
 
 async def start_kafka_consumer():
     """Start kafka consumer for order service"""
-    consumer = KafkaConsumer(
-        bootstrap_servers=os.getenv("KAFKA_BROKER", "localhost:9092"),
-        group_id="order-service-group"
-    )
 
     # Map event types to handlers
     event_handlers = {
@@ -34,6 +56,51 @@ async def start_kafka_consumer():
         if handler:
             await handler(message)
         else:
-            logger.warning(f"No handler for event type: {event_type}")
+            logger.debug(f"No handler for event type: {event_type}")
+
+    try:
+        await consumer.consumer(["users", "orders"], message_handler)
+    except Exception as e:
+        logger.error(f"Order service consumer stopped: {e}")
+
+
+async def start_cache_invalidation(service_client):
+    """Drop cached user/product lookups when the owning service reports a change"""
+    user_events = {EventType.USER_CREATED.value, EventType.USER_UPDATED.value}
+    product_events = {
+        EventType.PRODUCT_CREATED.value,
+        EventType.PRODUCT_UPDATED.value,
+        EventType.PRODUCT_STOCK_UPDATED.value,
+        EventType.PRODUCT_DELETED.value,
+    }
+
+    async def message_handler(message: dict):
+        event_type = message.get("event_type")
+        data = message.get("data", {})
+        # user.created too, a short lived "not found" may be cached for the new id
+        if event_type in user_events and data.get("user_id") is not None:
+            service_client.invalidate_user(data["user_id"])
+        elif event_type in product_events and data.get("product_id") is not None:
+            service_client.invalidate_product(data["product_id"])
+
+    try:
+        await cache_consumer.consumer(["users", "products"], message_handler)
+    except Exception as e:
+        # Entries still expire by TTL while kafka is unavailable
+        logger.error(f"Lookup cache consumer stopped: {e}")
+
+
+async def start_recommendation_updates(recommender):
+    """Count the basket of every new order into the co-purchase recommender"""
+
+    async def message_handler(message: dict):
+        if message.get("event_type") != EventType.ORDER_CREATED.value:
+            return
+        data = message.get("data", {})
+        recommender.add_basket((item["product_id"] for item in data.get("items", [])), data.get("order_id"))
 
-    await consumer.consumer(["users", "orders"], message_handler)
\ No newline at end of file
+    try:
+        await recommendation_consumer.consumer(["orders"], message_handler)
+    except Exception as e:
+        # Still served from the last build, the periodic rebuild catches up
+        logger.error(f"Recommendation consumer stopped: {e}")
@@ -0,0 +1,20 @@
+import os
+from sqlmodel.ext.asyncio.session import AsyncSession
+from shared.kafka_client import KafkaClient
+from shared.outbox import add_outbox_event
+
+class EventHandler:
+    def __init__(self):
+        self.kafka_client = KafkaClient(
+            bootstrap_servers=os.getenv("KAFKA_BROKER", "localhost:9092"),
+            producer_name="order-service"
+        )
+
+    def order_created(self, session: AsyncSession, order_data: dict):
+        """Queue order created event, published by the outbox relay once the session commits"""
+        add_outbox_event(
+            session,
+            topic="orders",
+            event=self.kafka_client.build_event("order.created", order_data),
+            key=str(order_data["user_id"])
+        )
@@ -1,15 +1,27 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, status, Query
 from fastapi.middleware.cors import CORSMiddleware
 from sqlmodel import Session, select
-from typing import List
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import tuple_
+from sqlalchemy.orm import selectinload
+from datetime import datetime
+from typing import Optional
 import logging 
 import asyncio
+import os
 
-from models import Order, OrderItem, OrderCreate, OrderRead, OrderStatus
-from database import create_db_and_tables, get_session
+from models import Order, OrderCreate, OrderRead, OrderStatus, OrderPage, OrderExport, ProductRecommendations
+from database import engine, create_db_and_tables, get_session, get_async_session, async_session_maker
+from crud import create_order_with_items
+from event_handler import EventHandler
 import event_consume
 from order_saga import OrderSaga
-from service_client import ServieClient
+from service_client import ServiceClient
+from shared.circuit_breaker import ServiceUnavailableException
+from shared.pagination import encode_cursor, decode_cursor, InvalidCursor
+from shared.export import export_response
+from shared.outbox import OutboxRelay
+from recommendations import CoPurchaseRecommender, RECOMMENDATIONS, RECOMMENDATIONS_TOP_K
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -18,7 +30,19 @@ logger = logging.getLogger(__name__)
 app = FastAPI(title="Order Service", description="Order Service for ML Powerd E-commerce")
 
 # Initialize service client
-service_client = ServieClient()
+service_client = ServiceClient()
+
+event_handler = EventHandler()
+
+# Publishes the events committed to the outbox table
+outbox_relay = OutboxRelay(event_handler.kafka_client, async_session_maker)
+
+# "Bought together" model, built from the order history and kept current by order events
+recommender = CoPurchaseRecommender()
+
+# Order history page size
+ORDERS_PAGE_SIZE = int(os.getenv("ORDERS_PAGE_SIZE", "50"))
+ORDERS_MAX_PAGE_SIZE = int(os.getenv("ORDERS_MAX_PAGE_SIZE", "200"))
 
 # CORS Middleware
 app.add_middleware(
@@ -36,69 +60,88 @@ def on_startup():
 
     # Start Kafka consumer in background
     asyncio.create_task(event_consume.start_kafka_consumer())
+    asyncio.create_task(event_consume.start_cache_invalidation(service_client))
+    outbox_relay.start()
+    if RECOMMENDATIONS:
+        # Loads the order history in a worker thread, startup doesn't wait for it
+        asyncio.create_task(recommender.run_maintenance(engine))
+        asyncio.create_task(event_consume.start_recommendation_updates(recommender))
     logger.info("Order service started with kafka consumer")
 
+# Shutdown event
+@app.on_event("shutdown")
+async def on_shutdown():
+    await service_client.close()
+    await outbox_relay.stop()
+    # Flush events still sitting in the producer batches
+    await event_handler.kafka_client.stop()
+
 # Health Check
 @app.get("/health")
 def health_check():
     return {"status": "ok", "service": "order-service"}
 
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "kafka_consumer": event_consume.consumer.stats(),
+        "event_dedup": event_consume.dedup.stats(),
+        "cache_consumer": event_consume.cache_consumer.stats(),
+        "service_client": service_client.stats(),
+        "kafka_producer": event_handler.kafka_client.stats(),
+        "outbox_relay": outbox_relay.stats(),
+        "recommendations": recommender.stats(),
+    }
+
 # Create a new order
 @app.post("/orders/", response_model=OrderRead, status_code=status.HTTP_201_CREATED)
-async def create_order(order_data: OrderCreate, session: Session = Depends(get_session)):
+async def create_order(order_data: OrderCreate, session: AsyncSession = Depends(get_async_session)):
 
     # Validate user existence using circuit breaker protected call
-    user = await service_client.get_user(order_data.user_id)
+    try:
+        user = await service_client.get_user(order_data.user_id)
+    except ServiceUnavailableException:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="User service is currently unavailable"
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="User not found"
         )
     
-    # Validate products existence and get their details
-    for item in order_data.items:
-        product = await service_client.get_product(item.prodict_id)
-        if not product:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail=f"Product with ID {item.prodict_id} not found"
-            )
-        
+    # Validate products existence with one batch lookup for the whole order
+    product_ids = sorted({item.prodict_id for item in order_data.items})
+    products = await service_client.get_products_batch(product_ids)
+    if products is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Product service is currently unavailable"
+        )
+    if products["missing"]:
+        missing = ", ".join(str(product_id) for product_id in products["missing"])
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail=f"Product with ID {missing} not found"
+        )
+
 
     # Calculate item total price
     total_amount = sum(item.price * item.quantity for item in order_data.items)
     
-    # Create Order instance
-    db_order = Order(
-        user_id=order_data.user_id,
-        shipping_address=order_data.shipping_address,
-        total_amount=total_amount,
-        status=OrderStatus.PENDING
-    )
-
-    session.add(db_order)
-    session.commit()
-    session.refresh(db_order)
-
-    # Create OrderItem instances
-    for item in order_data.items:
-        db_item = OrderItem(
-            order_id=db_order.id,
-            prodict_id=item.prodict_id,
-            quantity=item.quantity,
-            price=item.price
-        )
-        session.add(db_item)
-    session.commit()
-    session.refresh(db_order)
+    # Create the order and all of its items in one transaction
+    db_order = await create_order_with_items(session, order_data, total_amount, event_handler)
+    outbox_relay.notify()
     
-    logger.info(f"Order created with ID: {db_order.id} for User ID: {db_order.user_id}")
+    logger.info(f"Order created with ID: {db_order.id} for User ID: {order_data.user_id}")
 
     return db_order
 
 
 @app.post("/orders/saga/", status_code=status.HTTP_201_CREATED)
-async def create_order_with_saga(order_data: OrderCreate, session: Session = Depends(get_session)):
+async def create_order_with_saga(order_data: OrderCreate, session: AsyncSession = Depends(get_async_session)):
     """Create order using saga pattern"""
     # Calculate total amount
     total_amount = sum(item.price * item.quantity for item in order_data.items)
@@ -111,9 +154,14 @@ async def create_order_with_saga(order_data: OrderCreate, session: Session = Dep
     }
     
     # Create and execute saga
-    order_saga = OrderSaga(saga_data, session)
+    order_saga = OrderSaga(saga_data, session, service_client)
     success, order_id = await order_saga.create_order_saga()
     
+    if isinstance(order_saga.error, ServiceUnavailableException):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="A service the order depends on is currently unavailable"
+        )
     if not success:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -124,6 +172,38 @@ async def create_order_with_saga(order_data: OrderCreate, session: Session = Dep
 
 
 
+# Stream the order history as NDJSON for the ML feature jobs
+@app.get("/orders/export")
+def export_orders(updated_since: Optional[datetime] = None):
+    # Items are loaded per chunk with one SELECT ... IN query
+    return export_response(engine, Order, OrderExport, updated_since, options=(selectinload(Order.items),))
+
+
+# Products most often bought together with this one
+@app.get("/recommendations/products/{product_id}", response_model=ProductRecommendations)
+def get_product_recommendations(
+    product_id: int,
+    limit: int = Query(10, ge=1, le=RECOMMENDATIONS_TOP_K)
+):
+    if not RECOMMENDATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Recommendations are disabled"
+        )
+    if not recommender.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Recommendations are still loading"
+        )
+    return {
+        "product_id": product_id,
+        "recommendations": [
+            {"product_id": neighbour, "score": score, "co_purchases": together}
+            for neighbour, score, together in recommender.recommend(product_id, limit)
+        ]
+    }
+
+
 # Get order by ID
 @app.get("/orders/{order_id}", response_model=OrderRead)
 def get_order(order_id: int, session: Session = Depends(get_session)):
@@ -135,17 +215,50 @@ def get_order(order_id: int, session: Session = Depends(get_session)):
         )
     return db_order
 
-# Get orders for a specific user
-@app.get("/users/{user_id}/orders", response_model=List[OrderRead])
-def get_user_orders(user_id: int, session: Session = Depends(get_session)):
-    statements = select(Order).where(Order.user_id == user_id)
+# Get orders for a specific user, newest first, one page at a time
+@app.get("/users/{user_id}/orders", response_model=OrderPage)
+def get_user_orders(
+    user_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(ORDERS_PAGE_SIZE, ge=1, le=ORDERS_MAX_PAGE_SIZE),
+    session: Session = Depends(get_session)
+):
+    # Keyset pagination on (created_at, id) served by ix_order_user_id_created_at_id,
+    # items are loaded for the whole page with one extra SELECT ... IN query
+    statements = (
+        select(Order)
+        .where(Order.user_id == user_id)
+        .options(selectinload(Order.items))
+        .order_by(Order.created_at.desc(), Order.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        try:
+            created_at, order_id = decode_cursor(cursor, 2)
+            created_at = datetime.fromisoformat(created_at)
+            order_id = int(order_id)
+        except (InvalidCursor, TypeError, ValueError):
+            raise HTTPException(
+                status_code=400, 
+                detail="Invalid cursor"
+            )
+        statements = statements.where(tuple_(Order.created_at, Order.id) < (created_at, order_id))
+
     db_orders = session.exec(statements).all()
-    if not db_orders:
+    if not db_orders and not cursor:
         raise HTTPException(
             status_code=404, 
             detail="Order not found for this user"
         )
-    return db_orders
+
+    # We fetched one row more than the page to know if there is a next page
+    next_cursor = None
+    if len(db_orders) > limit:
+        db_orders = db_orders[:limit]
+        last = db_orders[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return {"orders": db_orders, "next_cursor": next_cursor}
 
 # Update order status
 @app.patch("/orders/{order_id}/status", response_model=OrderRead)
@@ -157,6 +270,7 @@ def update_order_status(order_id: int, status: OrderStatus, session: Session = D
             detail="Order not found"
         )
     db_order.status = status
+    db_order.updated_at = datetime.utcnow()
     session.add(db_order)
     session.commit()
     session.refresh(db_order)
@@ -1,4 +1,5 @@
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index
 from typing import Optional, List
 from datetime import datetime
 from enum import Enum
@@ -30,10 +31,15 @@ class OrderBase(SQLModel):
 
 # Order model representing the orders table
 class Order(OrderBase, table=True):
+    # Keyset pagination of a user's order history walks this index
+    __table_args__ = (
+        Index("ix_order_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     total_amount: float = Field(default=0.0, ge=0)
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow, index=True)
     items: List[OrderItem] = Relationship(
         back_populates="order",
         sa_relationship_kwargs={"cascade": "all, delete-orphan"}
@@ -49,4 +55,30 @@ class OrderCreate(SQLModel):
 class OrderRead(SQLModel):
     id: int
     created_at: datetime
-    items: List[OrderItemBase]
\ No newline at end of file
+    items: List[OrderItemBase]
+
+# One page of a user's order history
+class OrderPage(SQLModel):
+    orders: List[OrderRead]
+    next_cursor: Optional[str] = None
+
+
+# Bulk export row, the full order so feature jobs don't need a second lookup
+class OrderExport(OrderBase):
+    id: int
+    total_amount: float
+    created_at: datetime
+    updated_at: datetime
+    items: List[OrderItemBase]
+
+
+# A product often bought together with the requested one
+class ProductRecommendation(SQLModel):
+    product_id: int
+    score: float
+    co_purchases: int
+
+
+class ProductRecommendations(SQLModel):
+    product_id: int
+    recommendations: List[ProductRecommendation]
@@ -1,16 +1,17 @@
 import uuid
 from saga_orchestrator import SagaOrchestrator, SagaStep
 from service_client import ServiceClient
-from models import Order, OrderItem
-from database import get_session
-from sqlmodel import Session
+from models import Order
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 class OrderSaga:
-    def __init__(self, order_data: dict, session: Session):
+    def __init__(self, order_data: dict, session: AsyncSession, service_client: ServiceClient):
         self.order_data = order_data
         self.session = session
         self.saga_id = str(uuid.uuid4())
-        self.service_client = ServiceClient()
+        # The app wide client, its breakers and connection pool outlive the saga
+        self.service_client = service_client
+        self.error = None
         
     async def create_order_saga(self):
         """Create order using saga pattern"""
@@ -46,17 +47,16 @@ class OrderSaga:
                 shipping_address=self.order_data["shipping_address"]
             )
             self.session.add(order)
-            self.session.commit()
-            self.session.refresh(order)
+            await self.session.commit()
             self.order_id = order.id
             
         async def compensate_create_order_db():
             # Delete order if created
             if hasattr(self, 'order_id'):
-                order = self.session.get(Order, self.order_id)
+                order = await self.session.get(Order, self.order_id)
                 if order:
-                    self.session.delete(order)
-                    self.session.commit()
+                    await self.session.delete(order)
+                    await self.session.commit()
                     
         saga.add_step(SagaStep(
             name="create_order_db",
@@ -86,4 +86,5 @@ class OrderSaga:
         
         # Execute saga
         success = await saga.execute()
+        self.error = saga.error
         return success, self.order_id if success else None
\ No newline at end of file
@@ -0,0 +1,332 @@
+from sqlmodel import Session, select
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+from models import OrderItem
+
+logger = logging.getLogger(__name__)
+
+# Serve /recommendations from the in-process co-purchase model
+RECOMMENDATIONS = os.getenv("RECOMMENDATIONS", "true").lower() == "true"
+# Neighbours kept per product
+RECOMMENDATIONS_TOP_K = int(os.getenv("RECOMMENDATIONS_TOP_K", "20"))
+# Bigger baskets (bulk/wholesale orders) say little about what goes together and cost k^2 pairs
+RECOMMENDATIONS_MAX_BASKET = int(os.getenv("RECOMMENDATIONS_MAX_BASKET", "50"))
+# Pairs counted from events before they are folded into the sparse matrix
+RECOMMENDATIONS_MERGE_PAIRS = int(os.getenv("RECOMMENDATIONS_MERGE_PAIRS", "200000"))
+# Full rebuild from the order tables, 0 disables it
+RECOMMENDATIONS_REBUILD_INTERVAL = float(os.getenv("RECOMMENDATIONS_REBUILD_INTERVAL", "86400"))
+
+# Order lines read per round trip when loading
+LOAD_CHUNK_SIZE = 100000
+
+
+def co_occurrence(order_ids: np.ndarray, product_ids: np.ndarray,
+                  max_basket: int = RECOMMENDATIONS_MAX_BASKET) -> Tuple[np.ndarray, sparse.csr_matrix, np.ndarray]:
+    """Product ids, product x product co-purchase counts and orders per product.
+
+    With B the binary order x product basket matrix, the counts are B^T B
+    without its diagonal; the diagonal is the number of orders per product.
+    """
+    ids, columns = np.unique(product_ids, return_inverse=True)
+    _, rows = np.unique(order_ids, return_inverse=True)
+    baskets = sparse.csr_matrix(
+        (np.ones(len(columns), dtype=np.float32), (rows, columns)),
+        shape=(rows.max() + 1 if len(rows) else 0, len(ids))
+    )
+    # The same product on two lines of one order is bought together with itself only once
+    baskets.sum_duplicates()
+    baskets.data[:] = 1
+    baskets = baskets[np.diff(baskets.indptr) <= max_basket]
+
+    counts = (baskets.T @ baskets).tocsr()
+    orders = counts.diagonal().astype(np.float64)
+    counts.setdiag(0)
+    counts.eliminate_zeros()
+    counts.sort_indices()
+    return ids, counts, orders
+
+
+def top_neighbours(counts: sparse.csr_matrix, orders: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Per row the k columns with the highest cosine similarity, -1 padded"""
+    n = counts.shape[0]
+    rows = np.repeat(np.arange(n), np.diff(counts.indptr))
+    scores = counts.data / np.sqrt(orders[rows] * orders[counts.indices])
+    # Rows ascending, scores descending within a row; stable, so ties stay in product id order
+    order = np.argsort(rows * 2.0 + (1.0 - scores), kind="stable")
+    rank = np.arange(len(order)) - counts.indptr[rows[order]]
+    keep = order[rank < k]
+    slots = rank[rank < k]
+
+    neighbours = np.full((n, k), -1, dtype=np.int32)
+    similarity = np.zeros((n, k), dtype=np.float32)
+    together = np.zeros((n, k), dtype=np.int32)
+    neighbours[rows[keep], slots] = counts.indices[keep]
+    similarity[rows[keep], slots] = scores[keep]
+    together[rows[keep], slots] = counts.data[keep]
+    return neighbours, similarity, together
+
+
+def _contains(sorted_values: np.ndarray, value: int) -> bool:
+    i = np.searchsorted(sorted_values, value)
+    return i < len(sorted_values) and sorted_values[i] == value
+
+
+class CoPurchaseRecommender:
+    """Item to item "bought together" recommendations from order baskets.
+
+    A full build turns all order lines into a sparse basket matrix B and
+    computes the co-purchase counts B^T B in one sparse product, then keeps
+    the top k neighbours of every product by cosine similarity in dense
+    (products x k) arrays, so serving is one row read.
+
+    order.created events update it incrementally: the pair counts of the
+    new basket go into a small delta on top of the sparse matrix and only
+    the rows of the products in that basket are re-ranked. The delta is
+    folded into the matrix in the background once it holds
+    RECOMMENDATIONS_MERGE_PAIRS pairs. Rows of products outside the basket
+    keep their scores until a rebuild, even though the order count of a
+    neighbour they list went up.
+    """
+
+    def __init__(self, top_k: int = RECOMMENDATIONS_TOP_K, max_basket: int = RECOMMENDATIONS_MAX_BASKET):
+        self.top_k = top_k
+        self.max_basket = max_basket
+        self._lock = threading.Lock()
+        self._install(np.zeros(0, dtype=np.int64), sparse.csr_matrix((0, 0), dtype=np.float32), np.zeros(0))
+        # (order id, basket) seen while a rebuild runs, replayed on top of its result,
+        # and everything seen before the first one
+        self._pending: Optional[List[Tuple[Optional[int], List[int]]]] = []
+        self.loaded_at: Optional[float] = None
+
+        self.baskets = 0
+        self.skipped_baskets = 0
+        self.rebuilds = 0
+        self.merges = 0
+        self.last_build_ms = 0.0
+        self.last_merge_ms = 0.0
+
+    def _install(self, ids: np.ndarray, counts: sparse.csr_matrix, orders: np.ndarray,
+                 tables: Optional[tuple] = None):
+        neighbours, similarity, together = tables or top_neighbours(counts, orders, self.top_k)
+        self.size = len(ids)
+        self._ids = ids.copy()
+        self._index: Dict[int, int] = {int(product_id): i for i, product_id in enumerate(ids)}
+        self._counts = counts
+        self._orders = orders.copy()
+        self._neighbours, self._similarity, self._together = neighbours, similarity, together
+        self._delta: Dict[int, Counter] = defaultdict(Counter)
+        self.delta_pairs = 0
+
+    @property
+    def ready(self) -> bool:
+        """Built at least once, before that recommend() knows nothing"""
+        return self.rebuilds > 0
+
+    def build(self, order_ids: np.ndarray, product_ids: np.ndarray):
+        """Full build from parallel arrays of order lines, events keep being applied meanwhile"""
+        self._rebuild(lambda: (order_ids, product_ids))
+
+    def load(self, engine):
+        """Build from every order line in the database"""
+        self._rebuild(lambda: self._read(engine))
+        self.loaded_at = time.time()
+
+    def _read(self, engine) -> Tuple[np.ndarray, np.ndarray]:
+        order_ids, product_ids = [], []
+        with Session(engine) as session:
+            result = session.execute(
+                select(OrderItem.order_id, OrderItem.prodict_id).execution_options(yield_per=LOAD_CHUNK_SIZE)
+            )
+            for rows in result.partitions():
+                lines = np.array(rows, dtype=np.int64).reshape(-1, 2)
+                order_ids.append(lines[:, 0])
+                product_ids.append(lines[:, 1])
+        empty = np.zeros(0, dtype=np.int64)
+        return (np.concatenate(order_ids) if order_ids else empty,
+                np.concatenate(product_ids) if product_ids else empty)
+
+    def _rebuild(self, read: Callable[[], Tuple[np.ndarray, np.ndarray]]):
+        started = time.perf_counter()
+        # Started before the order lines are read, an order committed after the read still gets in
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+        try:
+            order_ids, product_ids = read()
+            ids, counts, orders = co_occurrence(order_ids, product_ids, self.max_basket)
+            tables = top_neighbours(counts, orders, self.top_k)
+            read_orders = np.unique(order_ids)
+        except Exception:
+            with self._lock:
+                if self.ready:
+                    self._pending = None
+            raise
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._install(ids, counts, orders, tables)
+            for order_id, basket in pending:
+                # Orders the read already returned are not counted twice
+                if order_id is not None and _contains(read_orders, order_id):
+                    continue
+                self._apply(basket)
+        self.rebuilds += 1
+        self.last_build_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Recommendations built from {len(order_ids)} order lines, {len(ids)} products, "
+                    f"{counts.nnz} pairs in {self.last_build_ms:.1f} ms")
+
+    def _position(self, product_id: int) -> int:
+        position = self._index.get(product_id)
+        if position is None:
+            position = self._index[product_id] = self.size
+            if self.size == len(self._ids):
+                capacity = max(2 * self.size, 64)
+                self._ids = np.resize(self._ids, capacity)
+                self._orders = np.concatenate([self._orders, np.zeros(capacity - len(self._orders))])
+                for name, fill in (("_neighbours", -1), ("_similarity", 0), ("_together", 0)):
+                    table = getattr(self, name)
+                    grown = np.full((capacity, self.top_k), fill, dtype=table.dtype)
+                    grown[:len(table)] = table
+                    setattr(self, name, grown)
+            self._ids[position] = product_id
+            self.size += 1
+        return position
+
+    def add_basket(self, product_ids: Iterable[int], order_id: Optional[int] = None):
+        """Count one new order, re-ranking the products in it"""
+        basket = sorted(set(product_ids))
+        if not basket or len(basket) > self.max_basket:
+            self.skipped_baskets += 1
+            return
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((order_id, basket))
+            self._apply(basket)
+        self.baskets += 1
+
+    def _apply(self, basket: List[int]):
+        positions = [self._position(product_id) for product_id in basket]
+        for i in positions:
+            self._orders[i] += 1
+            for j in positions:
+                if i != j:
+                    self._delta[i][j] += 1
+        self.delta_pairs += len(positions) * (len(positions) - 1)
+        for i in positions:
+            self._rank_row(i)
+
+    def _rank_row(self, i: int):
+        if i < self._counts.shape[0]:
+            start, end = self._counts.indptr[i], self._counts.indptr[i + 1]
+            columns = self._counts.indices[start:end]
+            together = self._counts.data[start:end].astype(np.float64)
+        else:
+            columns, together = np.zeros(0, dtype=np.int32), np.zeros(0)
+        delta = self._delta.get(i)
+        if delta:
+            delta_columns = np.fromiter(delta.keys(), dtype=np.int32, count=len(delta))
+            delta_together = np.fromiter(delta.values(), dtype=np.float64, count=len(delta))
+            # Columns are sorted, pairs already in the matrix are added in place
+            slots = np.searchsorted(columns, delta_columns)
+            found = slots < len(columns)
+            found[found] = columns[slots[found]] == delta_columns[found]
+            together[slots[found]] += delta_together[found]
+            columns = np.concatenate([columns, delta_columns[~found]])
+            together = np.concatenate([together, delta_together[~found]])
+
+        scores = together / np.sqrt(self._orders[i] * self._orders[columns])
+        if len(scores) > self.top_k:
+            # Everything tied with the k-th score stays in, so ties break by id like in a full build
+            threshold = np.partition(scores, len(scores) - self.top_k)[len(scores) - self.top_k]
+            candidates = np.flatnonzero(scores >= threshold)
+            columns, together, scores = columns[candidates], together[candidates], scores[candidates]
+        top = np.lexsort((columns, -scores))[:self.top_k]
+        n = len(top)
+        self._neighbours[i, :n], self._neighbours[i, n:] = columns[top], -1
+        self._similarity[i, :n], self._similarity[i, n:] = scores[top], 0
+        self._together[i, :n], self._together[i, n:] = together[top], 0
+
+    def merge(self):
+        """Fold the event delta into the sparse matrix, off the lock"""
+        started = time.perf_counter()
+        with self._lock:
+            frozen = {i: Counter(row) for i, row in self._delta.items()}
+            counts, size = self._counts, self.size
+        rows = np.fromiter((i for i, row in frozen.items() for _ in row), dtype=np.int32)
+        columns = np.fromiter((j for row in frozen.values() for j in row), dtype=np.int32)
+        values = np.fromiter((v for row in frozen.values() for v in row.values()), dtype=np.float32)
+        counts = counts.copy()
+        counts.resize((size, size))
+        merged = (counts + sparse.csr_matrix((values, (rows, columns)), shape=(size, size))).tocsr()
+        merged.sort_indices()
+
+        with self._lock:
+            for i, row in frozen.items():
+                live = self._delta[i]
+                live.subtract(row)
+                for j in [j for j, v in live.items() if v == 0]:
+                    del live[j]
+                if not live:
+                    del self._delta[i]
+            self._counts = merged
+            self.delta_pairs = sum(len(row) for row in self._delta.values())
+        self.merges += 1
+        self.last_merge_ms = (time.perf_counter() - started) * 1000
+
+    def recommend(self, product_id: int, limit: int = RECOMMENDATIONS_TOP_K) -> List[Tuple[int, float, int]]:
+        """(product id, cosine similarity, orders with both) of the products most bought together"""
+        with self._lock:
+            i = self._index.get(product_id)
+            if i is None:
+                return []
+            neighbours = self._neighbours[i, :limit]
+            valid = neighbours >= 0
+            return [
+                (int(self._ids[j]), float(score), int(together))
+                for j, score, together in zip(neighbours[valid], self._similarity[i, :limit][valid],
+                                              self._together[i, :limit][valid])
+            ]
+
+    async def run_maintenance(self, engine, rebuild_interval: float = RECOMMENDATIONS_REBUILD_INTERVAL):
+        """Load off the event loop (retried until it works), then rebuild and merge in the background"""
+        last_build = time.monotonic()
+        while True:
+            try:
+                if not self.ready or rebuild_interval and time.monotonic() - last_build >= rebuild_interval:
+                    last_build = time.monotonic()
+                    await asyncio.to_thread(self.load, engine)
+                elif self.delta_pairs >= RECOMMENDATIONS_MERGE_PAIRS:
+                    await asyncio.to_thread(self.merge)
+            except Exception as e:
+                logger.error(f"Recommendations maintenance failed: {e}")
+            await asyncio.sleep(5)
+
+    def memory_bytes(self) -> int:
+        matrix = self._counts.data.nbytes + self._counts.indices.nbytes + self._counts.indptr.nbytes
+        tables = self._neighbours.nbytes + self._similarity.nbytes + self._together.nbytes
+        return matrix + tables + self._ids.nbytes + self._orders.nbytes
+
+    def stats(self) -> dict:
+        return {
+            "enabled": RECOMMENDATIONS,
+            "products": self.size,
+            "pairs": self._counts.nnz,
+            "delta_pairs": self.delta_pairs,
+            "baskets": self.baskets,
+            "skipped_baskets": self.skipped_baskets,
+            "rebuilds": self.rebuilds,
+            "merges": self.merges,
+            "last_build_ms": round(self.last_build_ms, 1),
+            "last_merge_ms": round(self.last_merge_ms, 1),
+            "memory_bytes": self.memory_bytes(),
+            "ready": self.ready,
+            "loaded_at": self.loaded_at,
+        }
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import List, Dict, Any, Callable
+from typing import List, Dict, Any, Callable, Optional
 import asyncio
 import logging
 from datetime import datetime
@@ -25,6 +25,8 @@ class SagaOrchestrator:
         self.steps: List[SagaStep] = []
         self.status = SagaStatus.PENDING
         self.created_at = datetime.utcnow()
+        # Why the saga failed, lets the caller tell an unavailable service from a bug
+        self.error: Optional[Exception] = None
 
     def add_step(self, step: SagaStep):
         self.steps.append(step)
@@ -47,6 +49,7 @@ class SagaOrchestrator:
         except Exception as e:
             logger.error(f"Saga {self.saga_id} failed: {e}")
             self.status = SagaStatus.FAILED
+            self.error = e
             
             # Execute compensation in reverse order
             await self.compensate(completed_steps)
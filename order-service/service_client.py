@@ -1,39 +1,128 @@
-from shared.circuit_breaker import CircuitBreaker
+from shared.circuit_breaker import CircuitBreaker, ServiceUnavailableException
+from shared.response_cache import ResponseCache
+from typing import List
+import httpx
+import logging
 import os
 
-class ServieClient:
+logger = logging.getLogger(__name__)
+
+# Read-through cache of user and product lookups, kept fresh by kafka events
+LOOKUP_CACHE_TTL = float(os.getenv("LOOKUP_CACHE_TTL", "60"))
+LOOKUP_CACHE_MAX_ENTRIES = int(os.getenv("LOOKUP_CACHE_MAX_ENTRIES", "10000"))
+# "Doesn't exist" answers are kept briefly, a new user or product shows up quickly
+LOOKUP_NEGATIVE_TTL = float(os.getenv("LOOKUP_NEGATIVE_TTL", "5"))
+
+# Cached marker for a 404, the cache itself returns None on a miss
+NOT_FOUND = object()
+
+class ServiceClient:
     def __init__(self):
         self.circuit_breaker = CircuitBreaker()
         self.user_service_url = os.getenv("USER_SERVICE_URL", "http://user-service:8001")
         self.product_service_url = os.getenv("PRODUCT_SERVICE_URL", "http://product-service:8002")
+        self.user_cache = ResponseCache(ttl=LOOKUP_CACHE_TTL, max_entries=LOOKUP_CACHE_MAX_ENTRIES)
+        self.product_cache = ResponseCache(ttl=LOOKUP_CACHE_TTL, max_entries=LOOKUP_CACHE_MAX_ENTRIES)
+
+    async def get_user(self, user_id: int):
+        """Get user with circuit breaker protection, served from the cache when we can
+
+        Returns None when user-service says the user doesn't exist, raises
+        ServiceUnavailableException when it can't answer.
+        """
+        cached = self.user_cache.get(user_id)
+        if cached is not None:
+            return None if cached is NOT_FOUND else cached
+
+        url = f"{self.user_service_url}/users/{user_id}"
+        try:
+            user = await self.circuit_breaker.call_service(method="GET", url=url, hedge=True)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:
+                raise ServiceUnavailableException(f"User lookup failed: {e}") from e
+            self.user_cache.set(user_id, NOT_FOUND, ttl=LOOKUP_NEGATIVE_TTL)
+            return None
+        except Exception as e:
+            logger.warning(f"User lookup failed: {e}")
+            raise ServiceUnavailableException(f"User lookup failed: {e}") from e
+
+        self.user_cache.set(user_id, user)
+        return user
+
+    async def get_product(self, product_id: int):
+        """Get product with circuit breaker protection, served from the cache when we can
+
+        Returns None when product-service says the product doesn't exist, raises
+        ServiceUnavailableException when it can't answer.
+        """
+        cached = self.product_cache.get(product_id)
+        if cached is not None:
+            return None if cached is NOT_FOUND else cached
+
+        url = f"{self.product_service_url}/products/{product_id}"
+        try:
+            product = await self.circuit_breaker.call_service(method="GET", url=url, hedge=True)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:
+                raise ServiceUnavailableException(f"Product lookup failed: {e}") from e
+            self.product_cache.set(product_id, NOT_FOUND, ttl=LOOKUP_NEGATIVE_TTL)
+            return None
+        except Exception as e:
+            logger.warning(f"Product lookup failed: {e}")
+            raise ServiceUnavailableException(f"Product lookup failed: {e}") from e
 
-        async def get_user(self, user_id: int):
-            """Get user with circuit breaker protection"""
-            url = f"{self.user_service_url}/users/{user_id}"
-            
-            fallback_user = {
-                "id": user_id,
-                "full_name": "Unknown User",
-                "email": "customer@example.com,
-            }
-            return await self.circuit_breaker.call_with_fallback(
-                method="GET",
+        self.product_cache.set(product_id, product)
+        return product
+
+    async def get_products_batch(self, product_ids: List[int]):
+        """Get many products with circuit breaker protection, only cache misses go out in one call
+
+        Returns {"products": [...], "missing": [...]}, or None when the
+        product service can't be reached (no fake products for validation).
+        """
+        products, missing, to_fetch = [], [], []
+        for product_id in product_ids:
+            cached = self.product_cache.get(product_id)
+            if cached is NOT_FOUND:
+                missing.append(product_id)
+            elif cached is not None:
+                products.append(cached)
+            else:
+                to_fetch.append(product_id)
+
+        if to_fetch:
+            url = f"{self.product_service_url}/products/batch"
+            fetched = await self.circuit_breaker.call_with_fallback(
+                method="POST",
                 url=url,
-                fallback_value=fallback_user
+                fallback_value=None,
+                data={"ids": to_fetch},
+                # Read only lookup, safe to send again
+                retry=True
             )
-        
-
-        async def get_product(self, product_id: int):
-            """Get product with circuit breaker protection"""
-            url = f"{self.product_service_url}/products/{product_id}"
-            
-            fallback_product = {
-                "id": product_id,
-                "name": "Laptop",
-                "price": 0.0,
-            }
-            return await self.circuit_breaker.call_with_fallback(
-                method="GET",
-                url=url,
-                fallback_value=fallback_product
-            )
\ No newline at end of file
+            if fetched is None:
+                return None
+            for product in fetched["products"]:
+                self.product_cache.set(product["id"], product)
+                products.append(product)
+            for product_id in fetched["missing"]:
+                self.product_cache.set(product_id, NOT_FOUND, ttl=LOOKUP_NEGATIVE_TTL)
+                missing.append(product_id)
+
+        return {"products": products, "missing": sorted(missing)}
+
+    def invalidate_user(self, user_id: int):
+        self.user_cache.delete(user_id)
+
+    def invalidate_product(self, product_id: int):
+        self.product_cache.delete(product_id)
+
+    async def close(self):
+        await self.circuit_breaker.close()
+
+    def stats(self) -> dict:
+        return {
+            **self.circuit_breaker.stats(),
+            "user_cache": self.user_cache.stats(),
+            "product_cache": self.product_cache.stats(),
+        }
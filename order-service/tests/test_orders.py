@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+import database
+import main
+from models import Order, OrderItem
+from shared.circuit_breaker import CircuitOpenError
+from shared.pagination import encode_cursor
+
+USER_ID = 7
+
+
+@pytest.fixture(scope="module")
+def client():
+    database.create_db_and_tables()
+    # Not entered as a context manager, the startup handler would start the kafka clients
+    return TestClient(main.app)
+
+
+@pytest.fixture(scope="module")
+def order_ids(client):
+    """Ids of the user's orders, newest first, two of them created at the same instant"""
+    started = datetime(2024, 3, 1, 9, 0, 0)
+    created = [started, started + timedelta(hours=1), started + timedelta(hours=1),
+               started + timedelta(hours=2), started + timedelta(hours=3)]
+    with Session(database.engine) as session:
+        orders = [
+            Order(user_id=USER_ID, shipping_address="1 Main St", created_at=created_at, updated_at=created_at,
+                  items=[OrderItem(prodict_id=1, quantity=1, price=9.5)])
+            for created_at in created
+        ]
+        session.add_all(orders)
+        session.commit()
+        newest_first = sorted(orders, key=lambda order: (order.created_at, order.id), reverse=True)
+        return [order.id for order in newest_first]
+
+
+def test_pages_walk_the_whole_history_once(client, order_ids):
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"/users/{USER_ID}/orders", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        seen.extend(order["id"] for order in page["orders"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == order_ids
+
+
+@pytest.mark.parametrize("cursor", [
+    "garbage",
+    encode_cursor(datetime(2024, 3, 1), "not-an-id"),
+    encode_cursor(datetime(2024, 3, 1), [1]),
+    encode_cursor("yesterday", 1),
+    encode_cursor(20240301, 1),
+    encode_cursor(datetime(2024, 3, 1)),
+    encode_cursor(datetime(2024, 3, 1), 1, 2),
+])
+def test_malformed_cursor_is_rejected(client, order_ids, cursor):
+    response = client.get(f"/users/{USER_ID}/orders", params={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_order_is_refused_while_user_service_is_unavailable(client, monkeypatch):
+    async def circuit_open(*args, **kwargs):
+        raise CircuitOpenError("Circuit open for GET user-service:8001/users/{id}")
+
+    monkeypatch.setattr(main.service_client.circuit_breaker, "call_service", circuit_open)
+    response = client.post("/orders/", json={
+        "user_id": 4040, "shipping_address": "1 Main St",
+        "items": [{"prodict_id": 1, "quantity": 1, "price": 9.5}],
+    })
+    assert response.status_code == 503
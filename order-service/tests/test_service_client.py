@@ -0,0 +1,90 @@
+import asyncio
+
+import httpx
+import pytest
+
+from service_client import ServiceClient
+from shared.circuit_breaker import CircuitOpenError, ServiceUnavailableException
+
+
+class FakeUpstream:
+    """Stands in for CircuitBreaker.call_service, counting the lookups that go out"""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+
+    async def __call__(self, method, url, **kwargs):
+        self.calls.append(url)
+        answer = self.answers[url.rsplit("/", 1)[1]]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "http://user-service:8001/users/1")
+    return httpx.HTTPStatusError(str(status), request=request, response=httpx.Response(status, request=request))
+
+
+def client_with(answers) -> tuple:
+    client = ServiceClient()
+    upstream = FakeUpstream(answers)
+    client.circuit_breaker.call_service = upstream
+    return client, upstream
+
+
+def test_user_lookup_is_cached_until_invalidated():
+    client, upstream = client_with({"1": {"id": 1, "full_name": "Ada"}})
+
+    async def scenario():
+        assert await client.get_user(1) == {"id": 1, "full_name": "Ada"}
+        assert await client.get_user(1) == {"id": 1, "full_name": "Ada"}
+        assert len(upstream.calls) == 1
+
+        # A user.updated event drops the entry, the next lookup sees the change
+        upstream.answers["1"] = {"id": 1, "full_name": "Ada Lovelace"}
+        client.invalidate_user(1)
+        assert await client.get_user(1) == {"id": 1, "full_name": "Ada Lovelace"}
+        assert len(upstream.calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_product_lookup_is_cached_until_invalidated():
+    client, upstream = client_with({"5": {"id": 5, "price": 10.0}})
+
+    async def scenario():
+        await client.get_product(5)
+        await client.get_product(5)
+        client.invalidate_product(5)
+        upstream.answers["5"] = {"id": 5, "price": 12.0}
+        assert await client.get_product(5) == {"id": 5, "price": 12.0}
+
+    asyncio.run(scenario())
+    assert len(upstream.calls) == 2
+
+
+def test_missing_user_is_cached_briefly():
+    client, upstream = client_with({"2": status_error(404)})
+
+    async def scenario():
+        assert await client.get_user(2) is None
+        assert await client.get_user(2) is None
+
+    asyncio.run(scenario())
+    assert len(upstream.calls) == 1
+
+
+@pytest.mark.parametrize("error", [status_error(503), CircuitOpenError("open"), httpx.ConnectError("refused")])
+def test_unavailable_user_service_is_not_papered_over(error):
+    client, upstream = client_with({"3": error})
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(ServiceUnavailableException):
+                await client.get_user(3)
+
+    asyncio.run(scenario())
+    # Failures are not cached, the next lookup asks again
+    assert len(upstream.calls) == 2
@@ -0,0 +1,112 @@
+"""Benchmark: /products/search query latency and index memory.
+
+Indexes a synthetic catalog (1M products by default) whose names and
+descriptions draw words from a Zipf distributed vocabulary, then times
+single term, multi term, prefix and filtered queries against SearchIndex
+and, for reference, a linear substring scan over the same texts (what a
+client downloading the catalog does). Also prints the index build time and
+its memory footprint.
+
+Run from the product-service directory:
+
+    python bench_product_search.py
+"""
+from datetime import datetime
+from types import SimpleNamespace
+import os
+import random
+import resource
+import statistics
+import time
+
+from search import SearchIndex
+
+BENCH_PRODUCTS = int(os.getenv("BENCH_PRODUCTS", "1000000"))
+VOCABULARY = 20000
+CATEGORIES = [f"category-{i}" for i in range(10)]
+REPEAT = 20
+
+QUERIES = [
+    ("common term", "w3 ", {}),
+    ("rare term", "w4000 ", {}),
+    ("two terms", "w3 w17 ", {}),
+    ("prefix", "w12", {}),
+    ("term+category", "w3 ", {"category": "category-3"}),
+    ("term+price", "w17 ", {"min_price": 100, "max_price": 200}),
+]
+
+
+def make_products():
+    rng = random.Random(42)
+    # Zipf-ish: the rank r word shows up with weight 1/r
+    words = [f"w{rank}" for rank in range(1, VOCABULARY + 1)]
+    weights = [1 / rank for rank in range(1, VOCABULARY + 1)]
+    updated_at = datetime(2024, 1, 1)
+    chunk = 10000
+    for start in range(0, BENCH_PRODUCTS, chunk):
+        count = min(chunk, BENCH_PRODUCTS - start)
+        name_words = rng.choices(words, weights, k=count * 3)
+        description_words = rng.choices(words, weights, k=count * 12)
+        for i in range(count):
+            yield SimpleNamespace(
+                id=start + i + 1,
+                name=" ".join(name_words[i * 3:i * 3 + 3]),
+                description=" ".join(description_words[i * 12:i * 12 + 12]),
+                category=CATEGORIES[(start + i) % len(CATEGORIES)],
+                price=round(rng.uniform(1, 1000), 2),
+                is_active=True,
+                updated_at=updated_at,
+            )
+
+
+def latency_ms(fn, repeat: int = REPEAT):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), max(samples), result
+
+
+def scan(texts, products, query: str, filters: dict) -> int:
+    words = [f" {word} " for word in query.split()]
+    if not query.endswith(" "):
+        words[-1] = words[-1].rstrip()
+    category = filters.get("category")
+    min_price = filters.get("min_price", float("-inf"))
+    max_price = filters.get("max_price", float("inf"))
+    return sum(
+        1 for text, (product_category, price) in zip(texts, products)
+        if all(word in text for word in words)
+        and (category is None or product_category == category)
+        and min_price <= price <= max_price
+    )
+
+
+def main():
+    index = SearchIndex()
+    texts, products = [], []
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    for product in make_products():
+        index.upsert(product)
+        texts.append(f" {product.name} {product.description} ")
+        products.append((product.category, product.price))
+    build_seconds = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    stats = index.stats()
+    print(f"{BENCH_PRODUCTS} products, {stats['terms']} terms, built in {build_seconds:.1f}s")
+    print(f"index memory {stats['memory_bytes'] / 1e6:.1f} MB "
+          f"(process max RSS grew {(rss_after - rss_before) / 1e3:.0f} MB, including the scan texts)")
+
+    print(f"{'query':>14} {'matches':>8} {'p50 ms':>8} {'max ms':>8} {'scan ms':>9}")
+    for name, query, filters in QUERIES:
+        p50, worst, (hits, total) = latency_ms(lambda: index.search(query, limit=20, **filters))
+        # The scan only does whole word substring matching, the floor of what a client side search costs
+        scan_ms, _, _ = latency_ms(lambda: scan(texts, products, query, filters), repeat=1)
+        print(f"{name:>14} {total:>8} {p50:>8.2f} {worst:>8.2f} {scan_ms:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark: /products/suggest lookup latency, throughput and index size.
+
+Builds SuggestIndex over a synthetic catalog (1M products by default) with
+three to five word names drawn from a Zipf distributed vocabulary and
+random units sold, then replays typed prefixes (1 to 12 characters of
+random names, from any of their first words) and reports p50/p99 latency
+and single thread lookups/sec, once on a fresh snapshot and once with a
+full overlay of pending changes (the slowest state before a rebuild).
+
+Run from the product-service directory:
+
+    python bench_product_suggest.py
+"""
+from types import SimpleNamespace
+import itertools
+import os
+import random
+import time
+
+import numpy as np
+
+import suggest
+from suggest import SuggestIndex, SUGGEST_OVERLAY_MAX
+
+BENCH_PRODUCTS = int(os.getenv("BENCH_PRODUCTS", "1000000"))
+BENCH_QUERIES = int(os.getenv("BENCH_QUERIES", "100000"))
+VOCABULARY = 5000
+
+
+def make_catalog(rng: random.Random):
+    syllables = ["ka", "lo", "mi", "ne", "ro", "sa", "ti", "vu", "ze", "por", "len", "dar", "ish", "wen"]
+    words = sorted({"".join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(VOCABULARY * 2)})[:VOCABULARY]
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    products = {}
+    for product_id in range(1, BENCH_PRODUCTS + 1):
+        products[product_id] = (" ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 5))).title(), rng.randint(0, 500))
+    # A long tail of sales, most products never sold
+    units = {product_id: int(rng.paretovariate(1.2)) for product_id in rng.sample(range(1, BENCH_PRODUCTS + 1), BENCH_PRODUCTS // 5)}
+    return products, units
+
+
+def make_queries(rng: random.Random, products: dict) -> list:
+    queries = []
+    for _ in range(BENCH_QUERIES):
+        words = products[rng.randint(1, BENCH_PRODUCTS)][0].lower().split()
+        text = " ".join(words[rng.randrange(min(len(words), 3)):])
+        queries.append(text[:rng.randint(1, 12)])
+    return queries
+
+
+def replay(index: SuggestIndex, queries: list):
+    latencies = np.empty(len(queries))
+    started = time.perf_counter()
+    for i, query in enumerate(queries):
+        t = time.perf_counter()
+        index.suggest(query, 10)
+        latencies[i] = time.perf_counter() - t
+    elapsed = time.perf_counter() - started
+    p50, p99, worst = np.percentile(latencies, [50, 99, 100]) * 1e6
+    return p50, p99, worst, len(queries) / elapsed
+
+
+def main():
+    rng = random.Random(42)
+    products, units = make_catalog(rng)
+    queries = make_queries(rng, products)
+
+    index = SuggestIndex()
+    index._products, index._units = products, units
+    index.rebuild()
+    stats = index.stats()
+    print(f"{BENCH_PRODUCTS} products, {stats['keys']} keys, {stats['precomputed_prefixes']} precomputed prefixes, "
+          f"built in {stats['last_build_ms'] / 1000:.1f}s, {stats['memory_bytes'] / 1e6:.1f} MB")
+
+    print(f"{'state':>14} {'p50 us':>8} {'p99 us':>8} {'max us':>8} {'lookups/s':>10}")
+    p50, p99, worst, rate = replay(index, queries)
+    print(f"{'snapshot':>14} {p50:>8.1f} {p99:>8.1f} {worst:>8.0f} {rate:>10.0f}")
+
+    # Pending renames of popular products, all of them masking snapshot entries
+    for product_id in sorted(units, key=units.get, reverse=True)[:SUGGEST_OVERLAY_MAX]:
+        index.upsert(SimpleNamespace(id=product_id, name=products[product_id][0] + " Plus",
+                                     stock_quantity=products[product_id][1], is_active=True))
+    p50, p99, worst, rate = replay(index, queries)
+    print(f"{'full overlay':>14} {p50:>8.1f} {p99:>8.1f} {worst:>8.0f} {rate:>10.0f}")
+    print(f"slow path queries: {index.slow_queries}, ranking depth {suggest.TOP_DEPTH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+from typing import Dict, List, Optional
+import os
+
+import numpy as np
+
+from models import Product, ProductRead
+from crud import ProductSort
+from snapshot import ColumnarSnapshot, to_micros
+
+# Serve filtered listings from the in-process snapshot instead of the database
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", "true").lower() == "true"
+
+
+class CatalogSnapshot(ColumnarSnapshot):
+    """Columnar in-memory copy of the product table.
+
+    Every filterable/sortable field lives in its own NumPy array, categories
+    are dictionary encoded to int codes, so a listing is a few vectorized
+    comparisons with no database round trip. Sorted listings walk a
+    permutation per sort key, built lazily and dropped only when a change
+    touches that key (stock updates keep them). Rows are
+    upserted in place as product events arrive, deletes leave a tombstone
+    until a compaction.
+    """
+
+    LABEL = "Catalog snapshot"
+    COLUMNS = {"_ids": np.int64, "_price": np.float64, "_stock": np.int64, "_active": bool, "_category": np.int32,
+               "_created": np.int64, "_updated": np.int64, "_alive": bool, "_names": object}
+    STATE = ColumnarSnapshot.STATE + ("_rows", "_orders", "_id_ordered")
+
+    def _reset(self, capacity: int):
+        super()._reset(capacity)
+        self._rows: List[Optional[dict]] = [None] * len(self._ids)
+        # Positions ordered by (sort key, id), per sort, None for id order
+        self._orders: Dict[Optional[ProductSort], np.ndarray] = {}
+        # Position order is id order until an event inserts an id below the last one
+        self._id_ordered = True
+
+    def _grow(self):
+        super()._grow()
+        self._rows.extend([None] * (len(self._ids) - len(self._rows)))
+
+    def _write(self, product: Product):
+        position = self._positions.get(product.id)
+        if position is None:
+            if self.size == len(self._ids):
+                self._grow()
+            position = self.size
+            if position and product.id < self._ids[position - 1]:
+                self._id_ordered = False
+            self.size += 1
+            self._positions[product.id] = position
+            self._orders.clear()
+        else:
+            if self._price[position] != product.price:
+                self._orders.pop(ProductSort.PRICE, None)
+            if self._names[position] != product.name:
+                self._orders.pop(ProductSort.NAME, None)
+
+        self._ids[position] = product.id
+        self._price[position] = product.price
+        self._stock[position] = product.stock_quantity
+        self._active[position] = product.is_active
+        self._category[position] = self._category_code(product.category)
+        self._created[position] = to_micros(product.created_at)
+        self._updated[position] = to_micros(product.updated_at)
+        self._alive[position] = True
+        self._names[position] = product.name
+        self._rows[position] = ProductRead.model_validate(product).model_dump()
+
+    def _remove(self, product_id: int) -> bool:
+        position = self._positions.pop(product_id, None)
+        if position is None:
+            return False
+        self._alive[position] = False
+        self._rows[position] = None
+        self.version += 1
+        # Compact once a quarter of the rows are tombstones
+        if self.size - len(self._positions) > self.size // 4:
+            self._compact()
+        return True
+
+    def get_many(self, product_ids: List[int]) -> List[dict]:
+        """Rows of the given products in the given order, unknown ids are skipped"""
+        with self._lock:
+            positions = [self._positions.get(product_id) for product_id in product_ids]
+            return [self._rows[position] for position in positions if position is not None]
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive[:self.size])
+        rows = [self._rows[position] for position in keep]
+        for name in self.COLUMNS:
+            array = getattr(self, name)
+            array[:len(keep)] = array[keep]
+            array[len(keep):self.size] = 0 if array.dtype != object else None
+        self._rows[:self.size] = rows + [None] * (self.size - len(keep))
+        self.size = len(keep)
+        self._orders.clear()
+        self._positions = {int(product_id): position for position, product_id in enumerate(self._ids[:self.size])}
+
+    def query(
+        self,
+        category: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        is_active: Optional[bool] = None,
+        sort: Optional[ProductSort] = None,
+        descending: bool = False,
+        skip: int = 0,
+        limit: int = 100,
+    ) -> List[dict]:
+        """Filter, sort and slice the catalog, same semantics as the SQL listing"""
+        with self._lock:
+            self.queries += 1
+            n = self.size
+            mask = self._alive[:n].copy()
+            if category:
+                code = self._category_codes.get(category)
+                if code is None:
+                    return []
+                mask &= self._category[:n] == code
+            if min_price is not None:
+                mask &= self._price[:n] >= min_price
+            if max_price is not None:
+                mask &= self._price[:n] <= max_price
+            if is_active is not None:
+                mask &= self._active[:n] == is_active
+
+            if sort is None and self._id_ordered:
+                positions = np.flatnonzero(mask)
+            else:
+                order = self._order(sort)
+                if descending and sort is not None:
+                    order = order[::-1]
+                positions = order[mask[order]]
+
+            return [self._rows[position] for position in positions[skip:skip + limit]]
+
+    def _order(self, sort: Optional[ProductSort]) -> np.ndarray:
+        order = self._orders.get(sort)
+        if order is None and sort is None:
+            order = self._orders[sort] = np.argsort(self._ids[:self.size], kind="stable")
+        elif order is None:
+            n = self.size
+            keys = {
+                ProductSort.PRICE: self._price,
+                ProductSort.CREATED_AT: self._created,
+                ProductSort.NAME: self._names,
+            }[sort][:n]
+            # Ties broken by id, like the (sort key, id) order of the SQL listing
+            order = self._orders[sort] = np.lexsort((self._ids[:n], keys))
+        return order
+
+    def stats(self) -> dict:
+        return {
+            "enabled": CATALOG_SNAPSHOT,
+            "version": self.version,
+            "rows": len(self._positions),
+            "tombstones": self.size - len(self._positions),
+            "categories": len(self._categories),
+            "column_bytes": self.column_bytes(),
+            "queries": self.queries,
+            "reloads": self.reloads,
+            "drifts": self.drifts,
+            "ready": self.ready,
+            "loaded_at": self.loaded_at,
+        }
@@ -0,0 +1,77 @@
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from datetime import datetime
+from enum import Enum
+from typing import Dict, Optional, Tuple, Any
+
+from models import Product, ProductSales
+
+
+class ProductSort(str, Enum):
+    PRICE = "price"
+    CREATED_AT = "created_at"
+    NAME = "name"
+
+
+def filter_products(query, category: Optional[str] = None, min_price: Optional[float] = None,
+                    max_price: Optional[float] = None, is_active: Optional[bool] = None):
+    """Apply the listing filters shared by every product listing mode"""
+    if category:
+        query = query.where(Product.category == category)
+    if min_price is not None:
+        query = query.where(Product.price >= min_price)
+    if max_price is not None:
+        query = query.where(Product.price <= max_price)
+    if is_active is not None:
+        query = query.where(Product.is_active == is_active)
+    return query
+
+
+def product_page_query(
+    sort: ProductSort,
+    descending: bool,
+    limit: int,
+    after: Optional[Tuple[Any, int]] = None,
+    **filters
+):
+    """Keyset page of products ordered by (sort key, id).
+
+    `after` is the (sort key, id) of the last row of the previous page, so
+    the database seeks straight into the matching composite index instead of
+    scanning and discarding every skipped row like OFFSET does.
+    The query fetches limit + 1 rows to tell whether there is a next page.
+    """
+    sort_column = getattr(Product, sort.value)
+    query = filter_products(select(Product), **filters)
+
+    if after is not None:
+        position = tuple_(sort_column, Product.id)
+        query = query.where(position < after if descending else position > after)
+
+    if descending:
+        query = query.order_by(sort_column.desc(), Product.id.desc())
+    else:
+        query = query.order_by(sort_column, Product.id)
+    return query.limit(limit + 1)
+
+
+async def record_sales(session: AsyncSession, units: Dict[int, int]):
+    """Add sold units per product in one upsert"""
+    dialect = session.bind.dialect.name
+    insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+    now = datetime.utcnow()
+    statement = insert(ProductSales).values([
+        {"product_id": product_id, "units_sold": quantity, "updated_at": now}
+        for product_id, quantity in units.items()
+    ])
+    await session.exec(statement.on_conflict_do_update(
+        index_elements=[ProductSales.product_id],
+        set_={
+            "units_sold": ProductSales.units_sold + statement.excluded.units_sold,
+            "updated_at": statement.excluded.updated_at,
+        }
+    ))
+    await session.commit()
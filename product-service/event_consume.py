@@ -0,0 +1,77 @@
+import os
+import logging
+from collections import Counter
+from shared.kafka_client import KafkaConsumer
+from shared.kafka_events import EventType
+from shared.event_dedup import EventDeduplicator
+
+from database import async_session_maker
+from models import Product
+from crud import record_sales
+
+logger = logging.getLogger(__name__)
+
+# No group id: every replica keeps its own catalog snapshot and search index
+catalog_consumer = KafkaConsumer(
+    bootstrap_servers=os.getenv("KAFKA_BROKER", "localhost:9092"),
+    group_id=None
+)
+
+# One replica counts each order, redeliveries must not count it twice
+sales_dedup = EventDeduplicator(session_maker=async_session_maker)
+sales_consumer = KafkaConsumer(
+    bootstrap_servers=os.getenv("KAFKA_BROKER", "localhost:9092"),
+    group_id="product-service-sales",
+    dedup=sales_dedup
+)
+
+
+async def start_catalog_consumer(*views):
+    """Apply product changes made through any replica to the local in-memory views
+    (catalog snapshot, search index), each has upsert(product) and remove(product_id)"""
+    product_events = {
+        EventType.PRODUCT_CREATED.value,
+        EventType.PRODUCT_UPDATED.value,
+        EventType.PRODUCT_STOCK_UPDATED.value,
+        EventType.PRODUCT_DELETED.value,
+    }
+
+    async def message_handler(message: dict):
+        if message.get("event_type") not in product_events:
+            return
+        product_id = message.get("data", {}).get("product_id")
+        if product_id is None:
+            return
+        # The event only says what changed, the row itself is the source of truth
+        async with async_session_maker() as session:
+            product = await session.get(Product, product_id)
+        for view in views:
+            if product is None:
+                view.remove(product_id)
+            else:
+                view.upsert(product)
+
+    try:
+        await catalog_consumer.consumer(["products"], message_handler)
+    except Exception as e:
+        # verify() still reloads the views when they drift from the database
+        logger.error(f"Catalog consumer stopped: {e}")
+
+
+async def start_sales_consumer():
+    """Sum units sold per product from order.created events into product_sales"""
+
+    async def message_handler(message: dict):
+        if message.get("event_type") != EventType.ORDER_CREATED.value:
+            return
+        units = Counter()
+        for item in message.get("data", {}).get("items", []):
+            units[item["product_id"]] += item["quantity"]
+        if units:
+            async with async_session_maker() as session:
+                await record_sales(session, units)
+
+    try:
+        await sales_consumer.consumer(["orders"], message_handler)
+    except Exception as e:
+        logger.error(f"Sales consumer stopped: {e}")
@@ -0,0 +1,58 @@
+import os
+from shared.kafka_client import KafkaClient
+from shared.kafka_events import EventType
+
+class EventHandler:
+    def __init__(self):
+        self.kafka_client = KafkaClient(
+            bootstrap_servers=os.getenv("KAFKA_BROKER", "localhost:9092"),
+            producer_name="product-service"
+        )
+
+    @staticmethod
+    def product_data(product) -> dict:
+        """Event payload for a product row"""
+        return {
+            "product_id": product.id,
+            "name": product.name,
+            "category": product.category,
+            "price": product.price,
+            "stock_quantity": product.stock_quantity,
+            "is_active": product.is_active
+        }
+
+    async def send_product_created(self, product_data: dict):
+        """Send product created event"""
+        await self.kafka_client.send_event(
+            topic="products",
+            event_type=EventType.PRODUCT_CREATED.value,
+            data=product_data,
+            key=str(product_data["product_id"])
+        )
+
+    async def send_product_updated(self, product_data: dict):
+        """Send product updated event"""
+        await self.kafka_client.send_event(
+            topic="products",
+            event_type=EventType.PRODUCT_UPDATED.value,
+            data=product_data,
+            key=str(product_data["product_id"])
+        )
+
+    async def send_product_stock_updated(self, product_data: dict):
+        """Send product stock updated event"""
+        await self.kafka_client.send_event(
+            topic="products",
+            event_type=EventType.PRODUCT_STOCK_UPDATED.value,
+            data=product_data,
+            key=str(product_data["product_id"])
+        )
+
+    async def send_product_deleted(self, product_id: int):
+        """Send product deleted event"""
+        await self.kafka_client.send_event(
+            topic="products",
+            event_type=EventType.PRODUCT_DELETED.value,
+            data={"product_id": product_id},
+            key=str(product_id)
+        )
@@ -1,12 +1,23 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Query
+from fastapi import FastAPI, Depends, HTTPException, status, Query, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from sqlmodel import Session, select
 from typing import List, Optional
+from datetime import datetime
+import asyncio
 import logging
 import os
 
-from models import Product, ProductBase, ProductCreate, ProductRead, ProductUpdate
+from models import Product, ProductBase, ProductCreate, ProductRead, ProductUpdate, ProductBatchRequest, ProductBatchRead, ProductPage, ProductExport, ProductSearchResults, ProductSuggestion
 from database import get_session, engine, create_db_and_tables
+from event_handler import EventHandler
+from crud import ProductSort, filter_products, product_page_query
+from catalog import CatalogSnapshot, CATALOG_SNAPSHOT
+from search import SearchIndex, SEARCH_INDEX
+from snapshot import run_verifier
+from suggest import SuggestIndex, SUGGEST_INDEX, SUGGEST_MAX_RESULTS
+import event_consume
+from shared.pagination import encode_cursor, decode_cursor, InvalidCursor
+from shared.export import export_response
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -14,6 +25,17 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Product Service", desctiption="Product Service for ML Powerd E-commerce")
 
+event_handler = EventHandler()
+
+# In-process columnar copy of the catalog for filtered listings
+catalog = CatalogSnapshot()
+
+# In-process inverted index over product names and descriptions
+search_index = SearchIndex()
+
+# In-process prefix index of product names for type-ahead
+suggest_index = SuggestIndex()
+
 # CORS Middleware
 app.add_middleware(
     CORSMiddleware,
@@ -38,18 +60,62 @@ def on_startup():
     else:
         logger.info("Skipping database seeding")
 
+    views = []
+    if CATALOG_SNAPSHOT:
+        views.append(catalog)
+    if SEARCH_INDEX:
+        views.append(search_index)
+    for view in views:
+        # Loaded in a worker thread, the database serves until it is ready
+        asyncio.create_task(run_verifier(view, engine))
+    if SUGGEST_INDEX:
+        # Loaded in a worker thread and reloaded on its own schedule, which also picks up drift and new sales
+        asyncio.create_task(suggest_index.run_rebuilder(engine))
+        asyncio.create_task(event_consume.start_sales_consumer())
+        views.append(suggest_index)
+    if views:
+        # Changes made through other replicas arrive as product events
+        asyncio.create_task(event_consume.start_catalog_consumer(*views))
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Flush events still sitting in the producer batches
+    await event_handler.kafka_client.stop()
+
 
 @app.get("/health", tags=["Health"])
 def health_check():
     return {"status": "ok", "service": "product-service"}
 
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "kafka_producer": event_handler.kafka_client.stats(),
+        "catalog": catalog.stats(),
+        "search_index": search_index.stats(),
+        "suggest_index": suggest_index.stats(),
+        "sales_consumer": event_consume.sales_consumer.stats(),
+        "catalog_consumer": event_consume.catalog_consumer.stats(),
+    }
+
 # Create product
 @app.post("/products/", response_model=ProductRead, status_code=status.HTTP_201_CREATED)
-def create_product(product: ProductCreate, session: Session = Depends(get_session)):
+def create_product(product: ProductCreate, background_tasks: BackgroundTasks, session: Session = Depends(get_session)):
     db_product = Product.from_orm(product)
     session.add(db_product)
     session.commit()
     session.refresh(db_product)
+    if CATALOG_SNAPSHOT:
+        catalog.upsert(db_product)
+    if SEARCH_INDEX:
+        search_index.upsert(db_product)
+    if SUGGEST_INDEX:
+        suggest_index.upsert(db_product)
+
+    # Publish after the response is sent, the gateway drops its cached listings on it
+    background_tasks.add_task(event_handler.send_product_created, EventHandler.product_data(db_product))
     return db_product
 
 
@@ -61,23 +127,157 @@ def get_products(
     category: Optional[str] = Query(None),
     min_price: Optional[float] = Query(None, ge=0),
     max_price: Optional[float] = Query(None, ge=0),
-    session: Session = Depends(get_session)
+    sort: Optional[ProductSort] = None,
+    descending: bool = False
 ):
+    if CATALOG_SNAPSHOT and catalog.ready:
+        # Vectorized filter over the in-memory snapshot, no database round trip
+        return catalog.query(
+            category=category, min_price=min_price, max_price=max_price,
+            sort=sort, descending=descending, skip=skip, limit=limit
+        )
 
-    query = select(Product)
-    if category:
-        query = query.where(Product.category == category)
-    if min_price is not None:
-        query = query.where(Product.price >= min_price)
-    if max_price is not None:
-        query = query.where(Product.price <= max_price)
+    with Session(engine) as session:
+        query = filter_products(select(Product), category=category, min_price=min_price, max_price=max_price)
+        if sort is not None:
+            sort_column = getattr(Product, sort.value)
+            if descending:
+                query = query.order_by(sort_column.desc(), Product.id.desc())
+            else:
+                query = query.order_by(sort_column, Product.id)
 
-    query = query.offset(skip).limit(limit)
-    products = session.exec(query).all()
+        query = query.offset(skip).limit(limit)
+        products = session.exec(query).all()
 
     return products
 
 
+# Get products page by page with a cursor, latency doesn't grow with page depth
+@app.get("/products/page", response_model=ProductPage)
+def get_products_page(
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    sort: ProductSort = ProductSort.PRICE,
+    descending: bool = False,
+    category: Optional[str] = Query(None),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    is_active: Optional[bool] = Query(None),
+    session: Session = Depends(get_session)
+):
+    after = None
+    if cursor:
+        # The cursor carries the sort it was issued for, it can't be reused with another one
+        try:
+            cursor_sort, sort_value, product_id = decode_cursor(cursor, 3)
+            if cursor_sort != sort.value:
+                raise InvalidCursor("Cursor was issued for another sort order")
+            # Values go straight into the keyset comparison, they must have the column's type
+            if sort == ProductSort.CREATED_AT:
+                sort_value = datetime.fromisoformat(sort_value)
+            elif sort == ProductSort.PRICE:
+                sort_value = float(sort_value)
+            elif not isinstance(sort_value, str):
+                raise InvalidCursor("Invalid cursor")
+            after = (sort_value, int(product_id))
+        except (InvalidCursor, TypeError, ValueError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+
+    query = product_page_query(
+        sort, descending, limit, after,
+        category=category, min_price=min_price, max_price=max_price, is_active=is_active
+    )
+    products = session.exec(query).all()
+
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        next_cursor = encode_cursor(sort.value, getattr(last, sort.value), last.id)
+
+    return {"products": products, "next_cursor": next_cursor}
+
+
+# Full-text search over name and description, BM25 ranked
+@app.get("/products/search", response_model=ProductSearchResults)
+def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    category: Optional[str] = Query(None),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    is_active: Optional[bool] = Query(None)
+):
+    if not SEARCH_INDEX:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Search is disabled"
+        )
+    if not search_index.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Search index is still loading"
+        )
+
+    hits, total = search_index.search(
+        q, category=category, min_price=min_price, max_price=max_price,
+        is_active=is_active, skip=skip, limit=limit
+    )
+    scores = dict(hits)
+    if CATALOG_SNAPSHOT and catalog.ready:
+        rows = catalog.get_many(list(scores))
+    else:
+        with Session(engine) as session:
+            products = {product.id: product for product in session.exec(select(Product).where(Product.id.in_(scores))).all()}
+        rows = [ProductRead.model_validate(products[product_id]).model_dump() for product_id in scores if product_id in products]
+
+    return {"products": [{**row, "score": scores[row["id"]]} for row in rows], "total": total}
+
+
+# Type-ahead completions of product names, most sold first
+@app.get("/products/suggest", response_model=List[ProductSuggestion])
+def suggest_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(SUGGEST_MAX_RESULTS, ge=1, le=SUGGEST_MAX_RESULTS)
+):
+    if not SUGGEST_INDEX:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Suggestions are disabled"
+        )
+    if not suggest_index.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Suggest index is still loading"
+        )
+    return [
+        {"id": product_id, "name": name, "units_sold": units_sold}
+        for product_id, name, units_sold in suggest_index.suggest(q, limit)
+    ]
+
+
+# Get many products by ID in one query
+@app.post("/products/batch", response_model=ProductBatchRead)
+def get_products_batch(batch: ProductBatchRequest, session: Session = Depends(get_session)):
+    ids = set(batch.ids)
+    products = session.exec(select(Product).where(Product.id.in_(ids))).all()
+    found = {product.id for product in products}
+    return {
+        "products": products,
+        "missing": sorted(ids - found)
+    }
+
+
+# Stream the whole catalog as NDJSON for the ML feature jobs
+@app.get("/products/export")
+def export_products(updated_since: Optional[datetime] = None):
+    return export_response(engine, Product, ProductExport, updated_since)
+
+
 # Get product by ID
 @app.get("/products/{product_id}", response_model=ProductRead)
 def get_product(product_id: int, session: Session = Depends(get_session)):
@@ -91,7 +291,7 @@ def get_product(product_id: int, session: Session = Depends(get_session)):
 
 # Update product by ID
 @app.patch("/products/{product_id}", response_model=ProductRead)
-def update_product(product_id: int, product_update: ProductUpdate, session: Session = Depends(get_session)):
+def update_product(product_id: int, product_update: ProductUpdate, background_tasks: BackgroundTasks, session: Session = Depends(get_session)):
     db_product = session.get(Product, product_id)
     if not db_product:
         raise HTTPException(
@@ -102,15 +302,29 @@ def update_product(product_id: int, product_update: ProductUpdate, session: Sess
     for key, value in product_data.items():
         setattr(db_product, key, value)
 
+    db_product.updated_at = datetime.utcnow()
+
     session.add(db_product)
     session.commit()
     session.refresh(db_product)
+    if CATALOG_SNAPSHOT:
+        catalog.upsert(db_product)
+    if SEARCH_INDEX:
+        search_index.upsert(db_product)
+    if SUGGEST_INDEX:
+        suggest_index.upsert(db_product)
+
+    # A stock only change gets its own event type, consumers can handle it more cheaply
+    if set(product_data) == {"stock_quantity"}:
+        background_tasks.add_task(event_handler.send_product_stock_updated, EventHandler.product_data(db_product))
+    else:
+        background_tasks.add_task(event_handler.send_product_updated, EventHandler.product_data(db_product))
     return db_product
 
 
 # Delete product by ID
 @app.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_product(product_id: int, session: Session = Depends(get_session)):
+def delete_product(product_id: int, background_tasks: BackgroundTasks, session: Session = Depends(get_session)):
     product = session.get(Product, product_id)
     if not product:
         raise HTTPException(
@@ -119,6 +333,14 @@ def delete_product(product_id: int, session: Session = Depends(get_session)):
         )
     session.delete(product)
     session.commit()
+    if CATALOG_SNAPSHOT:
+        catalog.remove(product_id)
+    if SEARCH_INDEX:
+        search_index.remove(product_id)
+    if SUGGEST_INDEX:
+        suggest_index.remove(product_id)
+
+    background_tasks.add_task(event_handler.send_product_deleted, product_id)
     return {"detail": "Product deleted successfully"}
 
 
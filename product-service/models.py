@@ -1,5 +1,6 @@
 from sqlmodel import SQLModel, Field
-from typing import Optional
+from sqlalchemy import Index
+from typing import Optional, List
 from datetime import datetime
 
 class ProductBase(SQLModel):
@@ -11,8 +12,26 @@ class ProductBase(SQLModel):
     is_active: bool = Field(default=True)
 
 class Product(ProductBase, table=True):
+    # Composite indexes matching the listing filter + keyset sort shapes
+    __table_args__ = (
+        Index("ix_product_category_price_id", "category", "price", "id"),
+        Index("ix_product_category_created_at_id", "category", "created_at", "id"),
+        Index("ix_product_category_name_id", "category", "name", "id"),
+        Index("ix_product_price_id", "price", "id"),
+        Index("ix_product_created_at_id", "created_at", "id"),
+        Index("ix_product_is_active_category", "is_active", "category"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+# Units sold per product, summed from order.created events
+class ProductSales(SQLModel, table=True):
+    __tablename__ = "product_sales"
+
+    product_id: int = Field(primary_key=True)
+    units_sold: int = Field(default=0, ge=0)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ProductCreate(ProductBase):
@@ -22,10 +41,44 @@ class ProductRead(ProductBase):
     id: int
     created_at: datetime
 
+# Bulk export row, carries updated_at so incremental pulls can move their watermark
+class ProductExport(ProductRead):
+    updated_at: datetime
+
 class ProductUpdate(SQLModel):
     name: Optional[str] = None
     description: Optional[str] = None
     price: Optional[float] = None
     category: Optional[str] = None
     stock_quantity: Optional[int] = None
-    is_active: Optional[bool] = None
\ No newline at end of file
+    is_active: Optional[bool] = None
+
+# Batch lookup of many products by id in a single query
+class ProductBatchRequest(SQLModel):
+    ids: List[int] = Field(min_length=1, max_length=1000)
+
+class ProductBatchRead(SQLModel):
+    products: List[ProductRead]
+    missing: List[int]
+
+
+# One keyset page of products
+class ProductPage(SQLModel):
+    products: List[ProductRead]
+    next_cursor: Optional[str] = None
+
+
+# A full-text search match, best score first
+class ProductSearchHit(ProductRead):
+    score: float
+
+class ProductSearchResults(SQLModel):
+    products: List[ProductSearchHit]
+    total: int
+
+
+# A name completion, most sold first
+class ProductSuggestion(SQLModel):
+    id: int
+    name: str
+    units_sold: int
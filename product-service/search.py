@@ -0,0 +1,284 @@
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import bisect
+import heapq
+import math
+import os
+import re
+import sys
+
+import numpy as np
+
+from models import Product
+from snapshot import ColumnarSnapshot, to_micros
+
+# Serve /products/search from the in-process inverted index
+SEARCH_INDEX = os.getenv("SEARCH_INDEX", "true").lower() == "true"
+# A name token counts this many times a description token
+SEARCH_NAME_BOOST = int(os.getenv("SEARCH_NAME_BOOST", "3"))
+# The last query token also matches terms it is a prefix of, once it has this many characters
+SEARCH_MIN_PREFIX = int(os.getenv("SEARCH_MIN_PREFIX", "2"))
+# Most frequent terms a prefix expands to
+SEARCH_MAX_EXPANSIONS = int(os.getenv("SEARCH_MAX_EXPANSIONS", "50"))
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+STOPWORDS = frozenset("a an and are as at be by for from in is it of on or the this to with".split())
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+class SearchIndex(ColumnarSnapshot):
+    """In-memory inverted index over product name and description.
+
+    Each term maps to a posting list of (document position, weighted term
+    frequency) kept in compact typed arrays. An update appends the product
+    as a new document and tombstones the old one, so posting lists only
+    ever grow at the end; a compaction rewrites them once a quarter of the
+    documents are tombstones. Document frequencies include tombstoned
+    postings until then, and so does the document count of the idf, so it
+    stays positive. Category, price and is_active are kept per
+    document so filters are applied before ranking, not after the top k.
+    """
+
+    LABEL = "Search index"
+    COLUMNS = {"_ids": np.int64, "_lengths": np.float32, "_price": np.float64, "_active": bool,
+               "_category": np.int32, "_updated": np.int64, "_alive": bool}
+    STATE = ColumnarSnapshot.STATE + ("total_length", "_postings", "_terms")
+
+    def __init__(self):
+        super().__init__()
+        self.compactions = 0
+
+    def _reset(self, capacity: int):
+        super()._reset(capacity)
+        self.total_length = 0.0
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        # Sorted vocabulary for prefix lookups, rebuilt lazily after new terms
+        self._terms: Optional[List[str]] = None
+
+    def _tombstone(self, position: int):
+        self._alive[position] = False
+        self.total_length -= float(self._lengths[position])
+
+    def _write(self, product: Product):
+        previous = self._positions.get(product.id)
+        if previous is not None:
+            self._tombstone(previous)
+        if self.size == len(self._ids):
+            self._grow()
+        position = self.size
+        self.size += 1
+        self._positions[product.id] = position
+
+        name_tokens = tokenize(product.name)
+        description_tokens = tokenize(product.description)
+        frequencies = Counter(description_tokens)
+        for token in name_tokens:
+            frequencies[token] += SEARCH_NAME_BOOST
+        for term, frequency in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("i"), array("f"))
+                self._terms = None
+            postings[0].append(position)
+            postings[1].append(frequency)
+
+        length = SEARCH_NAME_BOOST * len(name_tokens) + len(description_tokens)
+        self.total_length += length
+        self._ids[position] = product.id
+        self._lengths[position] = length
+        self._price[position] = product.price
+        self._active[position] = product.is_active
+        self._category[position] = self._category_code(product.category)
+        self._updated[position] = to_micros(product.updated_at)
+        self._alive[position] = True
+
+    def _remove(self, product_id: int) -> bool:
+        position = self._positions.pop(product_id, None)
+        if position is None:
+            return False
+        self._tombstone(position)
+        self.version += 1
+        return True
+
+    def _changed(self):
+        if self.size - len(self._positions) > max(self.size // 4, 64):
+            self._compact()
+
+    def _compact(self):
+        alive = self._alive[:self.size]
+        keep = np.flatnonzero(alive)
+        remap = (np.cumsum(alive) - 1).astype(np.int32)
+        for term in list(self._postings):
+            positions, frequencies = self._postings[term]
+            current = np.frombuffer(positions, dtype=np.int32)
+            live = alive[current]
+            if not live.any():
+                del self._postings[term]
+                continue
+            new_positions, new_frequencies = array("i"), array("f")
+            new_positions.frombytes(remap[current[live]].tobytes())
+            new_frequencies.frombytes(np.frombuffer(frequencies, dtype=np.float32)[live].tobytes())
+            del current
+            self._postings[term] = (new_positions, new_frequencies)
+
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            column[:len(keep)] = column[keep]
+            column[len(keep):self.size] = 0
+        self.size = len(keep)
+        self._positions = {int(product_id): position for position, product_id in enumerate(self._ids[:self.size])}
+        self._terms = None
+        self.compactions += 1
+
+    def _expand(self, token: str, prefix: bool) -> List[str]:
+        """The terms a query token matches: itself, plus the terms it prefixes"""
+        if not prefix or len(token) < SEARCH_MIN_PREFIX:
+            return [token] if token in self._postings else []
+        if self._terms is None:
+            self._terms = sorted(self._postings)
+        start = bisect.bisect_left(self._terms, token)
+        end = bisect.bisect_left(self._terms, token + "\uffff", start)
+        terms = self._terms[start:end]
+        if len(terms) > SEARCH_MAX_EXPANSIONS:
+            terms = heapq.nlargest(SEARCH_MAX_EXPANSIONS, terms, key=lambda term: len(self._postings[term][0]))
+        return terms
+
+    def _bm25(self, positions: np.ndarray, frequencies: np.ndarray, idf: float, average_length: float) -> np.ndarray:
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[positions] / average_length)
+        return idf * frequencies * (BM25_K1 + 1) / (frequencies + norm)
+
+    def search(
+        self,
+        text: str,
+        category: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        is_active: Optional[bool] = None,
+        skip: int = 0,
+        limit: int = 20,
+    ) -> Tuple[List[Tuple[int, float]], int]:
+        """BM25 ranked (product id, score) matches of every query token, and the total match count.
+
+        The last token also matches as a prefix, as the user may still be typing it.
+        """
+        tokens = list(dict.fromkeys(tokenize(text)))
+        if not tokens:
+            return [], 0
+
+        with self._lock:
+            self.queries += 1
+            documents = len(self._positions)
+            if not documents:
+                return [], 0
+            average_length = max(self.total_length / documents, 1.0)
+            # Posting lists still hold tombstoned documents, the idf counts them on both sides
+            indexed = self.size
+
+            # Per token, the sorted positions of the matching documents and either their
+            # term frequencies and idf (one term, scored lazily) or their scores (prefix)
+            groups = []
+            for i, token in enumerate(tokens):
+                # A trailing space means the last word is complete
+                terms = self._expand(token, prefix=i == len(tokens) - 1 and not text[-1].isspace())
+                if not terms:
+                    return [], 0
+                term_postings = []
+                for term in terms:
+                    positions, frequencies = self._postings[term]
+                    positions = np.frombuffer(positions, dtype=np.int32)
+                    idf = math.log(1 + (indexed - len(positions) + 0.5) / (len(positions) + 0.5))
+                    term_postings.append((positions, np.frombuffer(frequencies, dtype=np.float32), idf))
+                if len(term_postings) == 1:
+                    groups.append(term_postings[0])
+                    continue
+
+                positions = np.concatenate([postings[0] for postings in term_postings])
+                scores = np.concatenate([
+                    self._bm25(postings[0], postings[1], postings[2], average_length) for postings in term_postings
+                ])
+                if len(positions) > self.size // 16:
+                    # Dense accumulation beats sorting this many postings
+                    summed = np.bincount(positions, weights=scores, minlength=self.size)
+                    positions = np.flatnonzero(summed)
+                    groups.append((positions, summed[positions], None))
+                else:
+                    positions, inverse = np.unique(positions, return_inverse=True)
+                    groups.append((positions, np.bincount(inverse, weights=scores), None))
+
+            def group_scores(group, found, candidates):
+                positions, values, idf = group
+                if idf is None:
+                    return values[found]
+                return self._bm25(candidates, values[found], idf, average_length)
+
+            # Intersect from the shortest list, probing the longer ones with a binary search,
+            # only the documents left after the filters get scored
+            groups.sort(key=lambda group: len(group[0]))
+            candidates = groups[0][0]
+            found_per_group = [np.arange(len(candidates))]
+            for positions, _, _ in groups[1:]:
+                found = np.minimum(np.searchsorted(positions, candidates), len(positions) - 1)
+                hit = positions[found] == candidates
+                candidates = candidates[hit]
+                found_per_group = [earlier[hit] for earlier in found_per_group] + [found[hit]]
+
+            # Filters pushed down before ranking
+            mask = self._alive[candidates]
+            if category:
+                code = self._category_codes.get(category)
+                if code is None:
+                    return [], 0
+                mask &= self._category[candidates] == code
+            if min_price is not None:
+                mask &= self._price[candidates] >= min_price
+            if max_price is not None:
+                mask &= self._price[candidates] <= max_price
+            if is_active is not None:
+                mask &= self._active[candidates] == is_active
+            candidates = candidates[mask]
+            scores = sum(group_scores(group, found[mask], candidates) for group, found in zip(groups, found_per_group))
+
+            total = len(candidates)
+            top = skip + limit
+            if total > top:
+                best = np.argpartition(-scores, top - 1)[:top]
+                candidates, scores = candidates[best], scores[best]
+            # Best score first, ties by id
+            ids = self._ids[candidates]
+            order = np.lexsort((ids, -scores))[skip:top]
+            return [(int(ids[i]), float(scores[i])) for i in order], total
+
+    def memory_bytes(self) -> int:
+        """Rough footprint of the posting lists, the vocabulary and the document columns"""
+        with self._lock:
+            postings = sum(
+                sys.getsizeof(term) + sys.getsizeof(positions) + sys.getsizeof(frequencies) + 56
+                for term, (positions, frequencies) in self._postings.items()
+            )
+            return postings + sys.getsizeof(self._postings) + sys.getsizeof(self._positions) + self.column_bytes()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": SEARCH_INDEX,
+            "version": self.version,
+            "documents": len(self._positions),
+            "tombstones": self.size - len(self._positions),
+            "terms": len(self._postings),
+            "queries": self.queries,
+            "reloads": self.reloads,
+            "drifts": self.drifts,
+            "compactions": self.compactions,
+            "memory_bytes": self.memory_bytes(),
+            "ready": self.ready,
+            "loaded_at": self.loaded_at,
+        }
@@ -0,0 +1,188 @@
+from sqlmodel import Session, select, func
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from models import Product
+
+logger = logging.getLogger(__name__)
+
+# How often an in-memory view is checked against the database (and reloaded when it drifted)
+CATALOG_VERIFY_INTERVAL = float(os.getenv("CATALOG_VERIFY_INTERVAL", "60"))
+# Wait before trying a failed first load again
+CATALOG_LOAD_RETRY = float(os.getenv("CATALOG_LOAD_RETRY", "5"))
+
+
+def to_micros(value: datetime) -> int:
+    return int(np.datetime64(value, "us").astype(np.int64))
+
+
+def database_fingerprint(engine) -> Tuple[int, Optional[int]]:
+    """Row count and newest updated_at (in microseconds) of the product table"""
+    with Session(engine) as session:
+        count, newest = session.exec(select(func.count(Product.id), func.max(Product.updated_at))).one()
+    return count, to_micros(newest) if newest is not None else None
+
+
+async def run_verifier(view, engine, interval: float = CATALOG_VERIFY_INTERVAL):
+    """Load an in-memory view of the product table off the event loop, then periodically verify() it"""
+    while not view.ready:
+        try:
+            await asyncio.to_thread(view.load, engine)
+        except Exception as e:
+            logger.error(f"{type(view).__name__} load failed, retrying in {CATALOG_LOAD_RETRY}s: {e}")
+            await asyncio.sleep(CATALOG_LOAD_RETRY)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(view.verify, engine)
+        except Exception as e:
+            logger.error(f"{type(view).__name__} verification failed: {e}")
+
+
+class ColumnarSnapshot:
+    """Lifecycle of a columnar in-memory view of the product table.
+
+    Per product fields live in NumPy arrays (`COLUMNS`, grown together),
+    `_positions` maps a product id to its row and categories are
+    dictionary encoded. Subclasses write and remove rows; this class loads
+    the whole table, keeps it current through upsert()/remove(), and
+    verify() compares row count and newest updated_at with the database. A
+    reload builds a fresh instance aside and swaps its `STATE` in, changes
+    arriving meanwhile are replayed on top.
+    """
+
+    # Name used in log lines
+    LABEL = "Snapshot"
+    # Per row arrays, name to dtype, every view has at least _ids, _updated and _alive
+    COLUMNS: Dict[str, type] = {"_ids": np.int64, "_updated": np.int64, "_alive": bool}
+    # Everything else a reload replaces
+    STATE: Tuple[str, ...] = ("size", "_positions", "_categories", "_category_codes")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = 0
+        self.loaded_at: Optional[float] = None
+        self._reset(0)
+        # Changes seen while a reload runs, a product or a removed id,
+        # and everything seen before the first one
+        self._pending: Optional[list] = []
+
+        self.queries = 0
+        self.reloads = 0
+        self.drifts = 0
+
+    @property
+    def ready(self) -> bool:
+        """Loaded at least once, until then callers use the database"""
+        return self.loaded_at is not None
+
+    def _reset(self, capacity: int):
+        capacity = max(capacity, 64)
+        self.size = 0
+        for name, dtype in self.COLUMNS.items():
+            setattr(self, name, np.empty(capacity, dtype=object) if dtype is object else np.zeros(capacity, dtype=dtype))
+        self._positions: Dict[int, int] = {}
+        self._categories: List[str] = []
+        self._category_codes: Dict[str, int] = {}
+
+    def _grow(self):
+        capacity = len(self._ids) * 2
+        for name in self.COLUMNS:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype) if old.dtype != object else np.empty(capacity, dtype=object)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _category_code(self, category: str) -> int:
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self._categories)
+            self._categories.append(category)
+        return code
+
+    def _write(self, product: Product):
+        raise NotImplementedError
+
+    def _remove(self, product_id: int) -> bool:
+        raise NotImplementedError
+
+    def _changed(self):
+        """Called under the lock after every applied change, e.g. to compact"""
+
+    def load(self, engine):
+        """Build the view from the whole product table, queries and events go on meanwhile"""
+        started = time.perf_counter()
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+        try:
+            fresh = type(self)()
+            with Session(engine) as session:
+                fresh._reset(session.exec(select(func.count(Product.id))).one())
+                for product in session.exec(select(Product).order_by(Product.id).execution_options(yield_per=1000)):
+                    fresh._write(product)
+        except Exception:
+            with self._lock:
+                if self.ready:
+                    self._pending = None
+            raise
+
+        with self._lock:
+            pending, self._pending = self._pending, None
+            for name in self.STATE + tuple(self.COLUMNS):
+                setattr(self, name, getattr(fresh, name))
+            for change in pending:
+                if isinstance(change, int):
+                    self._remove(change)
+                elif self._newer(change):
+                    self._write(change)
+            self._changed()
+            self.version += 1
+            self.loaded_at = time.time()
+            self.reloads += 1
+        logger.info(f"{self.LABEL} loaded {len(self._positions)} products in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    def _newer(self, product: Product) -> bool:
+        # A replayed event may predate the row the reload read
+        position = self._positions.get(product.id)
+        return position is None or to_micros(product.updated_at) >= self._updated[position]
+
+    def upsert(self, product: Product):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(product)
+            self._write(product)
+            self.version += 1
+            self._changed()
+
+    def remove(self, product_id: int):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(product_id)
+            if self._remove(product_id):
+                self._changed()
+
+    def verify(self, engine) -> bool:
+        """Compare with the database, reload when the view drifted (e.g. a missed event)"""
+        count, newest = database_fingerprint(engine)
+        with self._lock:
+            alive = self._alive[:self.size]
+            view_count = int(alive.sum())
+            view_newest = int(self._updated[:self.size][alive].max()) if view_count else None
+        if count == view_count and newest == view_newest:
+            return True
+
+        self.drifts += 1
+        logger.warning(f"{self.LABEL} drifted ({view_count} products vs {count} in the database), reloading")
+        self.load(engine)
+        return False
+
+    def column_bytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.COLUMNS)
@@ -0,0 +1,334 @@
+from sqlmodel import Session, select
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from models import Product, ProductSales
+from search import TOKEN_RE
+
+logger = logging.getLogger(__name__)
+
+# Serve /products/suggest from the in-process prefix index
+SUGGEST_INDEX = os.getenv("SUGGEST_INDEX", "true").lower() == "true"
+# Upper bound of the `limit` a suggest call can ask for
+SUGGEST_MAX_RESULTS = int(os.getenv("SUGGEST_MAX_RESULTS", "10"))
+# A name can be completed from each of its first words, not only the first one
+SUGGEST_MAX_WORD_STARTS = int(os.getenv("SUGGEST_MAX_WORD_STARTS", "4"))
+# Prefixes matching more keys than this get their best completions precomputed
+SUGGEST_SCAN_LIMIT = int(os.getenv("SUGGEST_SCAN_LIMIT", "256"))
+# Changes served on top of the snapshot before it is rebuilt
+SUGGEST_OVERLAY_MAX = int(os.getenv("SUGGEST_OVERLAY_MAX", "256"))
+# How often names and units sold are reloaded from the database
+SUGGEST_RELOAD_INTERVAL = float(os.getenv("SUGGEST_RELOAD_INTERVAL", "300"))
+
+# Keys are stored as fixed width bytes, longer names are truncated
+KEY_BYTES = 32
+# Completions kept per precomputed prefix, room for a full overlay masking the best ones
+TOP_DEPTH = SUGGEST_MAX_RESULTS + SUGGEST_OVERLAY_MAX
+# Units sold rank first, stock breaks the tie for products that never sold
+STOCK_BITS = 20
+
+
+def popularity(units_sold: int, stock: int) -> int:
+    return (units_sold << STOCK_BITS) | min(max(stock, 0), (1 << STOCK_BITS) - 1)
+
+
+def name_keys(name: str) -> List[bytes]:
+    """The normalized name starting at each of its first words"""
+    words = TOKEN_RE.findall(name.lower())
+    return [" ".join(words[i:]).encode("utf-8")[:KEY_BYTES] for i in range(min(len(words), SUGGEST_MAX_WORD_STARTS))]
+
+
+def prefix_range(keys: np.ndarray, prefix: bytes, lo: int = 0, hi: Optional[int] = None) -> Tuple[int, int]:
+    """[start, end) of the sorted keys starting with prefix"""
+    hi = len(keys) if hi is None else hi
+    window = keys[lo:hi]
+    if len(prefix) >= KEY_BYTES:
+        prefix = prefix[:KEY_BYTES]
+        return lo + int(np.searchsorted(window, prefix)), lo + int(np.searchsorted(window, prefix, side="right"))
+    # No UTF-8 byte is 0xff, so it sorts after every continuation of the prefix
+    return lo + int(np.searchsorted(window, prefix)), lo + int(np.searchsorted(window, prefix + b"\xff"))
+
+
+class SuggestSnapshot:
+    """Immutable sorted key array, built off the request path and swapped in whole"""
+
+    def __init__(self, products: Dict[int, Tuple[str, int]], units: Dict[int, int]):
+        self.product_ids = np.fromiter(sorted(products), dtype=np.int64, count=len(products))
+        self.names: List[str] = []
+        self.units = np.zeros(len(products), dtype=np.int64)
+        product_popularity = np.zeros(len(products), dtype=np.int64)
+        keys, owners = [], []
+        # Ordered by id, so an id is found with a binary search
+        for i, (product_id, (name, stock)) in enumerate(sorted(products.items())):
+            self.names.append(name)
+            sold = units.get(product_id, 0)
+            self.units[i] = sold
+            product_popularity[i] = popularity(sold, stock)
+            for key in name_keys(name):
+                keys.append(key)
+                owners.append(i)
+
+        order = np.argsort(np.array(keys, dtype=f"S{KEY_BYTES}"), kind="stable")
+        self.keys = np.array(keys, dtype=f"S{KEY_BYTES}")[order]
+        self.owners = np.array(owners, dtype=np.int32)[order]
+        self.popularity = product_popularity[self.owners]
+
+        # Best keys of every prefix too common to rank per request, found by walking
+        # the implicit trie of the sorted keys one byte at a time
+        self.top: Dict[bytes, np.ndarray] = {}
+        stack = [(b"", 0, len(self.keys))]
+        while stack:
+            prefix, lo, hi = stack.pop()
+            if hi - lo <= SUGGEST_SCAN_LIMIT:
+                continue
+            self.top[prefix] = self.ranked(lo, hi, TOP_DEPTH)
+            depth = len(prefix)
+            # Keys equal to the prefix sort first and have no children
+            while lo < hi and len(self.keys[lo]) == depth:
+                lo += 1
+            while lo < hi:
+                child = prefix + self.keys[lo][depth:depth + 1]
+                _, end = prefix_range(self.keys, child, lo, hi)
+                stack.append((child, lo, end))
+                lo = end
+
+    def ranked(self, lo: int, hi: int, depth: Optional[int] = None) -> np.ndarray:
+        """Key positions in [lo, hi) of the `depth` most popular products, ties by product id"""
+        scores = self.popularity[lo:hi]
+        candidates = np.arange(hi - lo)
+        # A product has at most SUGGEST_MAX_WORD_STARTS keys, so this many keys hold `depth` products
+        if depth is not None and len(candidates) > depth * SUGGEST_MAX_WORD_STARTS:
+            candidates = np.argpartition(-scores, depth * SUGGEST_MAX_WORD_STARTS - 1)[:depth * SUGGEST_MAX_WORD_STARTS]
+        owners = self.owners[lo + candidates]
+        order = np.lexsort((self.product_ids[owners], -scores[candidates]))
+        # A product matching through several of its keys is listed once
+        _, first = np.unique(owners[order], return_index=True)
+        order = order[np.sort(first)][:depth]
+        return (lo + candidates[order]).astype(np.int32)
+
+    def memory_bytes(self) -> int:
+        arrays = (self.product_ids, self.units, self.keys, self.owners, self.popularity)
+        return (sum(array.nbytes for array in arrays) + sum(len(name) + 49 for name in self.names)
+                + sum(len(prefix) + 33 + array.nbytes for prefix, array in self.top.items()))
+
+
+class SuggestOverlay:
+    """Product changes made since the snapshot was built, immutable too"""
+
+    def __init__(self, changes: Dict[int, tuple], snapshot: SuggestSnapshot):
+        # product id -> (seq, (name, stock, popularity, keys) or None when gone)
+        self.changes = changes
+        keys, owners, scores = [], [], []
+        for product_id, (_, entry) in changes.items():
+            if entry is not None:
+                for key in entry[3]:
+                    keys.append(key)
+                    owners.append(product_id)
+                    scores.append(entry[2])
+        keys = np.array(keys, dtype=f"S{KEY_BYTES}")
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.owners = np.array(owners, dtype=np.int64)[order]
+        self.popularity = np.array(scores, dtype=np.int64)[order]
+
+        # Snapshot products shadowed by a change
+        self.masked = np.zeros(len(snapshot.product_ids), dtype=bool)
+        changed = np.fromiter(changes, dtype=np.int64, count=len(changes))
+        positions = np.minimum(np.searchsorted(snapshot.product_ids, changed), len(snapshot.product_ids) - 1)
+        if len(snapshot.product_ids):
+            self.masked[positions[snapshot.product_ids[positions] == changed]] = True
+
+    def __len__(self) -> int:
+        return len(self.changes)
+
+    def matches(self, prefix: bytes, limit: int) -> List[int]:
+        """Ids of the `limit` most popular changed products completing prefix"""
+        lo, hi = prefix_range(self.keys, prefix)
+        if lo == hi:
+            return []
+        owners = self.owners[lo:hi]
+        order = np.lexsort((owners, -self.popularity[lo:hi]))
+        _, first = np.unique(owners[order], return_index=True)
+        return [int(product_id) for product_id in owners[order[np.sort(first)]][:limit]]
+
+
+class SuggestIndex:
+    """Product name completions from a sorted array of name keys.
+
+    Every active product contributes its lowercased name starting at each of
+    its first words, so "wire" and "head" both complete "Wireless
+    Headphones". A prefix is two binary searches into the sorted keys; a
+    narrow range is ranked on the spot, a wide one reads the completions
+    precomputed for that prefix. Ranking is by units sold (from order.created
+    events, summed in product_sales), then stock.
+
+    Reads never take the lock: they use the current (snapshot, overlay) pair,
+    which writers replace as a whole. Product changes land in the small
+    overlay at once, the snapshot is rebuilt in the background once the
+    overlay fills up, and everything is reloaded from the database every
+    SUGGEST_RELOAD_INTERVAL to pick up new sales.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Source of truth for rebuilds: name and stock of every active product
+        self._products: Dict[int, Tuple[str, int]] = {}
+        self._units: Dict[int, int] = {}
+        self._seq = 0
+        empty = SuggestSnapshot({}, {})
+        self._state: Tuple[SuggestSnapshot, SuggestOverlay] = (empty, SuggestOverlay({}, empty))
+        self.loaded_at: Optional[float] = None
+
+        self.queries = 0
+        self.slow_queries = 0
+        self.rebuilds = 0
+        self.reloads = 0
+        self.last_build_ms = 0.0
+
+    @property
+    def ready(self) -> bool:
+        """Loaded at least once, until then it only knows the products changed since startup"""
+        return self.loaded_at is not None
+
+    def load(self, engine):
+        """Reload names and units sold from the database and rebuild"""
+        with self._lock:
+            seq = self._seq
+        with Session(engine) as session:
+            products = {
+                product_id: (name, stock)
+                for product_id, name, stock in session.exec(
+                    select(Product.id, Product.name, Product.stock_quantity).where(Product.is_active == True)
+                )
+            }
+            units = dict(session.exec(select(ProductSales.product_id, ProductSales.units_sold)).all())
+        with self._lock:
+            # Changes that raced the read win over what it returned
+            for product_id, (change_seq, entry) in self._state[1].changes.items():
+                if change_seq > seq:
+                    if entry is None:
+                        products.pop(product_id, None)
+                    else:
+                        products[product_id] = entry[:2]
+            self._products = products
+            self._units = units
+        self.rebuild()
+        self.reloads += 1
+        self.loaded_at = time.time()
+
+    def rebuild(self):
+        """Build a new snapshot from the in-memory products, reads go on meanwhile"""
+        started = time.perf_counter()
+        with self._lock:
+            products, units, seq = dict(self._products), self._units, self._seq
+        snapshot = SuggestSnapshot(products, units)
+        with self._lock:
+            changes = self._state[1].changes
+            self._state = (snapshot, SuggestOverlay({
+                product_id: change for product_id, change in changes.items() if change[0] > seq
+            }, snapshot))
+        self.rebuilds += 1
+        self.last_build_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Suggest index built from {len(products)} products, {len(snapshot.keys)} keys "
+                    f"in {self.last_build_ms:.1f} ms")
+
+    def _change(self, product_id: int, entry: Optional[tuple]):
+        with self._lock:
+            self._seq += 1
+            if entry is None:
+                self._products.pop(product_id, None)
+            else:
+                self._products[product_id] = entry[:2]
+            snapshot, overlay = self._state
+            changes = dict(overlay.changes)
+            changes[product_id] = (self._seq, entry)
+            self._state = (snapshot, SuggestOverlay(changes, snapshot))
+
+    def upsert(self, product: Product):
+        if not product.is_active:
+            self.remove(product.id)
+            return
+        with self._lock:
+            current = self._products.get(product.id)
+            if current is not None and current[0] == product.name and product.id not in self._state[1].changes:
+                # Stock only change, the name is already indexed and the new rank comes with the next rebuild
+                self._products[product.id] = (product.name, product.stock_quantity)
+                return
+        score = popularity(self._units.get(product.id, 0), product.stock_quantity)
+        self._change(product.id, (product.name, product.stock_quantity, score, name_keys(product.name)))
+
+    def remove(self, product_id: int):
+        self._change(product_id, None)
+
+    def suggest(self, text: str, limit: int = SUGGEST_MAX_RESULTS) -> List[Tuple[int, str, int]]:
+        """(product id, name, units sold) of the best completions of text"""
+        words = TOKEN_RE.findall(text.lower())
+        if not words:
+            return []
+        # A trailing space means the last word is complete
+        prefix = (" ".join(words) + (" " if text[-1].isspace() else "")).encode("utf-8")[:KEY_BYTES]
+        snapshot, overlay = self._state
+        self.queries += 1
+
+        best = []
+        for product_id in overlay.matches(prefix, limit):
+            name, _, score, _ = overlay.changes[product_id][1]
+            best.append((-score, product_id, name, self._units.get(product_id, 0)))
+
+        lo, hi = prefix_range(snapshot.keys, prefix)
+        truncated = hi - lo > SUGGEST_SCAN_LIMIT
+        positions = snapshot.top.get(prefix) if truncated else None
+        if positions is None:
+            positions = snapshot.ranked(lo, hi, TOP_DEPTH if truncated else None)
+        # Products in the overlay are served from there
+        positions = positions[~overlay.masked[snapshot.owners[positions]]]
+        if len(positions) < limit and truncated:
+            # The overlay outgrew the precomputed depth before a rebuild
+            self.slow_queries += 1
+            positions = snapshot.ranked(lo, hi, limit + len(overlay))
+            positions = positions[~overlay.masked[snapshot.owners[positions]]]
+
+        for position in positions[:limit]:
+            owner = snapshot.owners[position]
+            best.append((-int(snapshot.popularity[position]), int(snapshot.product_ids[owner]),
+                         snapshot.names[owner], int(snapshot.units[owner])))
+        best.sort()
+        return [(product_id, name, units_sold) for _, product_id, name, units_sold in best[:limit]]
+
+    async def run_rebuilder(self, engine, reload_interval: float = SUGGEST_RELOAD_INTERVAL):
+        """Load off the event loop (retried until it works), then rebuild and reload in the background"""
+        last_load = time.monotonic()
+        while True:
+            try:
+                if not self.ready or time.monotonic() - last_load >= reload_interval:
+                    last_load = time.monotonic()
+                    await asyncio.to_thread(self.load, engine)
+                elif len(self._state[1]) >= SUGGEST_OVERLAY_MAX:
+                    await asyncio.to_thread(self.rebuild)
+            except Exception as e:
+                logger.error(f"Suggest index rebuild failed: {e}")
+            await asyncio.sleep(1)
+
+    def stats(self) -> dict:
+        snapshot, overlay = self._state
+        return {
+            "enabled": SUGGEST_INDEX,
+            "products": len(snapshot.product_ids),
+            "keys": len(snapshot.keys),
+            "precomputed_prefixes": len(snapshot.top),
+            "overlay": len(overlay),
+            "memory_bytes": snapshot.memory_bytes(),
+            "queries": self.queries,
+            "slow_queries": self.slow_queries,
+            "rebuilds": self.rebuilds,
+            "reloads": self.reloads,
+            "last_build_ms": round(self.last_build_ms, 1),
+            "ready": self.ready,
+            "loaded_at": self.loaded_at,
+        }
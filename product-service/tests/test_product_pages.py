@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+import database
+import main
+from models import Product
+from shared.pagination import encode_cursor
+
+
+@pytest.fixture(scope="module")
+def client():
+    database.create_db_and_tables()
+    # Not entered as a context manager, the startup handler would start the kafka clients
+    return TestClient(main.app)
+
+
+@pytest.fixture(scope="module")
+def products(client):
+    """Products with repeated prices and names, so pages have ties to break by id"""
+    started = datetime(2024, 1, 1)
+    with Session(database.engine) as session:
+        rows = [
+            Product(name=f"Product {i % 4}", price=float(10 + i % 3), category="books",
+                    created_at=started + timedelta(minutes=i // 2), updated_at=started)
+            for i in range(11)
+        ]
+        session.add_all(rows)
+        session.commit()
+        return [(product.id, product.price, product.name, product.created_at) for product in rows]
+
+
+def walk(client, sort: str, descending: bool = False) -> list:
+    seen, cursor = [], None
+    while True:
+        params = {"sort": sort, "descending": descending, "limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/products/page", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        seen.extend(product["id"] for product in page["products"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return seen
+
+
+@pytest.mark.parametrize("sort, key", [
+    ("price", lambda product: (product[1], product[0])),
+    ("name", lambda product: (product[2], product[0])),
+    ("created_at", lambda product: (product[3], product[0])),
+])
+@pytest.mark.parametrize("descending", [False, True])
+def test_pages_walk_every_product_once(client, products, sort, key, descending):
+    expected = [product[0] for product in sorted(products, key=key, reverse=descending)]
+    assert walk(client, sort, descending) == expected
+
+
+@pytest.mark.parametrize("sort, cursor", [
+    ("price", "garbage"),
+    ("price", encode_cursor("name", "Product 1", 1)),
+    ("price", encode_cursor("price", "cheap", 1)),
+    ("price", encode_cursor("price", [10], 1)),
+    ("price", encode_cursor("price", 10.0, "one")),
+    ("price", encode_cursor("price", 10.0)),
+    ("name", encode_cursor("name", 10, 1)),
+    ("name", encode_cursor("name", None, 1)),
+    ("created_at", encode_cursor("created_at", "last tuesday", 1)),
+    ("created_at", encode_cursor("created_at", datetime(2024, 1, 1), None)),
+])
+def test_malformed_cursor_is_rejected(client, products, sort, cursor):
+    response = client.get("/products/page", params={"sort": sort, "cursor": cursor})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
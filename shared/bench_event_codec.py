@@ -0,0 +1,85 @@
+"""Benchmark: bytes/event and encode/decode throughput, JSON vs schema based Avro.
+
+Encodes and decodes BENCH_EVENTS realistic user and product events with the
+stdlib json path the producer used before, with orjson (JsonCodec) and with
+the Avro codec, then prints the payload size and events/sec of each.
+
+Run from the repository root:
+
+    python -m shared.bench_event_codec
+"""
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from shared.event_codec import AvroCodec, JsonCodec, SchemaRegistry
+
+BENCH_EVENTS = int(os.getenv("BENCH_EVENTS", "50000"))
+
+
+def make_events() -> list:
+    events = []
+    for i in range(BENCH_EVENTS):
+        if i % 2:
+            event_type = "product.updated"
+            data = {"product_id": i, "name": f"Product {i}", "category": "electronics",
+                    "price": 19.99 + i % 100, "stock_quantity": i % 500, "is_active": True}
+        else:
+            event_type = "user.created"
+            data = {"user_id": i, "email": f"user{i}@example.com", "full_name": f"User Number {i}"}
+        events.append({
+            "event_id": str(uuid.uuid4()),
+            "event_type": event_type,
+            "timestamp": datetime.utcnow().isoformat(),
+            "producer": "bench-service",
+            "data": data,
+        })
+    return events
+
+
+class StdlibJson:
+    """What KafkaClient did before: json.dumps(...).encode()"""
+    name = "stdlib json"
+
+    def encode(self, event: dict) -> bytes:
+        return json.dumps(event).encode("utf-8")
+
+    def decode(self, raw: bytes) -> dict:
+        return json.loads(raw.decode("utf-8"))
+
+
+def run(codec, events: list) -> dict:
+    started = time.perf_counter()
+    encoded = [codec.encode(event) for event in events]
+    encode_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    decoded = [codec.decode(raw) for raw in encoded]
+    decode_seconds = time.perf_counter() - started
+
+    assert decoded[0] == events[0] and decoded[-1] == events[-1]
+    return {
+        "bytes_per_event": sum(len(raw) for raw in encoded) / len(encoded),
+        "encode_per_sec": len(events) / encode_seconds,
+        "decode_per_sec": len(events) / decode_seconds,
+    }
+
+
+def main():
+    events = make_events()
+    # Throwaway registry so the benchmark never touches the committed one
+    with tempfile.TemporaryDirectory() as tmp:
+        codecs = [StdlibJson(), JsonCodec(), AvroCodec(SchemaRegistry(os.path.join(tmp, "registry.json")))]
+        print(f"{BENCH_EVENTS} events, half user.created and half product.updated")
+        print(f"{'codec':>12} {'bytes/event':>12} {'encode/s':>10} {'decode/s':>10}")
+        for codec in codecs:
+            result = run(codec, events)
+            print(f"{codec.name:>12} {result['bytes_per_event']:>12.1f} "
+                  f"{result['encode_per_sec']:>10.0f} {result['decode_per_sec']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
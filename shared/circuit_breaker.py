@@ -1,55 +1,400 @@
-from circuitbreaker import CircuitBreaker
+import asyncio
 import logging
 import httpx
-import asyncio
-from typing import Any, Dict, Optional
-from functools import wraps
+import os
+import random
+import re
+import time
+from collections import deque
+from enum import Enum
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 logger = logging.getLogger(__name__)
 
+# Breaker tuning, the same for every endpoint
+CB_WINDOW_SIZE = int(os.getenv("CB_WINDOW_SIZE", "20"))            # calls in the sliding window
+CB_MIN_CALLS = int(os.getenv("CB_MIN_CALLS", "10"))                # calls needed before rates count
+CB_FAILURE_RATE = float(os.getenv("CB_FAILURE_RATE", "0.5"))       # open at this share of failed calls
+CB_SLOW_CALL_RATE = float(os.getenv("CB_SLOW_CALL_RATE", "0.5"))   # or at this share of slow calls
+CB_SLOW_CALL_SECONDS = float(os.getenv("CB_SLOW_CALL_SECONDS", "2.0"))
+CB_OPEN_SECONDS = float(os.getenv("CB_OPEN_SECONDS", "30"))        # how long to fail fast before probing
+CB_HALF_OPEN_CALLS = int(os.getenv("CB_HALF_OPEN_CALLS", "3"))     # trial calls let through when probing
+CB_HTTP_TIMEOUT = float(os.getenv("CB_HTTP_TIMEOUT", "10.0"))      # upper bound of any deadline
+CB_MAX_CONNECTIONS = int(os.getenv("CB_MAX_CONNECTIONS", "100"))
+
+# Adaptive deadlines: p99 of recent calls times a factor, kept within [min, CB_HTTP_TIMEOUT]
+CB_LATENCY_SAMPLES = int(os.getenv("CB_LATENCY_SAMPLES", "200"))
+CB_LATENCY_MIN_SAMPLES = int(os.getenv("CB_LATENCY_MIN_SAMPLES", "20"))
+CB_TIMEOUT_FACTOR = float(os.getenv("CB_TIMEOUT_FACTOR", "3.0"))
+CB_MIN_TIMEOUT = float(os.getenv("CB_MIN_TIMEOUT", "0.25"))
+# Hedged GETs: a second request once the first passes p95, at most this share of extra requests
+CB_HEDGE_RATIO = float(os.getenv("CB_HEDGE_RATIO", "0.1"))
+CB_HEDGE_BURST = float(os.getenv("CB_HEDGE_BURST", "10"))
+# Retries: decorrelated jitter between base and cap, at most this share of extra requests per host
+CB_MAX_RETRIES = int(os.getenv("CB_MAX_RETRIES", "2"))
+CB_RETRY_BASE = float(os.getenv("CB_RETRY_BASE", "0.05"))
+CB_RETRY_CAP = float(os.getenv("CB_RETRY_CAP", "1.0"))
+CB_RETRY_RATIO = float(os.getenv("CB_RETRY_RATIO", "0.1"))
+CB_RETRY_BURST = float(os.getenv("CB_RETRY_BURST", "10"))
+
+# Responses worth another try, anything else is final
+RETRYABLE_STATUS = {429, 502, 503, 504}
+# Methods retried without the caller asking for it
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE"}
+
+# /users/42 and /users/43 are the same endpoint
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
 class ServiceUnavailableException(Exception):
     """Custom exception to indicate that a service is unavailable."""
     pass
 
+
+class CircuitOpenError(ServiceUnavailableException):
+    """Raised without calling the service while its circuit is open."""
+    pass
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class TokenBudget:
+    """Token bucket that caps extra requests (retries, hedges) to a share of normal traffic.
+
+    Every call earns `ratio` of a token, every extra request spends a whole
+    one, and at most `burst` tokens can be saved up. During an outage the
+    bucket drains and extra requests stop instead of multiplying the load.
+    """
+
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+        self.calls = 0
+        self.spent = 0
+        self.exhausted = 0
+
+    def earn(self):
+        self.calls += 1
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self) -> bool:
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        self.spent += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "spent": self.spent,
+            "exhausted": self.exhausted,
+            "tokens": round(self.tokens, 2),
+        }
+
+
+class LatencyTracker:
+    """Rolling latency percentiles over the last `size` successful calls"""
+
+    def __init__(self, size: int = CB_LATENCY_SAMPLES):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self._sorted: List[float] = []
+        self._stale = 0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self._stale += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.samples) < CB_LATENCY_MIN_SAMPLES:
+            return None
+        # Re-sort every few samples, not on every call
+        if self._stale >= 10 or not self._sorted:
+            self._sorted = sorted(self.samples)
+            self._stale = 0
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
+
+    def timeout(self) -> float:
+        """Deadline for the next call, the static timeout until we have enough samples"""
+        p99 = self.percentile(0.99)
+        if p99 is None:
+            return CB_HTTP_TIMEOUT
+        return min(CB_HTTP_TIMEOUT, max(CB_MIN_TIMEOUT, p99 * CB_TIMEOUT_FACTOR))
+
+
+class EndpointBreaker:
+    """Breaker state of one downstream endpoint.
+
+    Outcomes of the last `window_size` calls are kept in a ring buffer; once
+    there are `min_calls` of them the circuit opens when either the failure
+    rate or the slow call rate crosses its threshold. After `open_seconds`
+    up to `half_open_calls` trial calls are let through: all of them
+    succeeding closes the circuit, any failure opens it again.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CircuitState.CLOSED
+        self.window: Deque[Tuple[bool, bool]] = deque(maxlen=CB_WINDOW_SIZE)
+        self.opened_at = 0.0
+        self.trials = 0
+        self.trial_successes = 0
+        self.latency = LatencyTracker()
+        self.hedge_budget = TokenBudget(CB_HEDGE_RATIO, CB_HEDGE_BURST)
+
+        self.calls = 0
+        self.rejected = 0
+        self.hedge_wins = 0
+        self.transitions: Dict[str, int] = {}
+
+    def _transition(self, state: CircuitState):
+        key = f"{self.state.value}->{state.value}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        logger.warning(f"Circuit {self.name}: {key}")
+        self.state = state
+        self.window.clear()
+        self.trials = 0
+        self.trial_successes = 0
+        if state == CircuitState.OPEN:
+            self.opened_at = time.monotonic()
+
+    def allow(self) -> bool:
+        """Whether a call may go out, cheap enough to run on every request"""
+        if self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.OPEN:
+            if time.monotonic() - self.opened_at < CB_OPEN_SECONDS:
+                self.rejected += 1
+                return False
+            self._transition(CircuitState.HALF_OPEN)
+        if self.trials >= CB_HALF_OPEN_CALLS:
+            self.rejected += 1
+            return False
+        self.trials += 1
+        return True
+
+    def record(self, failed: bool, duration: float):
+        self.calls += 1
+        slow = duration >= CB_SLOW_CALL_SECONDS
+
+        if self.state == CircuitState.HALF_OPEN:
+            if failed or slow:
+                self._transition(CircuitState.OPEN)
+                return
+            self.trial_successes += 1
+            if self.trial_successes >= CB_HALF_OPEN_CALLS:
+                self._transition(CircuitState.CLOSED)
+            return
+        if self.state == CircuitState.OPEN:
+            # A call let through before the circuit opened
+            return
+
+        self.window.append((failed, slow))
+        if len(self.window) < CB_MIN_CALLS:
+            return
+        failures = sum(1 for f, _ in self.window if f)
+        slow_calls = sum(1 for _, s in self.window if s)
+        if failures / len(self.window) >= CB_FAILURE_RATE or slow_calls / len(self.window) >= CB_SLOW_CALL_RATE:
+            self._transition(CircuitState.OPEN)
+
+    def stats(self) -> dict:
+        window = len(self.window)
+        p50, p95, p99 = (self.latency.percentile(q) for q in (0.5, 0.95, 0.99))
+        return {
+            "state": self.state.value,
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "p50_ms": round(p50 * 1000, 2) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 2) if p95 is not None else None,
+            "p99_ms": round(p99 * 1000, 2) if p99 is not None else None,
+            "timeout_ms": round(self.latency.timeout() * 1000, 2),
+            "hedges": self.hedge_budget.spent,
+            "hedge_wins": self.hedge_wins,
+            "window": window,
+            "failure_rate": round(sum(1 for f, _ in self.window if f) / window, 4) if window else 0.0,
+            "slow_call_rate": round(sum(1 for _, s in self.window if s) / window, 4) if window else 0.0,
+            "transitions": dict(self.transitions),
+        }
+
+
 class CircuitBreaker:
+    """HTTP calls to other services through one pooled client, one breaker per endpoint.
+
+    Endpoints are keyed by method, host and path with numeric ids folded,
+    so a failing /products/batch doesn't open the circuit for /users/{id}.
+    Connection errors, timeouts and 5xx responses count as failures, 4xx
+    responses are the caller's problem and don't.
+
+    Deadlines follow each endpoint's own recent latency instead of a fixed
+    10 seconds, and idempotent GETs can be hedged: when the first request
+    is still running at the endpoint's p95 a second one goes out and the
+    first good response wins. Hedges are capped at CB_HEDGE_RATIO of the
+    endpoint's calls.
+
+    Connection errors, timeouts and 429/502/503/504 are retried with
+    decorrelated jitter backoff, for idempotent methods or when the caller
+    says the call is safe to repeat. Retries come out of a token budget per
+    destination host, so they stay below CB_RETRY_RATIO of its traffic.
+    """
+
+    def __init__(self, timeout: float = CB_HTTP_TIMEOUT):
+        self.timeout = timeout
+        self.breakers: Dict[str, EndpointBreaker] = {}
+        self.retry_budgets: Dict[str, TokenBudget] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=CB_MAX_CONNECTIONS, max_keepalive_connections=CB_MAX_CONNECTIONS)
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def breaker(self, method: str, url: str) -> EndpointBreaker:
+        parts = urlsplit(url)
+        name = f"{method.upper()} {parts.netloc}{_ID_SEGMENT.sub('/{id}', parts.path)}"
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = EndpointBreaker(name)
+        return breaker
+
+    def retry_budget(self, url: str) -> TokenBudget:
+        host = urlsplit(url).netloc
+        budget = self.retry_budgets.get(host)
+        if budget is None:
+            budget = self.retry_budgets[host] = TokenBudget(CB_RETRY_RATIO, CB_RETRY_BURST)
+        return budget
 
-    @staticmethod
-    @circuit(
-        failure_threshold=5,
-        recovery_timeout=30,
-        excepted_exceptions=httpx.RequestError
-    )
     async def call_service(
         self,
         method: str,
         url: str,
         data: Optional[Dict] = None,
         headers: Optional[Dict] = None,
+        hedge: bool = False,
+        retry: Optional[bool] = None,
     ) -> Any:
-        """Make an HTTP call to another service with circuit breaker protection."""
-        async with httpx.AsyncClient(timeout=10.0) as client:
+        """Make an HTTP call to another service with circuit breaker protection.
+
+        `hedge` is only honoured for GET, other methods aren't safe to send twice.
+        `retry` defaults to whether the method is idempotent, pass True for
+        POSTs that only read (e.g. batch lookups).
+        """
+        method = method.upper()
+        breaker = self.breaker(method, url)
+        budget = self.retry_budget(url)
+        if retry is None:
+            retry = method in IDEMPOTENT_METHODS
+
+        backoff = CB_RETRY_BASE
+        attempt = 0
+        while True:
+            error, response = None, None
             try:
-                if method.upper() == "GET":
-                    response = await client.get(url, headers=headers)
-                elif method.upper() == "POST":
-                    response = await client.post(url, json=data, headers=headers)
-                elif method.upper() == "PUT":
-                    response = await client.put(url, json=data, headers=headers)
-                elif method.upper() == "DELETE":
-                    response = await client.delete(url, headers=headers)
-                else:
-                    raise ValueError(f"Unsupported HTTP method: {method}")
-                
-                response.raise_for_status()
-                return response.json()
-            
-            except httpx.RequestError as e:
-                logger.error(f"Request error when calling {url}: {e}")
-                raise
-
-            except httpx.HTTPStatusError as e:
-                logger.error(f"HTTP error when calling {url}: {e}")
-                raise
+                response = await self._attempt(breaker, method, url, data, headers, hedge)
+            except httpx.TransportError as e:
+                error = e
+            if attempt == 0:
+                # Only calls that went out earn retries, not ones an open circuit rejected
+                budget.earn()
+            if error is None and response.status_code not in RETRYABLE_STATUS:
+                break
+            if not retry or attempt >= CB_MAX_RETRIES or not budget.spend():
+                break
+
+            # Decorrelated jitter, a server supplied Retry-After wins when it is longer
+            backoff = min(CB_RETRY_CAP, random.uniform(CB_RETRY_BASE, backoff * 3))
+            retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+            if retry_after.isdigit():
+                backoff = min(CB_RETRY_CAP, max(backoff, float(retry_after)))
+            attempt += 1
+            logger.warning(f"Retrying {method} {url} in {backoff:.3f}s (attempt {attempt}): "
+                           f"{error or response.status_code}")
+            await asyncio.sleep(backoff)
+
+        if error is not None:
+            logger.error(f"Request error when calling {url}: {error}")
+            raise error
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            logger.error(f"HTTP error when calling {url}: {e}")
+            raise
+        return response.json()
+
+    async def _attempt(self, breaker: EndpointBreaker, method: str, url: str,
+                       data: Optional[Dict], headers: Optional[Dict], hedge: bool) -> httpx.Response:
+        """One try through the endpoint's breaker"""
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {breaker.name}")
+
+        started = time.monotonic()
+        try:
+            if hedge and method == "GET":
+                response = await self._hedged(breaker, url, headers)
+            else:
+                response = await self._send(breaker, method, url, data, headers)
+        except httpx.RequestError:
+            breaker.record(True, time.monotonic() - started)
+            raise
+
+        elapsed = time.monotonic() - started
+        breaker.record(response.status_code >= 500, elapsed)
+        if response.status_code < 500:
+            breaker.latency.add(elapsed)
+        return response
+
+    async def _send(self, breaker: EndpointBreaker, method: str, url: str,
+                    data: Optional[Dict], headers: Optional[Dict]) -> httpx.Response:
+        return await self.client.request(
+            method, url,
+            json=data if method in ("POST", "PUT", "PATCH") else None,
+            headers=headers,
+            timeout=breaker.latency.timeout()
+        )
+
+    async def _hedged(self, breaker: EndpointBreaker, url: str, headers: Optional[Dict]) -> httpx.Response:
+        breaker.hedge_budget.earn()
+        first = asyncio.ensure_future(self._send(breaker, "GET", url, None, headers))
+        hedge_after = breaker.latency.percentile(0.95)
+        if hedge_after is None:
+            return await first
+
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done or not breaker.hedge_budget.spend():
+            return await first
+
+        second = asyncio.ensure_future(self._send(breaker, "GET", url, None, headers))
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code < 500:
+                        if task is second:
+                            breaker.hedge_wins += 1
+                        return task.result()
+            # Both failed, report the original request's outcome
+            return first.result()
+        finally:
+            for task in pending:
+                task.cancel()
 
     async def call_with_fallback(
         self,
@@ -58,12 +403,19 @@ class CircuitBreaker:
         fallback_value: Any,
         data: Optional[Dict] = None,
         headers: Optional[Dict] = None,
+        hedge: bool = False,
+        retry: Optional[bool] = None,
     ) -> Any:
         """Call the service with a fallback in case of failure."""
         try:
-            return await self.call_service(method, url, data, headers)
+            return await self.call_service(method, url, data, headers, hedge=hedge, retry=retry)
         except Exception as e:
             logger.warning(f"Service call failed, executing fallback: {e}")
             if fallback_value:
                 return fallback_value
-            
\ No newline at end of file
+
+    def stats(self) -> dict:
+        return {
+            "endpoints": {name: breaker.stats() for name, breaker in self.breakers.items()},
+            "retry_budgets": {host: budget.stats() for host, budget in self.retry_budgets.items()},
+        }
@@ -0,0 +1,252 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import io
+import json
+import os
+import struct
+import threading
+import uuid
+
+import fastavro
+import orjson
+
+from shared.kafka_events import BaseEvent, EventType, UserCreatedEvent, OrderCreatedEvent
+
+# Codec producers encode with, "json" or "avro". Consumers decode both either way,
+# so switch producers to avro only once every consumer runs this code
+KAFKA_EVENT_CODEC = os.getenv("KAFKA_EVENT_CODEC", "json")
+SCHEMA_REGISTRY_PATH = os.getenv(
+    "SCHEMA_REGISTRY_PATH",
+    str(Path(__file__).resolve().parent / "schemas" / "registry.json")
+)
+
+# Binary events start with this byte and the big endian schema id (Confluent wire format),
+# JSON events always start with "{" so both can share a topic
+MAGIC_BYTE = 0
+HEADER = struct.Struct(">bI")
+
+
+def nullable(name: str, avro_type) -> dict:
+    return {"name": name, "type": ["null", avro_type], "default": None}
+
+
+USER_DATA_FIELDS = [
+    {"name": "user_id", "type": "long"},
+    {"name": "email", "type": "string"},
+    {"name": "full_name", "type": "string"},
+]
+
+# product.deleted only carries the id, so everything else is optional
+PRODUCT_DATA_FIELDS = [
+    {"name": "product_id", "type": "long"},
+    nullable("name", "string"),
+    nullable("category", "string"),
+    nullable("price", "double"),
+    nullable("stock_quantity", "long"),
+    nullable("is_active", "boolean"),
+]
+
+ORDER_DATA_FIELDS = [
+    {"name": "order_id", "type": "long"},
+    {"name": "user_id", "type": "long"},
+    {"name": "total_amount", "type": "double"},
+    {"name": "items", "type": {"type": "array", "items": {
+        "type": "record",
+        "name": "OrderItemData",
+        "fields": [
+            {"name": "product_id", "type": "long"},
+            {"name": "quantity", "type": "long"},
+            {"name": "price", "type": "double"},
+        ],
+    }}},
+]
+
+
+def event_schema(data_name: str, data_fields: List[dict]) -> dict:
+    """Avro schema of the event envelope around a typed `data` record"""
+    return {
+        "type": "record",
+        "name": "Event",
+        "namespace": "ecom.events",
+        "fields": [
+            {"name": "event_id", "type": {"type": "fixed", "name": "UUID", "size": 16}},
+            {"name": "event_type", "type": "string"},
+            {"name": "timestamp", "type": {"type": "long", "logicalType": "timestamp-micros"}},
+            {"name": "producer", "type": "string"},
+            {"name": "data", "type": {"type": "record", "name": data_name, "fields": data_fields}},
+        ],
+    }
+
+
+# Current schema of every event type with a binary encoding, the subject is the event type
+EVENT_SCHEMAS: Dict[str, dict] = {
+    EventType.USER_CREATED.value: event_schema("UserData", USER_DATA_FIELDS),
+    EventType.USER_UPDATED.value: event_schema("UserData", USER_DATA_FIELDS),
+    EventType.PRODUCT_CREATED.value: event_schema("ProductData", PRODUCT_DATA_FIELDS),
+    EventType.PRODUCT_UPDATED.value: event_schema("ProductData", PRODUCT_DATA_FIELDS),
+    EventType.PRODUCT_STOCK_UPDATED.value: event_schema("ProductData", PRODUCT_DATA_FIELDS),
+    EventType.PRODUCT_DELETED.value: event_schema("ProductData", PRODUCT_DATA_FIELDS),
+    EventType.ORDER_CREATED.value: event_schema("OrderData", ORDER_DATA_FIELDS),
+}
+
+# Typed models for decode_model(), anything else decodes as a BaseEvent
+EVENT_MODELS = {
+    EventType.USER_CREATED.value: UserCreatedEvent,
+    EventType.ORDER_CREATED.value: OrderCreatedEvent,
+}
+
+
+class SchemaRegistry:
+    """Local, file backed stand-in for a schema registry.
+
+    The file maps schema ids to (subject, version, schema) and is committed
+    with the code, so every service resolves the same ids without a registry
+    server. Registering a schema that is already there returns its id,
+    a changed schema becomes the subject's next version.
+    """
+
+    def __init__(self, path: str = SCHEMA_REGISTRY_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._schemas: Dict[int, dict] = {}
+        self._parsed: Dict[int, dict] = {}
+        self._latest: Dict[str, int] = {}
+        if self.path.exists():
+            for entry in json.loads(self.path.read_text())["schemas"]:
+                self._add(entry)
+
+    def _add(self, entry: dict):
+        self._schemas[entry["id"]] = entry
+        self._parsed[entry["id"]] = fastavro.parse_schema(entry["schema"], named_schemas={})
+        latest = self._latest.get(entry["subject"])
+        if latest is None or self._schemas[latest]["version"] < entry["version"]:
+            self._latest[entry["subject"]] = entry["id"]
+
+    def register(self, subject: str, schema: dict) -> int:
+        with self._lock:
+            for entry in self._schemas.values():
+                if entry["subject"] == subject and entry["schema"] == schema:
+                    return entry["id"]
+
+            latest = self._latest.get(subject)
+            entry = {
+                "id": max(self._schemas, default=0) + 1,
+                "subject": subject,
+                "version": self._schemas[latest]["version"] + 1 if latest else 1,
+                "schema": schema,
+            }
+            self._add(entry)
+            self._save()
+            return entry["id"]
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        entries = [self._schemas[schema_id] for schema_id in sorted(self._schemas)]
+        tmp.write_text(json.dumps({"schemas": entries}, indent=2) + "\n")
+        tmp.replace(self.path)
+
+    def schema(self, schema_id: int) -> dict:
+        return self._parsed[schema_id]
+
+    def subject(self, schema_id: int) -> str:
+        return self._schemas[schema_id]["subject"]
+
+    def latest(self, subject: str) -> Optional[Tuple[int, dict]]:
+        schema_id = self._latest.get(subject)
+        if schema_id is None:
+            return None
+        return schema_id, self._parsed[schema_id]
+
+
+class JsonCodec:
+    """Plain JSON events, keys repeated in every message"""
+    name = "json"
+
+    def encode(self, event: dict) -> bytes:
+        return orjson.dumps(event)
+
+    def decode(self, raw: bytes) -> dict:
+        return orjson.loads(raw)
+
+
+class AvroCodec:
+    """Schemaless Avro body behind a 5 byte header carrying the schema id.
+
+    Field names live in the registry instead of every message, the event id
+    travels as 16 raw bytes and the timestamp as a varint. Event types
+    without a registered schema fall back to JSON.
+    """
+    name = "avro"
+
+    def __init__(self, registry: SchemaRegistry):
+        self.registry = registry
+        self._writers: Dict[str, Tuple[int, dict]] = {}
+        for subject, schema in EVENT_SCHEMAS.items():
+            schema_id = registry.register(subject, schema)
+            self._writers[subject] = (schema_id, registry.schema(schema_id))
+
+    def encode(self, event: dict) -> bytes:
+        writer = self._writers.get(event.get("event_type"))
+        if writer is None:
+            return orjson.dumps(event)
+        schema_id, schema = writer
+        record = dict(event)
+        record["event_id"] = bytes.fromhex(event["event_id"].replace("-", ""))
+        if isinstance(record["timestamp"], str):
+            record["timestamp"] = datetime.fromisoformat(record["timestamp"])
+
+        buffer = io.BytesIO()
+        buffer.write(HEADER.pack(MAGIC_BYTE, schema_id))
+        fastavro.schemaless_writer(buffer, schema, record)
+        return buffer.getvalue()
+
+    def decode(self, raw: bytes) -> dict:
+        if raw[:1] != b"\x00":
+            return orjson.loads(raw)
+        _, schema_id = HEADER.unpack_from(raw)
+        writer_schema = self.registry.schema(schema_id)
+        # Resolve old versions against the newest schema of the subject
+        latest_id, reader_schema = self.registry.latest(self.registry.subject(schema_id))
+        if latest_id == schema_id:
+            reader_schema = None
+        event = fastavro.schemaless_reader(io.BytesIO(raw[HEADER.size:]), writer_schema, reader_schema)
+
+        # Same shape as the JSON events: string id, naive UTC iso timestamp
+        event["event_id"] = str(uuid.UUID(bytes=event["event_id"]))
+        event["timestamp"] = event["timestamp"].replace(tzinfo=None).isoformat()
+        return event
+
+
+_registry: Optional[SchemaRegistry] = None
+_codecs: Dict[str, object] = {}
+
+
+def get_codec(name: str = KAFKA_EVENT_CODEC):
+    """Codec by name, built once per process"""
+    global _registry
+    if name not in _codecs:
+        if name == "avro":
+            if _registry is None:
+                _registry = SchemaRegistry()
+            _codecs[name] = AvroCodec(_registry)
+        elif name == "json":
+            _codecs[name] = JsonCodec()
+        else:
+            raise ValueError(f"Unknown event codec: {name}")
+    return _codecs[name]
+
+
+def decode_event(raw: bytes) -> dict:
+    """Decode an event whatever codec its producer used"""
+    if raw[:1] == b"\x00":
+        return get_codec("avro").decode(raw)
+    return orjson.loads(raw)
+
+
+def decode_model(raw: bytes) -> BaseEvent:
+    """Decode an event into its shared.kafka_events model"""
+    event = decode_event(raw)
+    model = EVENT_MODELS.get(event.get("event_type"), BaseEvent)
+    return model.model_validate(event)
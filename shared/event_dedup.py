@@ -0,0 +1,222 @@
+from sqlmodel import SQLModel, Field, select, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+import hashlib
+import logging
+import math
+import os
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# In memory window of recently processed event ids
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+DEDUP_TTL_SECONDS = float(os.getenv("DEDUP_TTL_SECONDS", "3600"))
+# Bloom filter in front of the processed ids table, 0 disables it
+DEDUP_BLOOM_CAPACITY = int(os.getenv("DEDUP_BLOOM_CAPACITY", "1000000"))
+DEDUP_BLOOM_ERROR_RATE = float(os.getenv("DEDUP_BLOOM_ERROR_RATE", "0.001"))
+# How long processed ids are kept in the table, longer than any replay we expect
+DEDUP_RETENTION_HOURS = float(os.getenv("DEDUP_RETENTION_HOURS", "24"))
+
+
+class ProcessedEvent(SQLModel, table=True):
+    """An event id the consumer has already handled"""
+    __tablename__ = "processed_event"
+
+    event_id: str = Field(primary_key=True, max_length=36)
+    processed_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
+class BloomFilter:
+    """Fixed size Bloom filter: no false negatives, about `error_rate` false positives at capacity"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # Double hashing, two 64 bit halves of one digest give all k positions
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def clear(self):
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+
+class EventDeduplicator:
+    """Skips events whose event_id was already processed.
+
+    Recent ids sit in a time and size bounded LRU. With a session maker the
+    ids are also written to the processed_event table so replays survive a
+    restart or a rebalance onto another replica, and a Bloom filter loaded
+    from that table answers "never seen" without a database round trip.
+    The Bloom filter only knows the ids in the table at its last load() and
+    the ones marked here since, so the consumer reloads it whenever it is
+    assigned partitions another replica may have handled.
+    Processed ids are buffered and written once per consumer batch, before
+    its offsets are committed.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEDUP_MAX_ENTRIES,
+        ttl: float = DEDUP_TTL_SECONDS,
+        session_maker: Optional[Callable[[], AsyncSession]] = None,
+        bloom_capacity: int = DEDUP_BLOOM_CAPACITY,
+        bloom_error_rate: float = DEDUP_BLOOM_ERROR_RATE,
+        retention_hours: float = DEDUP_RETENTION_HOURS,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.session_maker = session_maker
+        self.retention = timedelta(hours=retention_hours)
+        self.bloom = BloomFilter(bloom_capacity, bloom_error_rate) if session_maker and bloom_capacity else None
+        self._recent: "OrderedDict[str, float]" = OrderedDict()
+        self._pending: List[str] = []
+        self._last_prune = 0.0
+
+        self.checked = 0
+        self.duplicates = 0
+        self.lru_hits = 0
+        self.bloom_skips = 0
+        self.db_lookups = 0
+        self.db_hits = 0
+        self.persisted = 0
+
+    async def load(self):
+        """Fill the Bloom filter with the ids still in the table"""
+        if self.bloom is None:
+            return
+        # Filled aside, a load failing half way must not leave ids out
+        bloom = BloomFilter(self.bloom.capacity, self.bloom.error_rate)
+        since = datetime.utcnow() - self.retention
+        async with self.session_maker() as session:
+            result = await session.stream_scalars(
+                select(ProcessedEvent.event_id).where(ProcessedEvent.processed_at >= since)
+            )
+            async for event_id in result:
+                bloom.add(event_id)
+        # Marked meanwhile but not flushed yet
+        for event_id in self._pending:
+            bloom.add(event_id)
+        self.bloom = bloom
+        logger.info(f"Dedup bloom filter loaded with {self.bloom.count} processed event ids")
+
+    def _remember(self, event_id: str):
+        self._recent[event_id] = time.monotonic() + self.ttl
+        self._recent.move_to_end(event_id)
+        while len(self._recent) > self.max_entries:
+            self._recent.popitem(last=False)
+
+    async def is_duplicate(self, event_id: str) -> bool:
+        self.checked += 1
+        expires_at = self._recent.get(event_id)
+        if expires_at is not None:
+            if expires_at > time.monotonic():
+                self._recent.move_to_end(event_id)
+                self.lru_hits += 1
+                self.duplicates += 1
+                return True
+            del self._recent[event_id]
+
+        if self.session_maker is None:
+            return False
+        if self.bloom is not None and event_id not in self.bloom:
+            # Not in the table at the last load and not handled here since
+            self.bloom_skips += 1
+            return False
+
+        self.db_lookups += 1
+        async with self.session_maker() as session:
+            found = await session.get(ProcessedEvent, event_id)
+        if found is None:
+            return False
+        self.db_hits += 1
+        self.duplicates += 1
+        self._remember(event_id)
+        return True
+
+    def mark(self, event_id: str):
+        """The event was handled, persisted on the next flush()"""
+        self._remember(event_id)
+        if self.session_maker is not None:
+            self._pending.append(event_id)
+            if self.bloom is not None:
+                self.bloom.add(event_id)
+
+    async def flush(self):
+        """Write the buffered ids in one statement, called before offsets are committed"""
+        if not self._pending:
+            return
+        # Kept until the insert commits, a failed flush is retried with them
+        pending = list(self._pending)
+        async with self.session_maker() as session:
+            dialect = session.bind.dialect.name
+            insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+            # Another replica may have recorded the same id during a rebalance
+            await session.exec(
+                insert(ProcessedEvent)
+                .values([{"event_id": event_id, "processed_at": datetime.utcnow()} for event_id in pending])
+                .on_conflict_do_nothing()
+            )
+            await session.commit()
+        del self._pending[:len(pending)]
+        self.persisted += len(pending)
+
+        if time.monotonic() - self._last_prune > 3600:
+            try:
+                await self.prune()
+            except Exception as e:
+                # The ids are written, pruning can wait for the next flush
+                logger.error(f"Pruning processed event ids failed: {e}")
+
+    async def prune(self):
+        """Drop ids past the retention window, rebuilding an overfull Bloom filter"""
+        self._last_prune = time.monotonic()
+        async with self.session_maker() as session:
+            await session.exec(
+                delete(ProcessedEvent).where(ProcessedEvent.processed_at < datetime.utcnow() - self.retention)
+            )
+            await session.commit()
+        if self.bloom is not None and self.bloom.count > self.bloom.capacity:
+            await self.load()
+
+    def memory_bytes(self) -> int:
+        """Rough footprint of the LRU and the Bloom filter"""
+        lru = sys.getsizeof(self._recent) + sum(sys.getsizeof(event_id) + 24 for event_id in self._recent)
+        return lru + (len(self.bloom.bits) if self.bloom is not None else 0)
+
+    def stats(self) -> dict:
+        return {
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "hit_ratio": round(self.duplicates / self.checked, 4) if self.checked else 0.0,
+            "lru_hits": self.lru_hits,
+            "lru_entries": len(self._recent),
+            "bloom_skips": self.bloom_skips,
+            "bloom_entries": self.bloom.count if self.bloom is not None else None,
+            "db_lookups": self.db_lookups,
+            "db_hits": self.db_hits,
+            "persisted": self.persisted,
+            "memory_bytes": self.memory_bytes(),
+        }
@@ -0,0 +1,41 @@
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session, select
+from datetime import datetime
+from typing import Iterator, Optional, Type
+from pydantic import BaseModel
+import os
+
+# Media type for newline delimited JSON exports
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Rows fetched per server side cursor round trip in bulk exports
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+
+def ndjson_stream(engine, query, read_model: Type[BaseModel], chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """Stream query rows as newline delimited JSON.
+
+    Rows come from a server side cursor `chunk_size` at a time (yield_per),
+    are serialized one by one and written out per chunk, so memory stays
+    flat no matter how big the table is. The generator owns its session
+    because it outlives the request handler that returned it.
+    """
+    with Session(engine) as session:
+        rows = session.exec(query.execution_options(yield_per=chunk_size))
+        lines = []
+        for row in rows:
+            lines.append(read_model.model_validate(row).model_dump_json())
+            if len(lines) >= chunk_size:
+                yield "\n".join(lines) + "\n"
+                lines.clear()
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+
+def export_response(engine, model, read_model: Type[BaseModel], updated_since: Optional[datetime] = None,
+                    options: tuple = ()) -> StreamingResponse:
+    """NDJSON export of a whole table in id order, or only the rows changed since `updated_since`"""
+    query = select(model).options(*options).order_by(model.id)
+    if updated_since is not None:
+        # Incremental pull, only rows changed since the previous run
+        query = query.where(model.updated_at >= updated_since)
+    return StreamingResponse(ndjson_stream(engine, query, read_model), media_type=NDJSON_MEDIA_TYPE)
@@ -1,75 +1,458 @@
-from aiokafka import AIOKafkaProducer, AIOKafkaConsumer
+from aiokafka import AIOKafkaProducer, AIOKafkaConsumer, ConsumerRebalanceListener, TopicPartition
+from aiokafka.errors import CommitFailedError
+try:
+    from aiokafka.codec import has_gzip, has_lz4, has_snappy, has_zstd
+except ImportError:
+    # Older aiokafka uses kafka-python's codecs
+    from kafka.codec import has_gzip, has_lz4, has_snappy, has_zstd
 import asyncio
-import json
+import os
+import time
 import uuid
 from datetime import datetime
-from typing import Callable, List, Optional
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
 import logging
 
+from shared.event_codec import KAFKA_EVENT_CODEC, get_codec, decode_event
+
+if TYPE_CHECKING:
+    # Needs sqlmodel, which the gateway doesn't install
+    from shared.event_dedup import EventDeduplicator
+
 logger = logging.getLogger(__name__)
 
+# Producer batching, all overridable from the environment
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", "5"))
+KAFKA_BATCH_SIZE = int(os.getenv("KAFKA_BATCH_SIZE", str(64 * 1024)))
+# "lz4", "zstd", "gzip", "snappy" or "none", lz4/zstd need their codec package installed
+KAFKA_COMPRESSION = os.getenv("KAFKA_COMPRESSION", "lz4")
+KAFKA_ACKS = os.getenv("KAFKA_ACKS", "all")
+
+COMPRESSION_CODECS = {"gzip": has_gzip, "snappy": has_snappy, "lz4": has_lz4, "zstd": has_zstd}
+
+
+def available_compression(compression_type: Optional[str]) -> Optional[str]:
+    """The compression to produce with, gzip when the requested codec's package isn't installed"""
+    if compression_type in (None, "", "none"):
+        return None
+    installed = COMPRESSION_CODECS.get(compression_type)
+    if installed is not None and not installed():
+        # Otherwise the producer can't start and every send fails
+        logger.warning(f"Kafka compression {compression_type} is not installed, falling back to gzip")
+        return "gzip"
+    return compression_type
+
+
 class KafkaClient:
-    def __init__(self, bootstrap_servers: str):
+    """Batched, fire-and-forget kafka producer.
+
+    send_event() only enqueues the event into the producer's batch
+    accumulator and returns the delivery future; records to the same
+    partition go out together every `linger_ms` or once a batch fills up,
+    instead of one broker round trip per event.
+    """
+
+    def __init__(
+        self,
+        bootstrap_servers: str,
+        producer_name: str = os.getenv("SERVICE_NAME", "unknown-service"),
+        linger_ms: int = KAFKA_LINGER_MS,
+        max_batch_size: int = KAFKA_BATCH_SIZE,
+        compression_type: Optional[str] = KAFKA_COMPRESSION,
+        on_delivery_failure: Optional[Callable[[str, dict, BaseException], None]] = None,
+        codec: str = KAFKA_EVENT_CODEC,
+    ):
         self.bootstrap_servers = bootstrap_servers
+        self.producer_name = producer_name
+        self.linger_ms = linger_ms
+        self.max_batch_size = max_batch_size
+        self.compression_type = available_compression(compression_type)
+        self.on_delivery_failure = on_delivery_failure
+        self.codec = get_codec(codec)
         self.producer: Optional[AIOKafkaProducer] = None
+        self._start_lock = asyncio.Lock()
+
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.sent = 0
+        self.delivered = 0
+        self.failed = 0
 
     async def start(self):
         """Start the kafka producer."""
-        self.producer = AIOKafkaProducer(
-            bootstrap_servers=self.bootstrap_servers, 
-            value_serializer=lambda v: json.dumps(v).encode('utf-8')
-        )
-        await self.producer.start()
-        logger.info("Kafka Producer started")
+        async with self._start_lock:
+            if self.producer:
+                return
+            producer = AIOKafkaProducer(
+                bootstrap_servers=self.bootstrap_servers,
+                client_id=self.producer_name,
+                acks=KAFKA_ACKS if KAFKA_ACKS == "all" else int(KAFKA_ACKS),
+                linger_ms=self.linger_ms,
+                max_batch_size=self.max_batch_size,
+                compression_type=self.compression_type,
+                key_serializer=lambda k: k.encode('utf-8') if k is not None else None,
+                value_serializer=self.codec.encode
+            )
+            try:
+                await producer.start()
+            except Exception:
+                await producer.stop()
+                raise
+            self.producer = producer
+            logger.info(f"Kafka Producer started for {self.producer_name} "
+                        f"(linger_ms={self.linger_ms}, batch={self.max_batch_size}, compression={self.compression_type})")
 
     async def stop(self):
-        """Stop the kafka producer."""
+        """Stop the kafka producer, flushing whatever is still batched."""
         if self.producer:
             await self.producer.stop()
+            self.producer = None
             logger.info("Kafka Producer stopped")
 
-    async def send_event(self, topic: str, event_type: str, data: dict):
-        """Send an event to Kafka topics"""
-        if not self.producer:
-            await self.start()
-        
-        event = {
+    async def flush(self):
+        if self.producer:
+            await self.producer.flush()
+
+    def build_event(self, event_type: str, data: dict) -> dict:
+        return {
             "event_id": str(uuid.uuid4()),
             "event_type": event_type,
             "timestamp": datetime.utcnow().isoformat(),
-            "producer": "user-service", # will be set dynamically based on service
+            "producer": self.producer_name,
             "data": data
         }
-    
+
+    def _delivery_failed(self, topic: str, event: dict, error: BaseException):
+        self.failed += 1
+        logger.error(f"Failed to deliver {event.get('event_type')} event {event.get('event_id')} to topic {topic}: {error}")
+        if self.on_delivery_failure:
+            self.on_delivery_failure(topic, event, error)
+
+    def _on_delivery(self, topic: str, event: dict, future: asyncio.Future):
+        self.in_flight -= 1
+        if future.cancelled():
+            self._delivery_failed(topic, event, asyncio.CancelledError())
+        elif future.exception() is not None:
+            self._delivery_failed(topic, event, future.exception())
+        else:
+            self.delivered += 1
+
+    async def publish(self, topic: str, event: dict, key: Optional[str] = None) -> Optional[asyncio.Future]:
+        """Enqueue an already built event, returns the delivery future (or None if it couldn't be enqueued)
+
+        `key` picks the partition, events with the same key keep their order.
+        Await the returned future only when the caller needs the broker ack.
+        """
         try:
-            await self.producer.send_and_wait(topic, event)
-            logger.info(f"Event send to topic {topic}: {event_type}")
+            if not self.producer:
+                await self.start()
+            future = await self.producer.send(topic, event, key=key)
         except Exception as e:
-            logger.error(f"Failed to send event to topic {topic}: {e}")
+            self._delivery_failed(topic, event, e)
+            return None
+
+        self.sent += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        future.add_done_callback(lambda f: self._on_delivery(topic, event, f))
+        return future
+
+    async def send_event(self, topic: str, event_type: str, data: dict, key: Optional[str] = None) -> Optional[asyncio.Future]:
+        """Build and enqueue an event, see publish()"""
+        return await self.publish(topic, self.build_event(event_type, data), key=key)
+
+    async def send_event_and_wait(self, topic: str, event_type: str, data: dict, key: Optional[str] = None) -> bool:
+        """Send an event and wait for the broker ack, returns whether it was delivered"""
+        future = await self.send_event(topic, event_type, data, key=key)
+        if future is None:
             return False
-        
+        try:
+            await future
+            return True
+        except Exception:
+            return False
+
+    def stats(self) -> dict:
+        return {
+            "producer": self.producer_name,
+            "started": self.producer is not None,
+            "linger_ms": self.linger_ms,
+            "max_batch_size": self.max_batch_size,
+            "compression": self.compression_type,
+            "codec": self.codec.name,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "sent": self.sent,
+            "delivered": self.delivered,
+            "failed": self.failed,
+        }
+
+
+# Consumer batching, all overridable from the environment
+KAFKA_CONSUMER_BATCH = int(os.getenv("KAFKA_CONSUMER_BATCH", "500"))
+KAFKA_CONSUMER_CONCURRENCY = int(os.getenv("KAFKA_CONSUMER_CONCURRENCY", "16"))
+KAFKA_CONSUMER_POLL_MS = int(os.getenv("KAFKA_CONSUMER_POLL_MS", "1000"))
+# Log one message out of this many instead of every payload
+KAFKA_LOG_SAMPLE_EVERY = int(os.getenv("KAFKA_LOG_SAMPLE_EVERY", "1000"))
+# Pause before re-reading a batch whose handlers failed
+KAFKA_CONSUMER_RETRY_BACKOFF = float(os.getenv("KAFKA_CONSUMER_RETRY_BACKOFF", "1.0"))
+# Times a record's handler runs before the record is skipped, so one poison record can't block its partition
+KAFKA_CONSUMER_MAX_ATTEMPTS = int(os.getenv("KAFKA_CONSUMER_MAX_ATTEMPTS", "5"))
+
+
+class _DedupRebalanceListener(ConsumerRebalanceListener):
+    """Keeps the dedup Bloom filter in step with partition ownership.
+
+    The partitions' previous owner finishes its batch (and writes its
+    processed ids) before giving them up, and the new owner reloads the
+    Bloom filter from the table once they are assigned, so ids handled by
+    another replica are never taken for new.
+    """
+
+    def __init__(self, consumer: "KafkaConsumer"):
+        self.consumer = consumer
+
+    async def on_partitions_revoked(self, revoked):
+        async with self.consumer._batch_lock:
+            pass
+
+    async def on_partitions_assigned(self, assigned):
+        if assigned:
+            async with self.consumer._batch_lock:
+                await self.consumer.dedup.load()
+
+
 class KafkaConsumer:
-    def __inti__(self, bootstrap_servers: str, group_id: str):
+    """Batched kafka consumer running handlers concurrently.
+
+    Each poll fetches up to `max_batch` records with getmany(). Records are
+    grouped by message key (by partition when they have none): groups run
+    concurrently, at most `max_concurrency` at a time, while the records of
+    one group are handled one after the other so per-key order is kept.
+    Offsets are committed by hand once the batch's handlers are done, a
+    partition with a failed record is rewound to it and read again, up
+    to `max_attempts` times before the record is logged and skipped.
+    With a `dedup` store, events whose event_id was already processed are
+    skipped before their handler runs.
+    """
+
+    def __init__(
+        self,
+        bootstrap_servers: str,
+        group_id: Optional[str],
+        max_batch: int = KAFKA_CONSUMER_BATCH,
+        max_concurrency: int = KAFKA_CONSUMER_CONCURRENCY,
+        poll_timeout_ms: int = KAFKA_CONSUMER_POLL_MS,
+        log_sample_every: int = KAFKA_LOG_SAMPLE_EVERY,
+        dedup: Optional["EventDeduplicator"] = None,
+        max_attempts: int = KAFKA_CONSUMER_MAX_ATTEMPTS,
+    ):
         self.bootstrap_servers = bootstrap_servers
         self.group_id = group_id
-        self.consumer: Optional[AIOKafkaConsumer] = None
-    
+        self.max_batch = max_batch
+        self.max_concurrency = max_concurrency
+        self.poll_timeout_ms = poll_timeout_ms
+        self.log_sample_every = max(1, log_sample_every)
+        self.dedup = dedup
+        self.max_attempts = max(1, max_attempts)
+        self._consumer: Optional[AIOKafkaConsumer] = None
+        self._batch_lock = asyncio.Lock()
+        self._started_at: Optional[float] = None
+        # Failed attempts of the records being retried
+        self._attempts: Dict[tuple, int] = {}
+
+        self.consumed = 0
+        self.failed = 0
+        self.invalid = 0
+        self.batches = 0
+        self.commits = 0
+        self.retries = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.last_batch_size = 0
+        self.last_batch_seconds = 0.0
+        self.lag: Dict[str, int] = {}
+
     async def consumer(self, topics: List[str], callable: Callable):
-        """Consume messages from kafka topics"""
-        self.consumer = AIOKafkaConsumer(
-            *topics,
+        """Consume messages from kafka topics, `callable` gets each decoded event"""
+        self._consumer = AIOKafkaConsumer(
             bootstrap_servers=self.bootstrap_servers,
             group_id=self.group_id,
-            value_deserializer=lambda m: json.loads(m.decode('utf-8'))
+            # Without a group there is nothing to commit to
+            enable_auto_commit=False,
+            max_poll_records=self.max_batch,
+            key_deserializer=lambda k: k.decode('utf-8') if k is not None else None
         )
 
-        await self.consumer.start()
-        logger.info(f"Kafka Consumer started for topics: {topics}")
+        # In a group the dedup Bloom filter is (re)loaded on every partition assignment
+        rebalance_dedup = self.dedup is not None and self.group_id is not None
+        if rebalance_dedup:
+            self._consumer.subscribe(topics, listener=_DedupRebalanceListener(self))
+        else:
+            self._consumer.subscribe(topics)
+
+        try:
+            await self._consumer.start()
+            if self.dedup is not None and not rebalance_dedup:
+                await self.dedup.load()
+        except Exception:
+            await self._consumer.stop()
+            raise
+        self._started_at = time.monotonic()
+        logger.info(f"Kafka Consumer started for topics: {topics} "
+                    f"(batch={self.max_batch}, concurrency={self.max_concurrency})")
 
         try:
-            async for message in self.consumer:
-                logger.info(f"Message received from topic {message.topic}: {message.value}")
-                await callable(message.value)
+            while True:
+                batches = await self._consumer.getmany(
+                    timeout_ms=self.poll_timeout_ms,
+                    max_records=self.max_batch
+                )
+                if not batches:
+                    continue
+                try:
+                    async with self._batch_lock:
+                        await self._process_batch(batches, callable)
+                except Exception as e:
+                    logger.error(f"Processing a batch failed, re-reading it in {KAFKA_CONSUMER_RETRY_BACKOFF}s: {e}")
+                    self._rewind(batches)
+                    await asyncio.sleep(KAFKA_CONSUMER_RETRY_BACKOFF)
         finally:
-            await self.consumer.stop()
+            await self._consumer.stop()
             logger.info("Kafka Consumer stopped")
+
+    async def _process_batch(self, batches: Dict[TopicPartition, list], callable: Callable):
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # Records sharing a key must be handled in offset order
+        groups: Dict[tuple, list] = {}
+        for tp, messages in batches.items():
+            for message in messages:
+                ordering_key = (tp.topic, message.key) if message.key is not None else (tp.topic, tp.partition)
+                groups.setdefault(ordering_key, []).append((tp, message))
+
+        # First failed offset of every partition, if any
+        failed_offsets: Dict[TopicPartition, int] = {}
+
+        async def run_group(records: list):
+            async with semaphore:
+                for tp, message in records:
+                    if tp in failed_offsets and message.offset > failed_offsets[tp]:
+                        # The partition is re-read from an earlier offset anyway
+                        continue
+                    if await self._handle(message, callable):
+                        self._attempts.pop((tp, message.offset), None)
+                        continue
+                    attempts = self._attempts.pop((tp, message.offset), 0) + 1
+                    if attempts >= self.max_attempts:
+                        self.dropped += 1
+                        logger.error(f"Giving up on {message.topic}-{message.partition}@{message.offset} "
+                                     f"after {attempts} attempts, skipping it")
+                        continue
+                    self._attempts[(tp, message.offset)] = attempts
+                    failed_offsets[tp] = min(message.offset, failed_offsets.get(tp, message.offset))
+                    return
+
+        await asyncio.gather(*[run_group(records) for records in groups.values()])
+
+        # Commit what succeeded, rewind partitions to their first failure
+        offsets = {}
+        for tp, messages in batches.items():
+            if tp in failed_offsets:
+                offsets[tp] = failed_offsets[tp]
+                self._consumer.seek(tp, failed_offsets[tp])
+            else:
+                offsets[tp] = messages[-1].offset + 1
+        try:
+            if self.dedup is not None:
+                # Processed ids must be durable before the offsets move past them
+                await self.dedup.flush()
+            if self.group_id is not None:
+                await self._consumer.commit(offsets)
+                self.commits += 1
+        except CommitFailedError as e:
+            # The partitions moved to another replica, which re-reads from the last commit
+            logger.warning(f"Offset commit failed after a rebalance: {e}")
+        except Exception as e:
+            # Re-read the whole batch, the ids still pending in dedup skip what was handled
+            self._rewind(batches)
+            self.retries += 1
+            logger.error(f"Committing the batch failed, re-reading it in {KAFKA_CONSUMER_RETRY_BACKOFF}s: {e}")
+            await asyncio.sleep(KAFKA_CONSUMER_RETRY_BACKOFF)
+            return
+
+        self.batches += 1
+        self.last_batch_size = sum(len(messages) for messages in batches.values())
+        self.last_batch_seconds = time.perf_counter() - started
+        for tp in batches:
+            highwater = self._consumer.highwater(tp)
+            if highwater is not None:
+                self.lag[f"{tp.topic}-{tp.partition}"] = max(0, highwater - offsets[tp])
+
+        if failed_offsets:
+            self.retries += 1
+            logger.warning(f"{len(failed_offsets)} partitions had failed handlers, retrying them in {KAFKA_CONSUMER_RETRY_BACKOFF}s")
+            await asyncio.sleep(KAFKA_CONSUMER_RETRY_BACKOFF)
+
+    def _rewind(self, batches: Dict[TopicPartition, list]):
+        """Seek the partitions of a batch back to its first records"""
+        for tp, messages in batches.items():
+            try:
+                self._consumer.seek(tp, messages[0].offset)
+            except Exception as e:
+                # Revoked meanwhile, its new owner reads from the last commit
+                logger.warning(f"Could not rewind {tp.topic}-{tp.partition}: {e}")
+
+    async def _handle(self, message, callable: Callable) -> bool:
+        """Run the handler for one record, returns False if it has to be retried"""
+        try:
+            event = decode_event(message.value)
+        except Exception as e:
+            # A record that can't be decoded never will be, skip it
+            self.invalid += 1
+            logger.error(f"Skipping undecodable message {message.topic}-{message.partition}@{message.offset}: {e}")
+            return True
+
+        event_id = event.get("event_id")
+        if self.dedup is not None and event_id and await self.dedup.is_duplicate(event_id):
+            self.skipped += 1
+            return True
+
+        try:
+            await callable(event)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Handler failed for {event.get('event_type')} event {event.get('event_id')} "
+                         f"at {message.topic}-{message.partition}@{message.offset}: {e}")
+            return False
+
+        self.consumed += 1
+        if self.dedup is not None and event_id:
+            self.dedup.mark(event_id)
+        if (self.consumed - 1) % self.log_sample_every == 0:
+            logger.info(f"Consumed {self.consumed} messages, latest {event.get('event_type')} "
+                        f"from {message.topic}-{message.partition}@{message.offset}")
+        return True
+
+    def stats(self) -> dict:
+        uptime = time.monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "group_id": self.group_id,
+            "started": self._started_at is not None,
+            "max_batch": self.max_batch,
+            "max_concurrency": self.max_concurrency,
+            "consumed": self.consumed,
+            "failed": self.failed,
+            "invalid": self.invalid,
+            "batches": self.batches,
+            "commits": self.commits,
+            "retries": self.retries,
+            "skipped_duplicates": self.skipped,
+            "dropped": self.dropped,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_ms": round(self.last_batch_seconds * 1000, 2),
+            "messages_per_sec": round(self.consumed / uptime, 2) if uptime else 0.0,
+            "lag": dict(self.lag),
+            "total_lag": sum(self.lag.values()),
+        }
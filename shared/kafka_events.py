@@ -12,6 +12,7 @@ class EventType(str, Enum):
     PRODUCT_CREATED = "product.created"
     PRODUCT_UPDATED = "product.updated"
     PRODUCT_STOCK_UPDATED = "product.stock.updated"
+    PRODUCT_DELETED = "product.deleted"
 
 class BaseEvent(BaseModel):
     event_id: str
@@ -0,0 +1,140 @@
+from sqlmodel import SQLModel, Field, select, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import Column, JSON
+from typing import Callable, Optional
+from datetime import datetime
+import asyncio
+import logging
+import os
+
+from shared.kafka_client import KafkaClient
+
+logger = logging.getLogger(__name__)
+
+# Rows published per relay round trip
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+# How long an idle relay sleeps before polling the table again
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.5"))
+
+
+class OutboxEvent(SQLModel, table=True):
+    """An event waiting to be published, written in the same transaction as the change it describes"""
+    __tablename__ = "outbox_event"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    topic: str
+    key: Optional[str] = None
+    # The complete event (event_id included), so a retried publish is the same event
+    payload: dict = Field(sa_column=Column(JSON, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+def add_outbox_event(session: AsyncSession, topic: str, event: dict, key: Optional[str] = None):
+    """Queue an event, it is only visible to the relay once the caller commits"""
+    session.add(OutboxEvent(topic=topic, key=key, payload=event))
+
+
+class OutboxRelay:
+    """Background task draining the outbox table to kafka in batches.
+
+    Each round locks up to `batch_size` of the oldest rows with
+    FOR UPDATE SKIP LOCKED, so several replicas can relay side by side
+    without publishing the same rows, hands them all to the producer at once
+    and deletes the ones the broker acked in the same transaction. Rows that
+    fail stay in the table and go out on a later round (at least once).
+    """
+
+    def __init__(
+        self,
+        kafka_client: KafkaClient,
+        session_maker: Callable[[], AsyncSession],
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+    ):
+        self.kafka_client = kafka_client
+        self.session_maker = session_maker
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.published = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_size = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+        logger.info(f"Outbox relay started (batch={self.batch_size}, poll={self.poll_interval}s)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self):
+        """New rows were committed, don't wait for the next poll"""
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                relayed = await self.relay_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox relay round failed: {e}")
+                relayed = 0
+
+            # A full batch means there is probably more waiting
+            if relayed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def relay_batch(self) -> int:
+        """Publish one batch of outbox rows, returns how many were published"""
+        async with self.session_maker() as session:
+            rows = (await session.exec(
+                select(OutboxEvent)
+                .order_by(OutboxEvent.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )).all()
+            if not rows:
+                return 0
+
+            # Enqueue the whole batch before waiting, the producer sends it in a few requests
+            futures = [await self.kafka_client.publish(row.topic, row.payload, key=row.key) for row in rows]
+            results = await asyncio.gather(*[f for f in futures if f is not None], return_exceptions=True)
+            results = iter(results)
+
+            delivered = []
+            for row, future in zip(rows, futures):
+                if future is not None and not isinstance(next(results), BaseException):
+                    delivered.append(row.id)
+
+            if delivered:
+                await session.exec(delete(OutboxEvent).where(OutboxEvent.id.in_(delivered)))
+            await session.commit()
+
+        self.batches += 1
+        self.last_batch_size = len(rows)
+        self.published += len(delivered)
+        self.failed += len(rows) - len(delivered)
+        return len(delivered)
+
+    def stats(self) -> dict:
+        return {
+            "batch_size": self.batch_size,
+            "published": self.published,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+        }
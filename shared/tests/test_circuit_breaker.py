@@ -0,0 +1,76 @@
+import asyncio
+
+import httpx
+import pytest
+
+import shared.circuit_breaker as circuit_breaker
+from shared.circuit_breaker import CircuitBreaker, TokenBudget
+
+URL = "http://product-service:8002/products/1"
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "CB_RETRY_BASE", 0)
+    monkeypatch.setattr(circuit_breaker, "CB_RETRY_CAP", 0)
+
+
+def breaker_answering(*statuses) -> tuple:
+    """A CircuitBreaker whose upstream answers the given statuses in turn (the last one repeats)"""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        status = statuses[min(len(requests), len(statuses)) - 1]
+        return httpx.Response(status, json={"id": 1})
+
+    breaker = CircuitBreaker()
+    breaker._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return breaker, requests
+
+
+def test_budget_caps_extra_requests():
+    budget = TokenBudget(ratio=0.5, burst=2)
+    assert budget.spend() and budget.spend()
+    assert not budget.spend()
+
+    budget.earn()
+    assert not budget.spend()
+    budget.earn()
+    assert budget.spend()
+    assert budget.stats() == {"calls": 2, "spent": 3, "exhausted": 2, "tokens": 0}
+
+
+def test_transient_error_is_retried():
+    breaker, requests = breaker_answering(503, 200)
+
+    assert asyncio.run(breaker.call_service("GET", URL)) == {"id": 1}
+    assert len(requests) == 2
+
+
+def test_retries_stop_when_the_budget_runs_out():
+    breaker, requests = breaker_answering(503)
+    budget = breaker.retry_budgets["product-service:8002"] = TokenBudget(ratio=0, burst=1)
+
+    async def scenario():
+        # One token: the first call retries once, later ones go out a single time
+        with pytest.raises(httpx.HTTPStatusError):
+            await breaker.call_service("GET", URL)
+        assert len(requests) == 2
+        for _ in range(3):
+            with pytest.raises(httpx.HTTPStatusError):
+                await breaker.call_service("GET", URL)
+        assert len(requests) == 5
+        await breaker.close()
+
+    asyncio.run(scenario())
+    assert budget.exhausted == 4
+    assert budget.spent == 1
+
+
+def test_non_idempotent_calls_are_not_retried():
+    breaker, requests = breaker_answering(503)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(breaker.call_service("POST", URL, data={"quantity": 1}))
+    assert len(requests) == 1
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from shared.event_dedup import EventDeduplicator
+
+
+def test_duplicates_are_skipped_across_restarts(session_maker):
+    async def scenario():
+        before = EventDeduplicator(session_maker=session_maker)
+        await before.load()
+        assert not await before.is_duplicate("event-1")
+        before.mark("event-1")
+        await before.flush()
+
+        # A new replica starts with an empty memory, the table still knows the id
+        after = EventDeduplicator(session_maker=session_maker)
+        await after.load()
+        assert await after.is_duplicate("event-1")
+        assert not await after.is_duplicate("event-2")
+
+    asyncio.run(scenario())
+
+
+def test_duplicates_are_found_without_the_bloom_filter(session_maker):
+    async def scenario():
+        before = EventDeduplicator(session_maker=session_maker, bloom_capacity=0)
+        before.mark("event-1")
+        await before.flush()
+
+        after = EventDeduplicator(session_maker=session_maker, bloom_capacity=0)
+        assert await after.is_duplicate("event-1")
+        assert not await after.is_duplicate("event-2")
+
+    asyncio.run(scenario())
+
+
+def test_failed_flush_keeps_the_pending_ids(session_maker):
+    def unavailable():
+        raise ConnectionError("database is down")
+
+    async def scenario():
+        dedup = EventDeduplicator(session_maker=unavailable)
+        dedup.mark("event-1")
+        with pytest.raises(ConnectionError):
+            await dedup.flush()
+        assert dedup.persisted == 0
+
+        dedup.session_maker = session_maker
+        await dedup.flush()
+        assert dedup.persisted == 1
+
+        restarted = EventDeduplicator(session_maker=session_maker)
+        await restarted.load()
+        assert await restarted.is_duplicate("event-1")
+
+    asyncio.run(scenario())
+
+
+def test_memory_only_dedup_forgets_on_restart():
+    async def scenario():
+        dedup = EventDeduplicator()
+        dedup.mark("event-1")
+        assert await dedup.is_duplicate("event-1")
+        assert not await EventDeduplicator().is_duplicate("event-1")
+
+    asyncio.run(scenario())
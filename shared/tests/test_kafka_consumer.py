@@ -0,0 +1,139 @@
+import asyncio
+from collections import namedtuple
+
+import orjson
+import pytest
+from aiokafka import TopicPartition
+
+import shared.kafka_client as kafka_client
+from shared.event_dedup import EventDeduplicator
+from shared.kafka_client import KafkaConsumer
+
+Record = namedtuple("Record", "topic partition offset key value")
+
+TP0 = TopicPartition("events", 0)
+TP1 = TopicPartition("events", 1)
+
+
+class FakeConsumer:
+    """Records the seeks and commits the batch processing asks for"""
+
+    def __init__(self):
+        self.seeks = []
+        self.commits = []
+
+    def seek(self, tp, offset):
+        self.seeks.append((tp.partition, offset))
+
+    async def commit(self, offsets):
+        self.commits.append({tp.partition: offset for tp, offset in offsets.items()})
+
+    def highwater(self, tp):
+        return None
+
+
+def record(tp, offset, message_key, **event):
+    return Record(tp.topic, tp.partition, offset, message_key, orjson.dumps(event))
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(kafka_client, "KAFKA_CONSUMER_RETRY_BACKOFF", 0)
+
+
+def make_consumer(**kwargs) -> KafkaConsumer:
+    consumer = KafkaConsumer("kafka:9092", "test-group", **kwargs)
+    consumer._consumer = FakeConsumer()
+    return consumer
+
+
+def test_records_of_a_key_are_handled_in_offset_order():
+    consumer = make_consumer(max_concurrency=4)
+    batch = {TP0: [record(TP0, offset, str(offset % 3).encode(), key=offset % 3, seq=offset) for offset in range(30)]}
+    handled = []
+
+    async def handler(event):
+        # Later records of other keys overtake, those of the same key must not
+        await asyncio.sleep(0.001 * ((event["seq"] * 7) % 5))
+        handled.append((event["key"], event["seq"]))
+
+    asyncio.run(consumer._process_batch(batch, handler))
+
+    assert len(handled) == 30
+    for key in range(3):
+        sequence = [seq for handled_key, seq in handled if handled_key == key]
+        assert sequence == sorted(sequence)
+    assert consumer._consumer.commits == [{0: 30}]
+
+
+def test_failed_record_is_retried_then_dropped():
+    consumer = make_consumer(max_attempts=3)
+    batch = {
+        TP0: [record(TP0, 0, None, seq=0), record(TP0, 1, None, seq=1), record(TP0, 2, None, seq=2)],
+        TP1: [record(TP1, 10, None, seq=10)],
+    }
+    handled = []
+
+    async def handler(event):
+        if event["seq"] == 1:
+            raise RuntimeError("poison")
+        handled.append(event["seq"])
+
+    async def scenario():
+        for _ in range(2):
+            await consumer._process_batch(batch, handler)
+        # Retried from the failed record, the partition doesn't move past it
+        assert consumer._consumer.commits[-1] == {0: 1, 1: 11}
+        assert consumer._consumer.seeks == [(0, 1), (0, 1)]
+        assert consumer.dropped == 0
+
+        await consumer._process_batch({TP0: batch[TP0][1:]}, handler)
+
+    asyncio.run(scenario())
+
+    assert consumer.dropped == 1
+    assert consumer._consumer.commits[-1] == {0: 3}
+    assert consumer.retries == 2
+    assert consumer._attempts == {}
+    # The record after the poison one runs once it is dropped, not before
+    assert handled == [0, 10, 0, 10, 2]
+
+
+def test_failed_flush_rewinds_the_batch_and_keeps_the_ids(session_maker):
+    database_down = True
+
+    def flaky_session_maker():
+        if database_down:
+            raise ConnectionError("database is down")
+        return session_maker()
+
+    dedup = EventDeduplicator(session_maker=flaky_session_maker)
+    consumer = make_consumer(dedup=dedup)
+    batch = {TP0: [record(TP0, offset, None, event_id=f"event-{offset}") for offset in range(3)]}
+    handled = []
+
+    async def handler(event):
+        handled.append(event["event_id"])
+
+    async def scenario():
+        await consumer._process_batch(batch, handler)
+        assert consumer._consumer.commits == []
+        assert consumer._consumer.seeks == [(0, 0)]
+        assert dedup._pending == ["event-0", "event-1", "event-2"]
+
+        # The batch comes again, its events were handled already
+        nonlocal database_down
+        database_down = False
+        await consumer._process_batch(batch, handler)
+
+        restarted = EventDeduplicator(session_maker=session_maker)
+        await restarted.load()
+        for offset in range(3):
+            assert await restarted.is_duplicate(f"event-{offset}")
+
+    asyncio.run(scenario())
+
+    assert handled == ["event-0", "event-1", "event-2"]
+    assert consumer.skipped == 3
+    assert dedup._pending == []
+    assert consumer._consumer.commits == [{0: 3}]
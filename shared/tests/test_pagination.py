@@ -0,0 +1,38 @@
+import base64
+from datetime import datetime
+
+import pytest
+
+from shared.pagination import InvalidCursor, decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 17, 12, 30, 15, 250000)
+    cursor = encode_cursor(created_at, 42)
+
+    assert "=" not in cursor
+    value, order_id = decode_cursor(cursor, 2)
+    assert datetime.fromisoformat(value) == created_at
+    assert order_id == 42
+
+
+def test_cursor_round_trip_of_sort_values():
+    assert decode_cursor(encode_cursor("price", 19.99, 7), 3) == ["price", 19.99, 7]
+    assert decode_cursor(encode_cursor("name", "Laptop é", 8), 3) == ["name", "Laptop é", 8]
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    "%%%",
+    base64.urlsafe_b64encode(b"{not json").decode(),
+    base64.urlsafe_b64encode("ÿ".encode("latin-1")).decode(),
+])
+def test_undecodable_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, 2)
+
+
+@pytest.mark.parametrize("payload", [b'{"a": 1}', b'"2024-01-01"', b"[1]", b"[1, 2, 3]"])
+def test_cursor_with_the_wrong_shape(payload):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(base64.urlsafe_b64encode(payload).decode().rstrip("="), 2)
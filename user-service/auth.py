@@ -7,7 +7,17 @@ SECRET_KEY = os.getenv("SECRET_KEY", "mysecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt_sha256"], deprecated="auto")
+# bcrypt work factor (log2 rounds). Hashes made with any other cost are
+# flagged for update and transparently rehashed on the next good login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt_sha256"],
+    deprecated="auto",
+    bcrypt_sha256__default_rounds=BCRYPT_ROUNDS,
+    bcrypt_sha256__min_rounds=BCRYPT_ROUNDS,
+    bcrypt_sha256__max_rounds=BCRYPT_ROUNDS
+)
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -15,6 +25,10 @@ def hash_password(password: str) -> str:
 def verify_password(plane_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plane_password, hashed_password)
 
+def verify_and_update_password(plane_password: str, hashed_password: str):
+    """Verify a password, returns (valid, new_hash) where new_hash is set when the stored hash needs upgrading"""
+    return pwd_context.verify_and_update(plane_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
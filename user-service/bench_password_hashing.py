@@ -0,0 +1,61 @@
+"""Benchmark: login verifications/sec by number of hashing worker processes.
+
+Verifies BENCH_LOGINS passwords concurrently through the PasswordHasher for
+1, 2, 4 ... up to the core count workers, next to the inline (GIL holding)
+baseline the service used before.
+
+Run from the user-service directory:
+
+    BCRYPT_ROUNDS=12 python bench_password_hashing.py
+"""
+import asyncio
+import os
+import time
+
+import auth
+from password_hasher import PasswordHasher
+
+BENCH_LOGINS = int(os.getenv("BENCH_LOGINS", "64"))
+
+
+def worker_counts():
+    cores = os.cpu_count() or 1
+    counts, workers = [], 1
+    while workers < cores:
+        counts.append(workers)
+        workers *= 2
+    counts.append(cores)
+    return counts
+
+
+async def run_pool(workers: int, hashed: str) -> float:
+    hasher = PasswordHasher(workers=workers, max_pending=BENCH_LOGINS)
+    hasher.start()
+    # Warm the worker processes up so start-up cost isn't measured
+    await asyncio.gather(*[hasher.verify_and_update("password", hashed) for _ in range(workers)])
+
+    started = time.perf_counter()
+    await asyncio.gather(*[hasher.verify_and_update("password", hashed) for _ in range(BENCH_LOGINS)])
+    elapsed = time.perf_counter() - started
+    hasher.shutdown()
+    return BENCH_LOGINS / elapsed
+
+
+def run_inline(hashed: str) -> float:
+    started = time.perf_counter()
+    for _ in range(BENCH_LOGINS):
+        auth.verify_password("password", hashed)
+    return BENCH_LOGINS / (time.perf_counter() - started)
+
+
+async def main():
+    hashed = auth.hash_password("password")
+    print(f"bcrypt rounds {auth.BCRYPT_ROUNDS}, {BENCH_LOGINS} logins, {os.cpu_count()} cores")
+    print(f"{'workers':>8} {'logins/s':>9}")
+    print(f"{'inline':>8} {run_inline(hashed):>9.1f}")
+    for workers in worker_counts():
+        print(f"{workers:>8} {await run_pool(workers, hashed):>9.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
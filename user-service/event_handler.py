@@ -1,25 +1,29 @@
 import os
+from sqlmodel.ext.asyncio.session import AsyncSession
 from shared.kafka_client import KafkaClient
+from shared.outbox import add_outbox_event
 
 class EventHandler:
     def __init__(self):
         self.kafka_client = KafkaClient(
-            bootstrap_servers=os.getenv("KAFKA_BROKER", "logalhost:9092")
+            bootstrap_servers=os.getenv("KAFKA_BROKER", "logalhost:9092"),
+            producer_name="user-service"
         )
 
-    async def send_user_created(self, user_data: dict):
-        """Send user created event"""
-        await self.kafka_client.start()
-        await self.kafka_client.send_event(
+    def user_created(self, session: AsyncSession, user_data: dict):
+        """Queue user created event, published by the outbox relay once the session commits"""
+        add_outbox_event(
+            session,
             topic="users",
-            event_type="user.created",
-            data=user_data
+            event=self.kafka_client.build_event("user.created", user_data),
+            key=str(user_data["user_id"])
         )
 
-    async def send_user_updated(self, user_data: dict):
-        """Send user updated event"""
-        await self.kafka_client.send_event(
+    def user_updated(self, session: AsyncSession, user_data: dict):
+        """Queue user updated event, published by the outbox relay once the session commits"""
+        add_outbox_event(
+            session,
             topic="users",
-            event_type="user.updated",
-            data=user_data
-        )
\ No newline at end of file
+            event=self.kafka_client.build_event("user.updated", user_data),
+            key=str(user_data["user_id"])
+        )
@@ -1,15 +1,21 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from sqlmodel import Session, select
-from typing import List
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import List, Optional
+from datetime import datetime
 import logging
 import asyncio
 
-from models import User, UserCreate, UserRead, UserUpdate
-from database import engine, create_db_and_tables, get_session
-from auth import hash_password, verify_password, create_access_token
+from models import User, UserCreate, UserRead, UserUpdate, UserExport
+from database import engine, async_session_maker, create_db_and_tables, get_session, get_async_session
+from auth import create_access_token
+from password_hasher import PasswordHasher, HashingOverloaded
 from init_data import init_data 
 from event_handler import EventHandler
+from shared.export import export_response
+from shared.outbox import OutboxRelay
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -19,6 +25,12 @@ app = FastAPI(title="User Service", description="User Service for ML Powered E-c
 
 event_handler = EventHandler()
 
+# Publishes the events committed to the outbox table
+outbox_relay = OutboxRelay(event_handler.kafka_client, async_session_maker)
+
+# bcrypt runs in a process pool so it can't starve the event loop
+password_hasher = PasswordHasher()
+
 #CORS Middleware
 app.add_middleware(
     CORSMiddleware,
@@ -36,6 +48,28 @@ def on_startup():
     init_data() # Initialize default data
     logger.info("Database tables created")
 
+    password_hasher.start()
+    outbox_relay.start()
+
+
+# Shutdown event
+@app.on_event("shutdown")
+async def on_shutdown():
+    password_hasher.shutdown()
+    await outbox_relay.stop()
+    # Flush events still sitting in the producer batches
+    await event_handler.kafka_client.stop()
+
+
+# Shed load when the hashing queue is full instead of queuing forever
+@app.exception_handler(HashingOverloaded)
+async def hashing_overloaded_handler(request: Request, exc: HashingOverloaded):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many login requests, retry later"},
+        headers={"Retry-After": "1"}
+    )
+
 
 # Health Check
 @app.get("/health", tags=["Health"])
@@ -43,23 +77,42 @@ def health_check():
     return {"status": "ok", "service": "user-service"}
 
 
+@app.get("/metrics")
+def metrics():
+    return {
+        "password_hasher": password_hasher.stats(),
+        "kafka_producer": event_handler.kafka_client.stats(),
+        "outbox_relay": outbox_relay.stats(),
+    }
+
+
 # Login user
 @app.post("/login")
-def login(email: str, password: str, session: Session = Depends(get_session)):
+async def login(email: str, password: str, session: AsyncSession = Depends(get_async_session)):
 
     # Find user by email
-    user = session.exec(
+    user = (await session.exec(
         select(User).where(User.email == email)
-    ).first()
+    )).first()
+
+    valid, new_hash = (False, None)
+    if user:
+        valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
 
-    if not user or not verify_password(password, user.hashed_password):
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
+
+    # Stored hash uses an old work factor, upgrade it while we have the password
+    if new_hash:
+        user.hashed_password = new_hash
+        session.add(user)
+        await session.commit()
     
-    # Create JWT token
-    access_token = create_access_token(data={"sub": user.email})
+    # Create JWT token, the gateway verifies it locally with the shared key
+    access_token = create_access_token(data={"sub": user.email, "uid": user.id})
 
     return {
         "access_token": access_token, 
@@ -68,42 +121,53 @@ def login(email: str, password: str, session: Session = Depends(get_session)):
     }
 
 
+def user_event_data(user: User) -> dict:
+    """Event payload for a user row"""
+    return {
+        "user_id": user.id,
+        "email": user.email,
+        "full_name": user.full_name
+    }
+
+
 # Create User
 @app.post("/user-create", response_model=UserRead, status_code=status.HTTP_201_CREATED)
-def create_user(user_create: UserCreate, session: Session = Depends(get_session)):
+async def create_user(user_create: UserCreate, session: AsyncSession = Depends(get_async_session)):
 
-    existing_user = session.exec(
+    existing_user = (await session.exec(
         select(User).where(User.email == user_create.email)
-    ).first()
+    )).first()
 
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, 
             detail="Email already registered"
         )
-    hashed_pwd = hash_password(user_create.password)
+    hashed_pwd = await password_hasher.hash(user_create.password)
     db_user = User(
         email=user_create.email,
         full_name=user_create.full_name,
         hashed_password=hashed_pwd
     )
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    # Flush for the id, the event is committed together with the user
+    await session.flush()
+    event_handler.user_created(session, user_event_data(db_user))
+    await session.commit()
+    await session.refresh(db_user)
+    outbox_relay.notify()
 
     logger.info(f"User created with email: {db_user.email}")
 
-    user_data = {
-        "user_id": db_user.id,
-        "email": db_user.email,
-        "full_name": user_data.full_name
-    }
-
-    asyncio.create_task(event_handler.send_user_created(user_data))
-
     return db_user
 
     
+# Stream all users as NDJSON for the ML feature jobs
+@app.get("/users/export")
+def export_users(updated_since: Optional[datetime] = None):
+    return export_response(engine, User, UserExport, updated_since)
+
+
 # Get user by ID
 @app.get("/users/{user_id}", response_model=UserRead)
 def get_user(user_id: int, session: Session = Depends(get_session)):
@@ -124,8 +188,8 @@ def get_users(session: Session = Depends(get_session)):
 
 # Update user
 @app.patch("/users/{user_id}", response_model=UserRead)
-def update_user(user_id: int, user_update: UserUpdate, session: Session = Depends(get_session)):
-    db_user = session.get(User, user_id)
+async def update_user(user_id: int, user_update: UserUpdate, session: AsyncSession = Depends(get_async_session)):
+    db_user = await session.get(User, user_id)
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
@@ -133,15 +197,17 @@ def update_user(user_id: int, user_update: UserUpdate, session: Session = Depend
         )
     user_update = user_update.dict(exclude_unset=True)
     if "password" in user_update:
-        user_update["hashed_password"] = hash_password(user_update.pop("password"))
+        user_update["hashed_password"] = await password_hasher.hash(user_update.pop("password"))
 
     for key, value in user_update.items():
         setattr(db_user, key, value)
 
-    db_user.update_at = datetime.utcnow()
+    db_user.updated_at = datetime.utcnow()
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    event_handler.user_updated(session, user_event_data(db_user))
+    await session.commit()
+    await session.refresh(db_user)
+    outbox_relay.notify()
 
     return db_user 
     
@@ -12,7 +12,7 @@ class User(UserBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     hashed_password: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow, index=True)
 
 class UserCreate(UserBase):
     email: EmailStr
@@ -24,6 +24,10 @@ class UserRead(UserBase):
     id: int
     created_at: datetime
 
+# Bulk export row, carries updated_at so incremental pulls can move their watermark
+class UserExport(UserRead):
+    updated_at: datetime
+
 class UserUpdate(SQLModel):
     email: Optional[EmailStr] = None
     full_name: Optional[str] = None
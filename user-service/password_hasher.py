@@ -0,0 +1,89 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+import asyncio
+import logging
+import os
+
+import auth
+
+logger = logging.getLogger(__name__)
+
+# One worker per core by default, bcrypt is pure CPU
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Hash/verify jobs allowed to wait for a worker before we start shedding load
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 4)))
+
+
+class HashingOverloaded(Exception):
+    """Raised when the hashing queue is full, the caller should answer 503."""
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt hashing/verification in a dedicated process pool.
+
+    bcrypt holds the GIL for tens of milliseconds per call, inline it starves
+    every other request on the worker. Here it runs in other processes and
+    at most `max_pending` jobs are admitted, anything above is rejected
+    straight away instead of queuing forever.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        logger.info(f"Password hasher started with {self.workers} workers (max pending {self.max_pending})")
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HashingOverloaded("Password hashing queue is full")
+        if self.executor is None:
+            self.start()
+
+        self.pending += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        except BaseException:
+            # Errors, a broken pool and cancelled requests alike
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(auth.hash_password, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        valid, new_hash = await self._run(auth.verify_and_update_password, password, hashed_password)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "bcrypt_rounds": auth.BCRYPT_ROUNDS,
+        }